@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+bulk_delete benchmark compares the deletion of many ports one at a time (delete and GET until it is gone) with
+OpenStackClients.bulk_delete (concurrent deletes, batched status checks with backoff).
+No OpenStack deployment is needed: the ports are kept by a local stand-in of the neutron API, with a fixed latency
+per request and an asynchronous deletion (the port disappears some time after the delete request).
+Some ids do not exist, to check that 404 counts as deleted.
+
+Usage (from the repository root):
+    python benchmarks/bulk_delete.py [--resources N] [--latency SECONDS] [--delete-delay SECONDS]
+                                     [--concurrency N] [--json FILE]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qautils.openstack.osclients import OpenStackClients
+
+
+DEFAULT_RESOURCES = 100
+DEFAULT_LATENCY = 0.01
+DEFAULT_DELETE_DELAY = 0.5
+DEFAULT_CONCURRENCY = 16
+MISSING_RESOURCES_RATIO = 0.05
+
+
+class _NotFound(Exception):
+    status_code = 404
+
+
+class _StandInNeutron(object):
+    """
+    Neutron client stand-in: ports in memory, a latency per request and asynchronous deletions
+    """
+
+    def __init__(self, resources, latency, delete_delay):
+        self.latency = latency
+        self.delete_delay = delete_delay
+        self.ports = dict(("port-{}".format(index), None) for index in xrange(resources))
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            for port_id, deleted_time in self.ports.items():
+                if deleted_time is not None and now - deleted_time >= self.delete_delay:
+                    del self.ports[port_id]
+
+    def delete_port(self, port_id):
+        self._request()
+        with self._lock:
+            if port_id not in self.ports:
+                raise _NotFound("Port {} could not be found".format(port_id))
+            if self.ports[port_id] is None:
+                self.ports[port_id] = time.time()
+
+    def show_port(self, port_id):
+        self._request()
+        with self._lock:
+            if port_id not in self.ports:
+                raise _NotFound("Port {} could not be found".format(port_id))
+            return {'port': {'id': port_id, 'status': 'ACTIVE'}}
+
+    def list_ports(self, id=None, **kwargs):
+        self._request()
+        with self._lock:
+            port_ids = self.ports.keys() if id is None else [port_id for port_id in id if port_id in self.ports]
+            return {'ports': [{'id': port_id, 'status': 'ACTIVE'} for port_id in port_ids]}
+
+
+class _StandInClients(OpenStackClients):
+
+    def __init__(self, neutron):
+        OpenStackClients.__init__(self, auth_url="http://keystone.example.com:5000/v3")
+        self.neutron = neutron
+
+    def get_neutronclient(self):
+        return self.neutron
+
+
+def _get_ids(resources):
+    missing = int(resources * MISSING_RESOURCES_RATIO)
+    return ["port-{}".format(index) for index in xrange(resources)] + \
+        ["missing-{}".format(index) for index in xrange(missing)]
+
+
+def benchmark_one_by_one(resources, latency, delete_delay, poll_interval=0.1):
+    """
+    Delete the ports one at a time, polling each one until it is gone
+    :return (dict): elapsed (seconds), requests, deleted
+    """
+
+    neutron = _StandInNeutron(resources, latency, delete_delay)
+    start = time.time()
+    deleted = 0
+    for port_id in _get_ids(resources):
+        try:
+            neutron.delete_port(port_id)
+            while True:
+                neutron.show_port(port_id)
+                time.sleep(poll_interval)
+        except _NotFound:
+            deleted += 1
+    return {'elapsed': time.time() - start, 'requests': neutron.requests, 'deleted': deleted}
+
+
+def benchmark_bulk(resources, latency, delete_delay, concurrency, poll_interval=0.1):
+    """
+    Delete the ports with OpenStackClients.bulk_delete
+    :return (dict): elapsed (seconds), requests, deleted and the bulk_delete summary
+    """
+
+    neutron = _StandInNeutron(resources, latency, delete_delay)
+    clients = _StandInClients(neutron)
+    start = time.time()
+    summary = clients.bulk_delete('ports', _get_ids(resources), concurrency=concurrency, poll_interval=poll_interval)
+    return {'elapsed': time.time() - start, 'requests': neutron.requests,
+            'deleted': len(summary['deleted']) + len(summary['already_deleted']), 'summary': summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare one-by-one and bulk deletion of OpenStack resources")
+    parser.add_argument('--resources', type=int, default=DEFAULT_RESOURCES, help="Number of ports")
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="Latency of each request (seconds)")
+    parser.add_argument('--delete-delay', type=float, default=DEFAULT_DELETE_DELAY,
+                        help="Time until a deleted port disappears (seconds)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Concurrent deletes")
+    parser.add_argument('--json', dest='json_file', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {'one_by_one': benchmark_one_by_one(args.resources, args.latency, args.delete_delay),
+               'bulk': benchmark_bulk(args.resources, args.latency, args.delete_delay, args.concurrency)}
+    print "{:<12} {:>10} {:>10} {:>10}".format("MODE", "TIME(s)", "REQUESTS", "DELETED")
+    for mode in ("one_by_one", "bulk"):
+        result = results[mode]
+        print "{:<12} {:>10.2f} {:>10} {:>10}".format(mode, result['elapsed'], result['requests'], result['deleted'])
+    summary = results['bulk']['summary']
+    print "bulk: {} already deleted, {} failed, {} timed out, {} status requests, {:.1f} deleted/s".format(
+        len(summary['already_deleted']), len(summary['failed']), len(summary['timed_out']),
+        summary['status_requests'], summary['deleted_per_second'])
+
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+client_acquisition benchmark measures the time to get the OpenStack clients from OpenStackClients, building them
+on every call (client cache cleared) and reusing them (client cache), while looping over several regions.
+No OpenStack deployment is needed: the session is a local stand-in with a static token and catalog.
+Services whose client library is not installed are reported as skipped.
+
+Usage (from the repository root):
+    python benchmarks/client_acquisition.py [--iterations N] [--regions N] [--json FILE] [service ...]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qautils.openstack.osclients import OpenStackClients
+
+
+DEFAULT_SERVICES = ["nova", "neutron", "cinder", "glance", "swift", "keystone"]
+DEFAULT_ITERATIONS = 200
+DEFAULT_REGIONS = 5
+
+_SERVICE_TYPES = {"nova": "compute", "neutron": "network", "cinder": "volumev2", "glance": "image",
+                  "swift": "object-store", "keystone": "identity"}
+
+
+class _StaticAccess(dict):
+
+    def __init__(self, token, catalog):
+        super(_StaticAccess, self).__init__(catalog=catalog)
+        self.auth_token = token
+
+
+class _StaticAuth(object):
+
+    def __init__(self, access):
+        self.access = access
+
+    def get_access(self, session):
+        return self.access
+
+
+class _StaticSession(object):
+    """
+    Session stand-in: static token and catalog, no requests
+    """
+
+    def __init__(self, regions):
+        catalog = list()
+        for service_type in _SERVICE_TYPES.values():
+            endpoints = [{'id': "{}-{}-{}".format(service_type, region, interface), 'region': region,
+                          'region_id': region, 'interface': interface,
+                          'url': "http://{}.{}.example.com:8080/v2".format(service_type, region)}
+                         for region in regions for interface in ("public", "internal", "admin")]
+            catalog.append({'type': service_type, 'name': service_type, 'endpoints': endpoints})
+        self.auth = _StaticAuth(_StaticAccess("0123456789abcdef", catalog))
+
+    def get_token(self, *args, **kwargs):
+        return self.auth.access.auth_token
+
+    def get_endpoint(self, service_type=None, region_name=None, interface="public", **kwargs):
+        for service in self.auth.access['catalog']:
+            if service['type'] == service_type:
+                for endpoint in service['endpoints']:
+                    if endpoint['interface'] == interface and region_name in (None, endpoint['region']):
+                        return endpoint['url']
+
+    def get_project_id(self):
+        return "project"
+
+    def request(self, *args, **kwargs):
+        raise RuntimeError("The benchmark session does not send requests")
+
+    def invalidate(self):
+        pass
+
+
+def _get_client_method(clients, service):
+    return getattr(clients, "get_keystoneclientv3" if service == "keystone" else "get_{}client".format(service))
+
+
+def benchmark_service(service, iterations, regions):
+    """
+    Time the acquisition of the service client, looping over the regions
+    :param service (string): Service name (see DEFAULT_SERVICES)
+    :param iterations (int): Number of calls for each mode
+    :param regions (list): Region names
+    :return (dict): service, uncached_us and cached_us (mean time per call), speedup, error
+    """
+
+    clients = OpenStackClients(auth_url="http://keystone.example.com:5000/v3")
+    clients._session_v3 = _StaticSession(regions)
+    clients.set_region(regions[0])
+    get_client = _get_client_method(clients, service)
+    result = {'service': service, 'uncached_us': None, 'cached_us': None, 'speedup': None, 'error': None}
+    try:
+        get_client()
+    except ImportError, e:
+        result['error'] = "skipped ({})".format(e)
+        return result
+
+    for mode in ("uncached", "cached"):
+        clients.clear_client_cache()
+        start = time.time()
+        for iteration in xrange(iterations):
+            clients.set_region(regions[iteration % len(regions)])
+            if mode == "uncached":
+                clients.clear_client_cache()
+            get_client()
+        result[mode + '_us'] = (time.time() - start) / iterations * 1e6
+    result['speedup'] = result['uncached_us'] / result['cached_us'] if result['cached_us'] else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the acquisition time of OpenStack clients")
+    parser.add_argument('services', nargs='*', default=DEFAULT_SERVICES, help="Services to measure")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help="Calls for each mode")
+    parser.add_argument('--regions', type=int, default=DEFAULT_REGIONS, help="Number of regions to loop over")
+    parser.add_argument('--json', dest='json_file', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    regions = ["Region{}".format(index) for index in range(args.regions)]
+    results = [benchmark_service(service, args.iterations, regions) for service in args.services]
+    print "{:<10} {:>14} {:>14} {:>10}".format("SERVICE", "UNCACHED(us)", "CACHED(us)", "SPEEDUP")
+    for result in results:
+        if result['error']:
+            print "{:<10} {}".format(result['service'], result['error'])
+        else:
+            print "{:<10} {:>14.1f} {:>14.1f} {:>9.1f}x".format(result['service'], result['uncached_us'],
+                                                               result['cached_us'], result['speedup'])
+
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
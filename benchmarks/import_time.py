@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+import_time benchmark measures the import time of the qautils modules, in a new interpreter for each run
+(like short-lived CLI runs and per-test subprocesses). For each module it reports the best and median import time
+and, with --tree, an '-X importtime'-like breakdown (self and cumulative time of each nested import) of the best run.
+
+Usage (from the repository root):
+    python benchmarks/import_time.py [--repeat N] [--tree] [--json FILE] [module ...]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+
+DEFAULT_MODULES = ["qautils.logger.logger_utils",
+                   "qautils.configuration.configuration_utils",
+                   "qautils.commandline.commandline_utils",
+                   "qautils.dataset.dataset_utils",
+                   "qautils.dataset.data_generator_utils",
+                   "qautils.http.headers_utils",
+                   "qautils.http.body_model_utils",
+                   "qautils.http.rest_client_utils",
+                   "qautils.remote.fabric_utils",
+                   "qautils.remote.remote_tail_utils",
+                   "qautils.openstack.osclients"]
+
+DEFAULT_REPEAT = 5
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _child_import(module_name):
+    """
+    Import the module timing every nested import that loads new modules, and print the result as JSON.
+    Executed in a new interpreter (see _run_child).
+    :param module_name (string): Module to import
+    :return: None
+    """
+
+    import __builtin__
+    original_import = __builtin__.__import__
+    stack = list()
+    imports = list()
+
+    def _timed_import(name, *args, **kwargs):
+        modules_before = len(sys.modules)
+        already_loaded = sys.modules.get(name) is not None
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children_time = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if not already_loaded and len(sys.modules) != modules_before:
+                imports.append({'name': name, 'depth': len(stack),
+                                'self_us': int((elapsed - children_time) * 1e6), 'cumulative_us': int(elapsed * 1e6)})
+
+    __builtin__.__import__ = _timed_import
+    start = time.time()
+    error = None
+    try:
+        __import__(module_name)
+    except Exception, e:
+        error = repr(e)
+    total = time.time() - start
+    __builtin__.__import__ = original_import
+
+    print json.dumps({'module': module_name, 'total_us': int(total * 1e6), 'imports': imports, 'error': error})
+
+
+def _run_child(module_name):
+    """
+    Run _child_import in a new interpreter
+    :param module_name (string): Module to import
+    :return (dict): Child result
+    """
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [REPOSITORY_ROOT, environment.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', module_name],
+                                     env=environment)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark_imports(modules, repeat=DEFAULT_REPEAT):
+    """
+    Measure the import time of each module, importing it 'repeat' times (one new interpreter per import)
+    :param modules (list): Module names
+    :param repeat (int): Number of runs for each module
+    :return (list): One dict per module: module, best_ms, median_ms, error and imports (breakdown of the best run)
+    """
+
+    results = list()
+    for module_name in modules:
+        runs = sorted([_run_child(module_name) for _ in xrange(repeat)], key=lambda run: run['total_us'])
+        results.append({'module': module_name,
+                        'best_ms': runs[0]['total_us'] / 1000.0,
+                        'median_ms': runs[len(runs) // 2]['total_us'] / 1000.0,
+                        'error': runs[0]['error'],
+                        'imports': runs[0]['imports']})
+    return results
+
+
+def _print_tree(result):
+    """
+    Print the breakdown of an import like '-X importtime' does
+    :param result (dict): Result of a module (see benchmark_imports)
+    :return: None
+    """
+
+    print "import time: self [us] | cumulative | imported package"
+    for record in result['imports']:
+        print "import time: {:>9} | {:>10} | {}{}".format(record['self_us'], record['cumulative_us'],
+                                                          "  " * record['depth'], record['name'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of qautils modules")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Runs for each module")
+    parser.add_argument('--tree', action='store_true', help="Print the nested imports of the best run")
+    parser.add_argument('--json', dest='json_file', help="Write the results to this JSON file")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child_import(args.child)
+        return
+
+    results = benchmark_imports(args.modules, args.repeat)
+    print "{:<45} {:>10} {:>10}".format("MODULE", "BEST(ms)", "MEDIAN(ms)")
+    for result in results:
+        print "{:<45} {:>10.2f} {:>10.2f}{}".format(result['module'], result['best_ms'], result['median_ms'],
+                                                    "  ERROR: " + result['error'] if result['error'] else "")
+        if args.tree:
+            _print_tree(result)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
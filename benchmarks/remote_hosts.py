@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+remote_hosts benchmark runs FabricUtils.execute_command_in_hosts against local SSH stand-ins (paramiko servers, in
+a child process, that run the commands locally), serially (pool size 1) and in parallel, and checks the result of each host:
+    - the hosts that run the command return its output and exit code 0;
+    - a host where the command fails returns its exit code;
+    - a host where the command takes longer than the timeout returns an error;
+    - an unreachable host (closed port) returns an error and does not stop the other hosts.
+It also checks FabricUtils.execute_command called on an instance and on the class (former staticmethod, deprecated:
+it runs with the Fabric global 'env' and emits a DeprecationWarning).
+No SSH server is needed.
+
+Usage (from the repository root):
+    python benchmarks/remote_hosts.py [--hosts N] [--command-time SECONDS] [--pool-size N] [--json FILE]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import sys
+import json
+import time
+import socket
+import select
+import shutil
+import signal
+import argparse
+import tempfile
+import warnings
+import threading
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paramiko
+from fabric.api import settings
+
+from qautils.remote.fabric_utils import FabricUtils
+
+
+DEFAULT_HOSTS = 8
+DEFAULT_COMMAND_TIME = 0.5
+DEFAULT_POOL_SIZE = 8
+
+USERNAME = "qa"
+PASSWORD = "secret"
+
+# Exit code of the stand-in host where the command fails, and duration (seconds) of the one where it times out
+FAILING_HOST_EXIT_CODE = 7
+SLOW_HOST_TIME = 30
+
+
+class _StandInSSHServer(paramiko.ServerInterface):
+    """
+    SSH server stand-in: password authentication, PTY and exec requests. Commands are run locally with /bin/sh,
+    with an empty home directory (as a clean host: the login shell does not load the local user profile).
+    """
+
+    def __init__(self, command_prefix, home):
+        self.command_prefix = command_prefix
+        self.home = home
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if (username, password) == (USERNAME, PASSWORD) else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        thread = threading.Thread(target=_run_channel_command, args=[channel, self.command_prefix + command,
+                                                                          self.home])
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+def _run_channel_command(channel, command, home):
+    """
+    Run the command and send its output and exit status through the channel
+    """
+
+    process = subprocess.Popen(['/bin/sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               env=dict(os.environ, HOME=home), cwd=home, preexec_fn=os.setsid)
+    output_fd = process.stdout.fileno()
+    while True:
+        readable = select.select([output_fd], [], [], 0.1)[0]
+        if channel.closed:
+            # Closed by the client (e.g. command timeout): kill the whole command, not only the shell
+            os.killpg(process.pid, signal.SIGKILL)
+            break
+        if readable:
+            data = os.read(output_fd, 32768)
+            if not data:
+                break
+            channel.sendall(data)
+    process.wait()
+    try:
+        # Killed by a signal: exit status of the shell (128 + signal)
+        channel.send_exit_status(process.returncode if process.returncode >= 0 else 128 - process.returncode)
+        channel.close()
+    except (EOFError, socket.error):
+        pass
+
+
+def _start_stand_in_host(home, command_prefix=""):
+    """
+    Start an in-process SSH server in 127.0.0.1
+    :param home (string): Home directory of the commands
+    :param command_prefix (string): Shell code run before each command (e.g. to make it fail or slow)
+    :return (int): Port
+    """
+
+    host_key = paramiko.RSAKey.generate(1024)
+    server_socket = socket.socket()
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(("127.0.0.1", 0))
+    server_socket.listen(50)
+
+    def _start_transport(connection):
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(host_key)
+        try:
+            transport.start_server(server=_StandInSSHServer(command_prefix, home))
+        except (paramiko.SSHException, EOFError, socket.error):
+            # Client gone before the negotiation
+            transport.close()
+
+    def _serve():
+        while True:
+            connection = server_socket.accept()[0]
+            connection_thread = threading.Thread(target=_start_transport, args=[connection])
+            connection_thread.daemon = True
+            connection_thread.start()
+
+    thread = threading.Thread(target=_serve, name="StandInSSH")
+    thread.daemon = True
+    thread.start()
+    return server_socket.getsockname()[1]
+
+
+def _serve_stand_in_hosts(home, command_prefixes, ports_queue):
+    """
+    Process of the stand-in hosts. They do not run in the benchmark process: Fabric parallel mode forks it, and the
+    children could inherit locks held by the server threads.
+    :param home (string): Home directory of the commands
+    :param command_prefixes (list): Command prefix of each host (see _start_stand_in_host)
+    :param ports_queue: multiprocessing.Queue where the ports of the hosts are put
+    :return: None
+    """
+
+    try:
+        # paramiko with PyCrypto: the RNG must be re-initialized in the forked process
+        from Crypto import Random
+        Random.atfork()
+    except ImportError:
+        pass
+    ports_queue.put([_start_stand_in_host(home, command_prefix) for command_prefix in command_prefixes])
+    while True:
+        time.sleep(60)
+
+
+def _get_closed_port():
+    """
+    :return (int): Local port with nothing listening
+    """
+
+    closed_socket = socket.socket()
+    closed_socket.bind(("127.0.0.1", 0))
+    port = closed_socket.getsockname()[1]
+    closed_socket.close()
+    return port
+
+
+def _host_string(port):
+    return "{}@127.0.0.1:{}".format(USERNAME, port)
+
+
+def check_results(results, hosts, failing_host, slow_host, unreachable_host, command_time):
+    """
+    :return (list): Problems found in the results of execute_command_in_hosts
+    """
+
+    problems = list()
+    for host in hosts:
+        result = results.get(host)
+        if result is None:
+            problems.append("{}: no result".format(host))
+        elif host == failing_host:
+            if result['exit_code'] != FAILING_HOST_EXIT_CODE:
+                problems.append("{}: exit code {} (expected {})".format(host, result['exit_code'],
+                                                                        FAILING_HOST_EXIT_CODE))
+        elif host in (slow_host, unreachable_host):
+            if result['error'] is None:
+                problems.append("{}: no error (exit code {})".format(host, result['exit_code']))
+        elif result['exit_code'] != 0 or "done {}".format(command_time) not in (result['stdout'] or ""):
+            problems.append("{}: exit code {}, error {}, stdout {!r}".format(host, result['exit_code'],
+                                                                            result['error'], result['stdout']))
+    return problems
+
+
+def benchmark_hosts(fabric_utils, hosts, command, timeout, pool_size):
+    """
+    :return (tuple): (elapsed seconds, results of execute_command_in_hosts)
+    """
+
+    start = time.time()
+    results = fabric_utils.execute_command_in_hosts(command, hosts, pool_size=pool_size, timeout=timeout)
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run FabricUtils.execute_command_in_hosts against local SSH "
+                                                 "stand-ins")
+    parser.add_argument('--hosts', type=int, default=DEFAULT_HOSTS, help="Number of working hosts")
+    parser.add_argument('--command-time', type=float, default=DEFAULT_COMMAND_TIME,
+                        help="Duration of the command (seconds)")
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help="Pool size of the parallel run")
+    parser.add_argument('--json', dest='json_file', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="qa_remote_hosts_")
+    command_prefixes = ["exit {}; ".format(FAILING_HOST_EXIT_CODE), "sleep {}; ".format(SLOW_HOST_TIME)] + \
+        [""] * args.hosts
+    ports_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(target=_serve_stand_in_hosts, args=[home, command_prefixes, ports_queue])
+    server_process.daemon = True
+    server_process.start()
+    try:
+        ports = ports_queue.get(timeout=60)
+        return _run(args, [_host_string(port) for port in ports[2:]], _host_string(ports[0]), _host_string(ports[1]))
+    finally:
+        server_process.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def _run(args, working_hosts, failing_host, slow_host):
+    unreachable_host = _host_string(_get_closed_port())
+    hosts = working_hosts + [failing_host, slow_host, unreachable_host]
+    command = "sleep {time}; echo done {time}".format(time=args.command_time)
+    timeout = max(2, int(args.command_time * 4))
+
+    fabric_utils = FabricUtils(working_hosts[0], USERNAME, PASSWORD)
+    problems = list()
+    results = dict()
+    print "{:<10} {:>6} {:>8} {:>8} {:>8}".format("MODE", "HOSTS", "TIME(s)", "OK", "FAILED")
+    for mode, pool_size in (("serial", 1), ("parallel", args.pool_size)):
+        elapsed, host_results = benchmark_hosts(fabric_utils, hosts, command, timeout, pool_size)
+        ok_hosts = len([result for result in host_results.itervalues() if result and result['exit_code'] == 0])
+        print "{:<10} {:>6} {:>8.2f} {:>8} {:>8}".format(mode, len(hosts), elapsed, ok_hosts, len(hosts) - ok_hosts)
+        results[mode] = {'elapsed': elapsed, 'hosts': host_results}
+        problems.extend("{} {}".format(mode, problem) for problem in
+                        check_results(host_results, hosts, failing_host, slow_host, unreachable_host,
+                                      args.command_time))
+
+    output = fabric_utils.execute_command("echo instance")
+    if output is None or output.strip() != "instance":
+        problems.append("execute_command on the instance: {!r}".format(output))
+
+    with settings(host_string=working_hosts[-1], user=USERNAME, password=PASSWORD), \
+            warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter("always")
+        output = FabricUtils.execute_command("echo class")
+    if output is None or output.strip() != "class":
+        problems.append("execute_command on the class: {!r}".format(output))
+    if not [warning for warning in caught_warnings if issubclass(warning.category, DeprecationWarning)]:
+        problems.append("execute_command on the class: no DeprecationWarning")
+
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+    for problem in problems:
+        print "FAILED: " + problem
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
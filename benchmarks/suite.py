@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+
+"""
+suite benchmark runs a benchmark of each qautils subsystem and tracks regressions between runs:
+    - rest_client: RestClient requests against a local HTTP server.
+    - body_model: response_body_to_dict / model_to_request_body on small, medium and huge JSON and XML bodies, and
+      delete_model_element_when_value_is_none on wide and deep trees.
+    - dataset: DatasetUtils.prepare_data on large tables.
+    - logging: Formatting of the request/response log messages and of plain log records.
+    - remote_tail: RemoteTail capture of a local file (a local 'tail' stands in for the SSH one).
+Cases whose dependencies are not installed (requests, xmltodict, xmldict) are recorded as skipped.
+
+The results are saved as JSON with the metadata of the machine. 'compare' flags as regressions the cases whose
+median time (or best time) grows more than the threshold between two runs, and the cases measured in the baseline
+that fail or are skipped in the new run (exit status 1 if there is any regression).
+
+Usage (from the repository root):
+    python benchmarks/suite.py list
+    python benchmarks/suite.py run [--filter REGEX] [--repeat N] [--min-time SECONDS] [--json FILE]
+    python benchmarks/suite.py compare BASELINE_JSON NEW_JSON [--threshold PERCENT] [--statistic median|best]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qautils.http.headers_utils import HEADER_CONTENT_TYPE, HEADER_ACCEPT, HEADER_REPRESENTATION_JSON, \
+    HEADER_REPRESENTATION_XML
+
+
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_THRESHOLD = 10.0
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Version of the format of the results files
+RESULTS_FORMAT_VERSION = 1
+
+# Number of items of the generated bodies
+BODY_SIZES = {'small': 10, 'medium': 1000, 'huge': 50000}
+
+_BENCHMARKS = list()
+
+
+def benchmark(name, min_time=True):
+    """
+    Register a benchmark case. The decorated function prepares the case and returns the function to time, or a
+    (function, setup) tuple: setup is called before each call (not timed) and its result is passed to the function.
+    :param name (string): Case name ('subsystem.case')
+    :param min_time (bool): Repeat the calls of each run until --min-time. False to time one call per run.
+    :return: Decorator
+    """
+
+    def _decorator(function):
+        _BENCHMARKS.append((name, function, min_time))
+        return function
+    return _decorator
+
+
+def _generate_model(items):
+    """
+    :param items (int): Number of elements
+    :return (dict): Body model {'servers': {'server': [...]}} with 'items' servers
+    """
+
+    return {'servers': {'server': [{'id': "server-{}".format(index), 'name': "name-{}".format(index),
+                                    'status': "ACTIVE", 'flavor': {'id': str(index % 5), 'ram': "2048"},
+                                    'metadata': {'owner': "qa", 'index': str(index)}}
+                                   for index in xrange(items)]}}
+
+
+def _generate_xml(items):
+    """
+    :param items (int): Number of elements
+    :return (string): XML body equivalent to _generate_model
+    """
+
+    servers = ''.join('<server id="server-{0}" name="name-{0}" status="ACTIVE"><flavor id="{1}" ram="2048"/>'
+                      '<metadata><owner>qa</owner><index>{0}</index></metadata></server>'.format(index, index % 5)
+                      for index in xrange(items))
+    return '<?xml version="1.0" encoding="UTF-8"?><servers>{}</servers>'.format(servers)
+
+
+class _StandInResponse(object):
+    """
+    'Requests' response stand-in, for the body and logging cases
+    """
+
+    def __init__(self, content, content_type, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {HEADER_CONTENT_TYPE: content_type}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _build_request_handler():
+    """
+    :return: Handler class of the local HTTP server. It replies a JSON body of the size given in the 'items' query
+    parameter.
+    """
+
+    bodies = dict()
+
+    class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+            items = int(query.get('items', ['1'])[0])
+            if items not in bodies:
+                bodies[items] = json.dumps(_generate_model(items))
+            body = bodies[items]
+            self.send_response(200)
+            self.send_header('Content-Type', HEADER_REPRESENTATION_JSON)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _reply
+        do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    return _RequestHandler
+
+
+def _start_http_server():
+    """
+    Start the local HTTP server in a daemon thread
+    :return: Server (its port is server.server_address[1])
+    """
+
+    class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = _Server(("127.0.0.1", 0), _build_request_handler())
+    server_thread = threading.Thread(target=server.serve_forever, name="benchmark-http-server")
+    server_thread.daemon = True
+    server_thread.start()
+    return server
+
+
+_http_server = None
+
+
+def _get_rest_client():
+    global _http_server
+    from qautils.http.rest_client_utils import RestClient, _get_requests_lib
+
+    _get_requests_lib()
+    if _http_server is None:
+        _http_server = _start_http_server()
+    return RestClient("http", "127.0.0.1", _http_server.server_address[1])
+
+
+@benchmark("rest_client.get_small")
+def _rest_client_get_small():
+    client = _get_rest_client()
+    return lambda: client.get("{api_root_url}/servers", parameters={'items': BODY_SIZES['small']})
+
+
+@benchmark("rest_client.get_medium")
+def _rest_client_get_medium():
+    client = _get_rest_client()
+    return lambda: client.get("{api_root_url}/servers", parameters={'items': BODY_SIZES['medium']})
+
+
+@benchmark("rest_client.post_medium")
+def _rest_client_post_medium():
+    client = _get_rest_client()
+    body = json.dumps(_generate_model(BODY_SIZES['medium']))
+    headers = {HEADER_CONTENT_TYPE: HEADER_REPRESENTATION_JSON}
+    return lambda: client.post("{api_root_url}/servers", body, headers)
+
+
+def _register_body_cases(size, items):
+    @benchmark("body_model.response_json_" + size)
+    def _response_json():
+        from qautils.http.body_model_utils import response_body_to_dict
+        response = _StandInResponse(json.dumps(_generate_model(items)), HEADER_REPRESENTATION_JSON)
+        return lambda: response_body_to_dict(response, HEADER_REPRESENTATION_JSON)
+
+    @benchmark("body_model.response_xml_" + size)
+    def _response_xml():
+        import xmltodict  # noqa (skip the case if it is not installed)
+        from qautils.http.body_model_utils import response_body_to_dict
+        response = _StandInResponse(_generate_xml(items), HEADER_REPRESENTATION_XML)
+        return lambda: response_body_to_dict(response, HEADER_REPRESENTATION_XML, "servers", is_list=True)
+
+    @benchmark("body_model.request_json_" + size)
+    def _request_json():
+        from qautils.http.body_model_utils import model_to_request_body
+        model = _generate_model(items)
+        return lambda: model_to_request_body(model, HEADER_REPRESENTATION_JSON, "servers")
+
+    @benchmark("body_model.request_xml_" + size)
+    def _request_xml():
+        import xmldict  # noqa (skip the case if it is not installed)
+        from qautils.http.body_model_utils import model_to_request_body
+        model = _generate_model(items)
+        return lambda: model_to_request_body(model, HEADER_REPRESENTATION_XML)
+
+
+for _size in ("small", "medium", "huge"):
+    _register_body_cases(_size, BODY_SIZES[_size])
+
+
+@benchmark("body_model.delete_none_wide")
+def _delete_none_wide():
+    from qautils.http.body_model_utils import delete_model_element_when_value_is_none
+    # 20000 keys, a third of them None, and empty containers (also deleted)
+    tree = json.dumps(dict(("key-{}".format(index), None if index % 3 == 0 else ([] if index % 3 == 1 else "value"))
+                           for index in xrange(20000)))
+    return delete_model_element_when_value_is_none, lambda: json.loads(tree)
+
+
+@benchmark("body_model.delete_none_deep")
+def _delete_none_deep():
+    from qautils.http.body_model_utils import delete_model_element_when_value_is_none
+    # 50 trees of depth 150, with None values and lists at every level
+    node = None
+    for level in xrange(150):
+        node = {'child': node, 'none': None, 'value': level, 'items': [{'a': None, 'b': level}]}
+    tree = json.dumps([node] * 50)
+    return delete_model_element_when_value_is_none, lambda: json.loads(tree)
+
+
+@benchmark("dataset.prepare_data_large_table")
+def _dataset_prepare_data():
+    from qautils.dataset.dataset_utils import DatasetUtils
+    values = ["[TRUE]", "[FALSE]", "[MISSING_PARAM]", "[STRING_WITH_LENGTH_20]", "42", "3.14", '{"a": 1}', "text"]
+    # 5000 rows of 10 columns
+    table = [dict(("column{}".format(column), values[(row + column) % len(values)]) for column in xrange(10))
+             for row in xrange(5000)]
+    dataset_utils = DatasetUtils()
+
+    def _prepare_table(rows):
+        for row in rows:
+            dataset_utils.prepare_data(row)
+    return _prepare_table, lambda: [dict(row) for row in table]
+
+
+def _get_debug_logger():
+    logger = logging.getLogger("qautils.benchmark")
+    if not logger.handlers:
+        handler = logging.StreamHandler(open(os.devnull, 'w'))
+        handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+    return logger
+
+
+@benchmark("logging.request_json_medium")
+def _logging_request_json():
+    from qautils.logger.logger_utils import log_print_request
+    logger = _get_debug_logger()
+    body = json.dumps(_generate_model(BODY_SIZES['medium']))
+    headers = {HEADER_CONTENT_TYPE: HEADER_REPRESENTATION_JSON, HEADER_ACCEPT: HEADER_REPRESENTATION_JSON}
+    return lambda: log_print_request(logger, "post", "http://127.0.0.1:8080/servers", {'items': 1}, headers, body)
+
+
+@benchmark("logging.request_xml_medium")
+def _logging_request_xml():
+    from qautils.logger.logger_utils import log_print_request
+    logger = _get_debug_logger()
+    body = _generate_xml(BODY_SIZES['medium'])
+    headers = {HEADER_CONTENT_TYPE: HEADER_REPRESENTATION_XML, HEADER_ACCEPT: HEADER_REPRESENTATION_XML}
+    return lambda: log_print_request(logger, "post", "http://127.0.0.1:8080/servers", {'items': 1}, headers, body)
+
+
+@benchmark("logging.response_json_medium")
+def _logging_response_json():
+    from qautils.logger.logger_utils import log_print_response
+    logger = _get_debug_logger()
+    response = _StandInResponse(json.dumps(_generate_model(BODY_SIZES['medium'])), HEADER_REPRESENTATION_JSON)
+    return lambda: log_print_response(logger, response)
+
+
+@benchmark("logging.records")
+def _logging_records():
+    logger = _get_debug_logger()
+
+    def _log_records():
+        for index in xrange(1000):
+            logger.info("Executing API request [%s %s]", "get", index)
+    return _log_records
+
+
+@benchmark("remote_tail.capture_local_file", min_time=False)
+def _remote_tail_capture():
+    from qautils.remote.remote_tail_utils import RemoteTail
+    from qautils.remote.tail_engine_utils import LocalTailStream, TailEngine
+    from qautils.remote.capture_writer_utils import CaptureWriter
+
+    class _LocalRemoteTail(RemoteTail):
+        """
+        RemoteTail reading a local file: a local 'tail' stands in for the SSH one
+        """
+
+        def init_tailer_connection(self):
+            self.tailer = LocalTailStream(self.remote_log_path + self.remote_log_file_name, from_start=True)
+            self.local_capture_path = self.local_log_target + self.remote_log_file_name
+            self.local_capture_file_descriptor = CaptureWriter(self.local_capture_path)
+
+    # 200000 lines of a service log
+    lines = 200000
+    work_dir = tempfile.mkdtemp(prefix="qautils-benchmark-")
+    with open(os.path.join(work_dir, "service.log"), 'w') as log_file:
+        for index in xrange(lines):
+            log_file.write("2015-06-01 10:00:{:02d},{:03d} INFO [worker-{}] Request {} processed in {} ms\n".format(
+                index % 60, index % 1000, index % 8, index, random.randint(1, 500)))
+        log_file.write("END OF BENCHMARK\n")
+    tail_engine = TailEngine()
+
+    def _capture():
+        tail = _LocalRemoteTail("localhost", None, work_dir + "/", "service.log", work_dir + "/capture-",
+                                None, tail_engine=tail_engine)
+        tail.init_tailer_connection()
+        tail.start_tailer()
+        if tail.wait_for("END OF BENCHMARK", timeout=60, since=0) is None:
+            raise RuntimeError("The capture did not finish")
+        tail.stop_tailer(grace_period=0)
+    _capture.cleanup = lambda: (tail_engine.stop(), shutil.rmtree(work_dir, ignore_errors=True))
+    return _capture
+
+
+def _time_case(function, setup, repeat, min_time, calibrate):
+    """
+    Time a case
+    :param function (function): Function to time
+    :param setup (function): Called before each call (not timed). None if there is no setup.
+    :param repeat (int): Number of runs
+    :param min_time (float): Min duration of each run (seconds). The calls per run are calibrated with the first run.
+    :param calibrate (bool): False to make one call per run
+    :return (dict): calls (per run) and times (list of seconds per call, one per run)
+    """
+
+    def _run(calls):
+        elapsed = 0.0
+        for _ in xrange(calls):
+            argument = setup() if setup is not None else None
+            start = time.time()
+            function(argument) if setup is not None else function()
+            elapsed += time.time() - start
+        return elapsed
+
+    calls = 1
+    if calibrate:
+        # Warm-up and calibration
+        elapsed = _run(1)
+        while elapsed < min_time and calls < 1000000:
+            calls = max(calls * 2, int(calls * min_time / max(elapsed, 1e-6)))
+            elapsed = _run(calls)
+    else:
+        _run(1)
+    return {'calls': calls, 'times': [_run(calls) / calls for _ in xrange(repeat)]}
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_benchmarks(name_filter=None, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """
+    Run the benchmark cases
+    :param name_filter (string): Regular expression of the names of the cases to run. None to run all.
+    :param repeat (int): Number of runs of each case
+    :param min_time (float): Min duration of each run (seconds)
+    :return (dict): Case name -> result: best, median, mean (seconds per call), calls, times. Or skipped/error.
+    """
+
+    results = dict()
+    for name, prepare, calibrate in _BENCHMARKS:
+        if name_filter and not re.search(name_filter, name):
+            continue
+        sys.stderr.write("{}... ".format(name))
+        try:
+            case = prepare()
+        except ImportError, e:
+            results[name] = {'skipped': str(e)}
+            sys.stderr.write("skipped ({})\n".format(e))
+            continue
+        function, setup = case if isinstance(case, tuple) else (case, None)
+        try:
+            result = _time_case(function, setup, repeat, min_time, calibrate)
+        except Exception, e:
+            results[name] = {'error': "{}: {}".format(type(e).__name__, e)}
+            sys.stderr.write("error ({})\n".format(e))
+            continue
+        finally:
+            if hasattr(function, 'cleanup'):
+                function.cleanup()
+        result.update({'best': min(result['times']), 'median': _median(result['times']),
+                       'mean': sum(result['times']) / len(result['times'])})
+        results[name] = result
+        sys.stderr.write("{:.3f} ms\n".format(result['median'] * 1e3))
+    return results
+
+
+def get_machine_metadata():
+    """
+    :return (dict): Metadata of the machine and the code of the run
+    """
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_ROOT,
+                                         stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        cpu_count = __import__('multiprocessing').cpu_count()
+    except NotImplementedError:
+        cpu_count = None
+    return {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"), 'hostname': socket.gethostname(),
+            'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': cpu_count, 'python_version': platform.python_version(),
+            'python_implementation': platform.python_implementation(), 'qautils_version': __version__,
+            'git_commit': commit}
+
+
+def compare_results(baseline, new, threshold=DEFAULT_THRESHOLD, statistic="median"):
+    """
+    Compare the time of the cases of two runs
+    :param baseline (dict): Results file of the baseline run
+    :param new (dict): Results file of the new run
+    :param threshold (float): Min time increase (percent) flagged as regression, and decrease flagged as improvement
+    :param statistic (string): Compared time: 'median' or 'best' (less sensitive to the noise of the machine)
+    :return (list): (name, baseline time, new time, change percent, status) of the cases of both runs. A case
+    measured in the baseline that fails or is skipped in the new run is a regression too.
+    """
+
+    comparison = list()
+    for name in sorted(set(baseline['results']) | set(new['results'])):
+        baseline_result, new_result = baseline['results'].get(name), new['results'].get(name)
+        if baseline_result is None or new_result is None:
+            status = "only in baseline" if new_result is None else "only in new run"
+            comparison.append((name, None, None, None, status))
+        elif statistic in baseline_result and statistic not in new_result:
+            reason = "error: {}".format(new_result['error']) if 'error' in new_result \
+                else "skipped: {}".format(new_result.get('skipped'))
+            comparison.append((name, None, None, None, "REGRESSION ({})".format(reason)))
+        elif statistic not in baseline_result or statistic not in new_result:
+            comparison.append((name, None, None, None, "not compared (skipped or failed in baseline)"))
+        else:
+            change = (new_result[statistic] / baseline_result[statistic] - 1) * 100
+            status = "REGRESSION" if change > threshold else ("improvement" if change < -threshold else "ok")
+            comparison.append((name, baseline_result[statistic], new_result[statistic], change, status))
+    return comparison
+
+
+def _print_results(results):
+    print "{:<40} {:>12} {:>12} {:>10}".format("CASE", "MEDIAN(ms)", "BEST(ms)", "CALLS")
+    for name in sorted(results):
+        result = results[name]
+        if 'median' in result:
+            print "{:<40} {:>12.3f} {:>12.3f} {:>10}".format(name, result['median'] * 1e3, result['best'] * 1e3,
+                                                            result['calls'])
+        else:
+            print "{:<40} {}".format(name, "skipped ({})".format(result['skipped']) if 'skipped' in result
+                                     else "error ({})".format(result['error']))
+
+
+def _command_run(args):
+    results = run_benchmarks(args.filter, args.repeat, args.min_time)
+    _print_results(results)
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump({'format': RESULTS_FORMAT_VERSION, 'metadata': get_machine_metadata(),
+                       'settings': {'repeat': args.repeat, 'min_time': args.min_time, 'filter': args.filter},
+                       'results': results}, json_file, indent=4, sort_keys=True, separators=(',', ': '))
+    return 0
+
+
+def _command_compare(args):
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.new) as new_file:
+        new = json.load(new_file)
+
+    for key in ("hostname", "machine", "cpu_count", "python_version", "python_implementation"):
+        if baseline['metadata'].get(key) != new['metadata'].get(key):
+            print "WARNING: The runs were made in different environments ({}: {} / {})".format(
+                key, baseline['metadata'].get(key), new['metadata'].get(key))
+
+    comparison = compare_results(baseline, new, args.threshold, args.statistic)
+    print "{:<40} {:>14} {:>14} {:>9}  {}".format("CASE", "BASELINE(ms)", "NEW(ms)", "CHANGE", "STATUS")
+    for name, baseline_median, new_median, change, status in comparison:
+        if change is None:
+            print "{:<40} {:>14} {:>14} {:>9}  {}".format(name, "-", "-", "-", status)
+        else:
+            print "{:<40} {:>14.3f} {:>14.3f} {:>+8.1f}%  {}".format(name, baseline_median * 1e3, new_median * 1e3,
+                                                                    change, status)
+    regressions = [entry[0] for entry in comparison if entry[4].startswith("REGRESSION")]
+    if regressions:
+        print "{} regression(s) (threshold: {}%): {}".format(len(regressions), args.threshold, ", ".join(regressions))
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the qautils subsystems and compare runs")
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('list', help="List the benchmark cases")
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmark cases")
+    run_parser.add_argument('--filter', help="Regular expression of the names of the cases to run")
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Runs of each case")
+    run_parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                            help="Min duration of each run (seconds)")
+    run_parser.add_argument('--json', dest='json_file', help="Write the results to this JSON file")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare the results of two runs")
+    compare_parser.add_argument('baseline', help="Results JSON file of the baseline run")
+    compare_parser.add_argument('new', help="Results JSON file of the new run")
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help="Time increase (percent) flagged as regression")
+    compare_parser.add_argument('--statistic', choices=("median", "best"), default="median",
+                                help="Compared time of each case")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, _, _ in _BENCHMARKS:
+            print name
+        return 0
+    return _command_run(args) if args.command == 'run' else _command_compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+"""
+sweep benchmark runs the SweepEngine (delete action) against a local stand-in of Keystone, Nova and Neutron, serially
+(one worker) and in parallel, and checks its results:
+    - all the servers, ports, routers, subnets and networks of the tenants are deleted (the stand-in answers 409, like
+      neutron, when a network or subnet is still in use, so the dependency order is checked);
+    - the API calls counted by the engine are the requests received by the stand-in (every page, every call of a
+      router deletion);
+    - no region receives more requests than the rate limit allows (rate per second plus the burst).
+No OpenStack deployment is needed. Each request to the stand-in has a fixed latency.
+
+Usage (from the repository root):
+    python benchmarks/sweep.py [--tenants N] [--regions N] [--resources N] [--latency SECONDS] [--workers N]
+                               [--region-rate N] [--json FILE]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qautils.openstack import listing_utils
+from qautils.openstack.sweep_utils import SweepEngine, ACTION_DELETE
+
+
+DEFAULT_TENANTS = 4
+DEFAULT_REGIONS = 2
+DEFAULT_RESOURCES = 30
+DEFAULT_LATENCY = 0.005
+DEFAULT_WORKERS = 16
+DEFAULT_REGION_RATE = 100.0
+DEFAULT_REGION_BURST = 10
+
+# Small pages, so the listings need several requests
+PAGE_SIZE = 10
+
+RESOURCE_TYPES = ['servers', 'ports', 'routers', 'subnets', 'networks']
+
+
+class _StandInError(Exception):
+
+    def __init__(self, status_code, message):
+        Exception.__init__(self, "{} {}".format(status_code, message))
+        self.status_code = status_code
+
+
+class _StandInCloud(object):
+    """
+    Resources of all the tenants and regions, with a latency per request. The requests of each region are recorded.
+    """
+
+    def __init__(self, tenants, regions, resources, latency):
+        self.latency = latency
+        self.regions = regions
+        self.requests = dict((region, list()) for region in regions)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._resources = dict()
+        for tenant, region in itertools.product(tenants, regions):
+            for index in xrange(resources):
+                network = self._add(tenant, region, 'networks')
+                subnet = self._add(tenant, region, 'subnets', network_id=network['id'])
+                self._add(tenant, region, 'servers')
+                self._add(tenant, region, 'ports', network_id=network['id'], device_owner="compute:nova")
+                if index % 5 == 0:
+                    router = self._add(tenant, region, 'routers', external_gateway_info={'network_id': "public"})
+                    self._add(tenant, region, 'ports', network_id=network['id'], device_id=router['id'],
+                              device_owner="network:router_interface", subnet_id=subnet['id'])
+                # DHCP ports are deleted with their network
+                self._add(tenant, region, 'ports', network_id=network['id'], device_owner="network:dhcp")
+
+    def _add(self, tenant, region, collection, **fields):
+        resource = dict(fields, id="{}-{}".format(collection, next(self._ids)), name=collection, tenant_id=tenant)
+        self._resources.setdefault((tenant, region, collection), list()).append(resource)
+        return resource
+
+    def request(self, region):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests[region].append(time.time())
+
+    def list(self, tenant, region, collection, marker=None, limit=None, **filters):
+        self.request(region)
+        with self._lock:
+            resources = [resource for resource in self._resources.get((tenant, region, collection), list())
+                         if all(resource.get(key) == value for key, value in filters.iteritems())]
+        if marker is not None:
+            resources = resources[[resource['id'] for resource in resources].index(marker) + 1:]
+        return resources[:limit] if limit else resources
+
+    def delete(self, tenant, region, collection, resource_id):
+        self.request(region)
+        with self._lock:
+            resources = self._resources.get((tenant, region, collection), list())
+            resource = [resource for resource in resources if resource['id'] == resource_id]
+            if not resource:
+                raise _StandInError(404, "{} {} could not be found".format(collection, resource_id))
+            ports = self._resources.get((tenant, region, 'ports'), list())
+            if collection == 'networks' and [port for port in ports if port['network_id'] == resource_id and
+                                             port['device_owner'] != "network:dhcp"]:
+                raise _StandInError(409, "Network {} is in use".format(resource_id))
+            if collection == 'subnets' and [port for port in ports if port.get('subnet_id') == resource_id]:
+                raise _StandInError(409, "Subnet {} has router interfaces".format(resource_id))
+            if collection == 'routers' and [port for port in ports if port.get('device_id') == resource_id]:
+                raise _StandInError(409, "Router {} has interfaces".format(resource_id))
+            resources.remove(resource[0])
+            if collection == 'networks':
+                ports[:] = [port for port in ports if port['network_id'] != resource_id]
+
+    def remove_router_interface(self, tenant, region, router_id, port_id):
+        self.request(region)
+        with self._lock:
+            ports = self._resources.get((tenant, region, 'ports'), list())
+            ports[:] = [port for port in ports if not (port['id'] == port_id and port['device_id'] == router_id)]
+
+    def count(self, collections=None):
+        with self._lock:
+            return sum(len(resources) for (tenant, region, collection), resources in self._resources.iteritems()
+                       if collections is None or collection in collections)
+
+
+class _StandInServer(object):
+
+    def __init__(self, server):
+        self.__dict__.update(server)
+
+
+class _StandInServers(object):
+
+    def __init__(self, clients):
+        self.clients = clients
+
+    def list(self, search_opts=None, marker=None, limit=None):
+        return [_StandInServer(server) for server in self.clients.cloud.list(self.clients.tenant, self.clients.region,
+                                                                              'servers', marker, limit)]
+
+    def delete(self, server_id):
+        self.clients.cloud.delete(self.clients.tenant, self.clients.region, 'servers', server_id)
+
+
+class _StandInNova(object):
+
+    def __init__(self, clients):
+        self.servers = _StandInServers(clients)
+
+
+class _StandInNeutron(object):
+    """
+    Neutron client stand-in: list_<collection> (pages with retrieve_all=False), delete_<resource> and the router
+    interface calls
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+
+    def _call(self, function, *args, **kwargs):
+        return function(self.clients.tenant, self.clients.region, *args, **kwargs)
+
+    def _list(self, collection, retrieve_all=True, marker=None, limit=None, tenant_id=None, **filters):
+        if retrieve_all:
+            return {collection: self._call(self.clients.cloud.list, collection, **filters)}
+
+        def _pages(marker):
+            while True:
+                page = self._call(self.clients.cloud.list, collection, marker, limit, **filters)
+                yield {collection: page}
+                if not limit or len(page) < limit:
+                    return
+                marker = page[-1]['id']
+        return _pages(marker)
+
+    def list_ports(self, **kwargs):
+        return self._list('ports', **kwargs)
+
+    def list_routers(self, **kwargs):
+        return self._list('routers', **kwargs)
+
+    def list_subnets(self, **kwargs):
+        return self._list('subnets', **kwargs)
+
+    def list_networks(self, **kwargs):
+        return self._list('networks', **kwargs)
+
+    def delete_port(self, port_id):
+        self._call(self.clients.cloud.delete, 'ports', port_id)
+
+    def delete_router(self, router_id):
+        self._call(self.clients.cloud.delete, 'routers', router_id)
+
+    def delete_subnet(self, subnet_id):
+        self._call(self.clients.cloud.delete, 'subnets', subnet_id)
+
+    def delete_network(self, network_id):
+        self._call(self.clients.cloud.delete, 'networks', network_id)
+
+    def remove_gateway_router(self, router_id):
+        self.clients.cloud.request(self.clients.region)
+
+    def remove_interface_router(self, router_id, body):
+        self._call(self.clients.cloud.remove_router_interface, router_id, body['port_id'])
+
+
+class _StandInClients(object):
+    """
+    OpenStackClients stand-in: Keystone (credential check and catalog regions), Nova and Neutron
+    """
+
+    cloud = None
+
+    def __init__(self, auth_url=None):
+        self.tenant = None
+        self.region = None
+
+    def set_credential(self, username, password, tenant_name=None, **kwargs):
+        self.tenant = tenant_name
+
+    def get_token(self):
+        return "token-{}".format(self.tenant)
+
+    def get_regions(self, service_type):
+        return set(self.cloud.regions)
+
+    def get_tenant_id(self):
+        return self.tenant
+
+    def for_region(self, region):
+        clients = _StandInClients()
+        clients.tenant = self.tenant
+        clients.region = region
+        return clients
+
+    def get_novaclient(self):
+        return _StandInNova(self)
+
+    def get_neutronclient(self):
+        return _StandInNeutron(self)
+
+
+def _get_peak_requests(request_times, window=1.0):
+    """
+    :return (int): Max requests received in any time window (seconds)
+    """
+
+    request_times = sorted(request_times)
+    peak = 0
+    first = 0
+    for last, request_time in enumerate(request_times):
+        while request_time - request_times[first] > window:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+def benchmark_sweep(tenants, regions, resources, latency, workers, region_rate, region_burst):
+    """
+    Delete all the resources of the stand-in cloud with the SweepEngine
+    :return (dict): elapsed (seconds), resources, remaining (resources not deleted), errors, api_calls (counted by
+    the engine), requests (received by the stand-in), peak_region_requests (max requests to a region in one second),
+    max_allowed_region_requests
+    """
+
+    tenant_names = ["tenant-{}".format(index) for index in xrange(tenants)]
+    cloud = _StandInCloud(tenant_names, ["Region{}".format(index) for index in xrange(regions)], resources, latency)
+    _StandInClients.cloud = cloud
+    deletable = cloud.count(RESOURCE_TYPES)
+
+    engine = SweepEngine([{'username': "admin", 'password': "secret", 'tenant_name': tenant}
+                          for tenant in tenant_names], resource_types=RESOURCE_TYPES, action=ACTION_DELETE,
+                         clients_factory=_StandInClients, pool_size=workers, region_rate=region_rate,
+                         region_burst=region_burst, progress_interval=3600, progress_callback=lambda progress: None,
+                         delete_timeout=5, delete_poll_interval=0.01)
+    start = time.time()
+    results = engine.run()
+    elapsed = time.time() - start
+    progress = engine.get_progress()
+    return {'elapsed': elapsed, 'resources': deletable, 'remaining': cloud.count(RESOURCE_TYPES),
+            'errors': sum(len(result['errors']) for result in results.itervalues()),
+            'api_calls': progress['api_calls'],
+            'requests': sum(len(request_times) for request_times in cloud.requests.itervalues()),
+            'peak_region_requests': max(_get_peak_requests(request_times)
+                                        for request_times in cloud.requests.itervalues()),
+            'max_allowed_region_requests': int(region_rate + region_burst)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SweepEngine against a local Keystone/Nova/Neutron stand-in")
+    parser.add_argument('--tenants', type=int, default=DEFAULT_TENANTS, help="Number of tenants")
+    parser.add_argument('--regions', type=int, default=DEFAULT_REGIONS, help="Number of regions")
+    parser.add_argument('--resources', type=int, default=DEFAULT_RESOURCES,
+                        help="Networks (each one with a subnet, a server and ports) per tenant and region")
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="Latency of each request (seconds)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Worker threads of the parallel run")
+    parser.add_argument('--region-rate', type=float, default=DEFAULT_REGION_RATE,
+                        help="Max API calls per second to each region")
+    parser.add_argument('--json', dest='json_file', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    listing_utils.set_page_size('nova', PAGE_SIZE)
+    listing_utils.set_page_size('neutron', PAGE_SIZE)
+    results = dict()
+    for mode, workers in (("serial", 1), ("parallel", args.workers)):
+        results[mode] = benchmark_sweep(args.tenants, args.regions, args.resources, args.latency, workers,
+                                        args.region_rate, DEFAULT_REGION_BURST)
+
+    print "{:<10} {:>8} {:>10} {:>10} {:>8} {:>10} {:>10} {:>12}".format(
+        "MODE", "TIME(s)", "RESOURCES", "REMAINING", "ERRORS", "API CALLS", "REQUESTS", "PEAK REQ/s")
+    failures = list()
+    for mode in ("serial", "parallel"):
+        result = results[mode]
+        print "{:<10} {:>8.2f} {:>10} {:>10} {:>8} {:>10} {:>10} {:>6}/{:<5}".format(
+            mode, result['elapsed'], result['resources'], result['remaining'], result['errors'], result['api_calls'],
+            result['requests'], result['peak_region_requests'], result['max_allowed_region_requests'])
+        if result['remaining'] or result['errors']:
+            failures.append("{}: {} resources not deleted, {} errors".format(mode, result['remaining'],
+                                                                             result['errors']))
+        if result['api_calls'] != result['requests']:
+            failures.append("{}: {} API calls counted, {} requests received".format(mode, result['api_calls'],
+                                                                                  result['requests']))
+        if result['peak_region_requests'] > result['max_allowed_region_requests']:
+            failures.append("{}: {} requests to a region in one second (rate limit: {})".format(
+                mode, result['peak_region_requests'], result['max_allowed_region_requests']))
+
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+    for failure in failures:
+        print "FAILED: " + failure
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,9 @@
 """
     commandline_utils module contains utilities for executing local commands in the system
         - execute_command: Executes a new command
+        - run_command: Executes a new command streaming its output line by line, with timeout
+        - execute_commands: Executes several commands concurrently (see run_command)
+    The resource usage of the commands is recorded when it is enabled (see resource_usage_utils).
 """
 
 __author__ = "@jframos"
@@ -11,14 +14,72 @@ __copyright__ = "Copyright 2015"
 __license__ = " Apache License, Version 2.0"
 __version__ = "1.2.1"
 
+import os
+import time
+import errno
+import select
+import signal
 import subprocess
 from subprocess import CalledProcessError
 
 from qautils.logger.logger_utils import get_logger
+from qautils.commandline import resource_usage_utils
+from qautils.metrics.metrics_utils import get_metrics_registry
 
 
 __logger__ = get_logger(__name__)
 
+_commands_metric = get_metrics_registry().counter("local_commands_total", "Local commands executed by run_command",
+                                                  ("result",))
+_command_duration_metric = get_metrics_registry().histogram("local_command_duration_seconds",
+                                                            "Duration of the local commands executed by run_command")
+
+# Max number of commands running at the same time (see execute_commands)
+DEFAULT_POOL_SIZE = 8
+
+# Time between SIGTERM and SIGKILL when a command times out (seconds)
+KILL_GRACE_PERIOD = 2
+
+READ_BUFFER_SIZE = 65536
+
+
+def _wait_process(process):
+    """
+    Wait for the process end, getting its resource usage
+    :param process: subprocess.Popen
+    :return (tuple): (exit code, resource.struct_rusage)
+    """
+
+    while True:
+        try:
+            _, status, rusage = process.wait_result if hasattr(process, 'wait_result') else \
+                os.wait4(process.pid, 0)
+            break
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return process.returncode, rusage
+
+
+def _execute_command_with_usage(command):
+    """
+    Execute the given command like execute_command, recording its resource usage.
+    :param command (String): Shell command.
+    :return (String): The command output when command has finished.
+    """
+
+    start_time = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+    result = process.stdout.read()
+    process.stdout.close()
+    exit_code, rusage = _wait_process(process)
+    resource_usage_utils.get_resource_usage_recorder().record(
+        command, resource_usage_utils.get_local_usage(rusage, time.time() - start_time), exit_code)
+    if exit_code != 0:
+        __logger__.warning("Command execution failed. Command: '%s'; Output: '%s'", command, result)
+    return result
+
 
 def execute_command(command):
     """
@@ -28,6 +89,9 @@ def execute_command(command):
     """
     __logger__.debug("Executing command: '%s'", command)
 
+    if resource_usage_utils.is_resource_usage_enabled():
+        return _execute_command_with_usage(command)
+
     result = None
     try:
         result = subprocess.check_output(command, stderr=subprocess.STDOUT, shell=True)
@@ -36,3 +100,141 @@ def execute_command(command):
         __logger__.warning("Command execution failed. Command: '%s'; Output: '%s'", command, e.output)
 
     return result
+
+
+def _kill_process_group(process):
+    """
+    Kill the process and its children: SIGTERM and, if they do not finish in KILL_GRACE_PERIOD, SIGKILL.
+    :param process: subprocess.Popen, started in its own process group
+    :return: None
+    """
+
+    for kill_signal in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, kill_signal)
+        except OSError:
+            return
+        deadline = time.time() + KILL_GRACE_PERIOD
+        while time.time() < deadline:
+            # Not process.poll(): it would reap the process, and its resource usage would be lost (see _wait_process)
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid != 0:
+                process.wait_result = (pid, status, rusage)
+                return
+            time.sleep(0.05)
+
+
+def run_command(command, timeout=None, stdout_callback=None, stderr_callback=None, stdout_file=None,
+                stderr_file=None, keep_output=True, cwd=None, env=None):
+    """
+    Execute the given command in its own process group, streaming its output. Wait for command ends.
+    :param command (String): Shell command.
+    :param timeout (float): Max execution time (seconds). The process group is killed after it. None: no limit.
+    :param stdout_callback (function): Called with (command, line) for each stdout line (without line break).
+    :param stderr_callback (function): Called with (command, line) for each stderr line (without line break).
+    :param stdout_file (String): Path of the file where stdout is saved.
+    :param stderr_file (String): Path of the file where stderr is saved.
+    :param keep_output (bool): Keep the output in memory and return it. False for commands with huge outputs.
+    :param cwd (String): Working directory.
+    :param env (dict): Environment variables. By default, the ones of this process.
+    :return (dict): command, exit_code (None if the command could not be executed or was killed), stdout and
+    stderr (None if keep_output is False), duration (seconds), timed_out (bool), error (None if it was executed),
+    usage (resource usage, see resource_usage_utils.get_local_usage)
+    """
+
+    __logger__.debug("Executing command: '%s'", command)
+    result = {'command': command, 'exit_code': None, 'stdout': None, 'stderr': None, 'duration': None,
+              'timed_out': False, 'error': None, 'usage': None}
+    start_time = time.time()
+    try:
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   close_fds=True, preexec_fn=os.setsid, cwd=cwd, env=env)
+    except OSError, e:
+        __logger__.warning("Command execution failed. Command: '%s'; Error: '%s'", command, str(e))
+        result['error'] = str(e)
+        result['duration'] = time.time() - start_time
+        _commands_metric.labels("error").inc()
+        return result
+
+    # Output streams: file descriptor -> [callback, output file, kept chunks, incomplete line]
+    streams = {process.stdout.fileno(): [stdout_callback, stdout_file and open(stdout_file, 'wb'), list(), ""],
+               process.stderr.fileno(): [stderr_callback, stderr_file and open(stderr_file, 'wb'), list(), ""]}
+    outputs = [streams[process.stdout.fileno()][2], streams[process.stderr.fileno()][2]]
+    deadline = start_time + timeout if timeout is not None else None
+    try:
+        while streams:
+            remaining = deadline - time.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                result['timed_out'] = True
+                __logger__.warning("Command timed out after %s seconds. Killing it. Command: '%s'", timeout, command)
+                _kill_process_group(process)
+                break
+            try:
+                ready = select.select(streams.keys(), [], [], remaining)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                stream = streams[fd]
+                data = os.read(fd, READ_BUFFER_SIZE)
+                if stream[1]:
+                    stream[1].write(data)
+                if keep_output:
+                    stream[2].append(data)
+                if stream[0] is not None:
+                    lines = (stream[3] + data).split("\n") if data else [stream[3]] if stream[3] else []
+                    stream[3] = lines.pop() if data else ""
+                    for line in lines:
+                        stream[0](command, line)
+                if not data:
+                    if stream[1]:
+                        stream[1].close()
+                    del streams[fd]
+    finally:
+        for stream in streams.values():
+            if stream[1]:
+                stream[1].close()
+        process.stdout.close()
+        process.stderr.close()
+
+    exit_code, rusage = _wait_process(process)
+    result['duration'] = time.time() - start_time
+    result['usage'] = resource_usage_utils.get_local_usage(rusage, result['duration'])
+    if resource_usage_utils.is_resource_usage_enabled():
+        resource_usage_utils.get_resource_usage_recorder().record(command, result['usage'],
+                                                                  None if result['timed_out'] else exit_code)
+    if not result['timed_out']:
+        result['exit_code'] = exit_code
+    if keep_output:
+        result['stdout'], result['stderr'] = ["".join(output) for output in outputs]
+    if exit_code != 0 and not result['timed_out']:
+        __logger__.warning("Command execution failed. Command: '%s'; Exit code: %s", command, exit_code)
+    _commands_metric.labels("timeout" if result['timed_out'] else "ok" if exit_code == 0 else "failed").inc()
+    _command_duration_metric.observe(result['duration'])
+    return result
+
+
+def execute_commands(commands, pool_size=DEFAULT_POOL_SIZE, timeout=None, **kwargs):
+    """
+    Execute several commands concurrently. Each one is executed with run_command.
+    :param commands (list): Shell commands.
+    :param pool_size (int): Max number of commands running at the same time.
+    :param timeout (float): Max execution time of each command (seconds). None: no limit.
+    :param kwargs: Other run_command parameters, shared by all the commands (callbacks receive the command).
+    Output files are not supported: each command would overwrite them.
+    :return (list): run_command results, in the same order as the commands.
+    """
+
+    from multiprocessing.pool import ThreadPool
+
+    if 'stdout_file' in kwargs or 'stderr_file' in kwargs:
+        raise ValueError("Output files are not supported when executing several commands")
+
+    __logger__.debug("Executing %d commands (pool size: %d)", len(commands), pool_size)
+    pool = ThreadPool(min(pool_size, len(commands)) or 1)
+    try:
+        return pool.map(lambda command: run_command(command, timeout, **kwargs), commands, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+resource_usage_utils module contains utilities to account the resources used by the executed commands:
+    - enable_resource_usage / is_resource_usage_enabled: Enable the accounting (disabled by default, or enabled
+      with the environment variable QAUTILS_RESOURCE_USAGE=1).
+    - get_local_usage: Resource usage of a finished local process (from os.wait4).
+    - wrap_remote_command / parse_remote_usage: Measure a remote command with '/usr/bin/time'.
+    - ResourceUsageRecorder: Aggregates the usage by command name (wall time, user/sys CPU time, max RSS, I/O).
+    - get_resource_usage_recorder: Returns the shared ResourceUsageRecorder.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import json
+import pipes
+import threading
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+RESOURCE_USAGE_ENV_VAR = "QAUTILS_RESOURCE_USAGE"
+
+# Size of the blocks of the I/O counters of rusage (bytes)
+IO_BLOCK_SIZE = 512
+
+# Prefix of the last output line of wrapped remote commands
+_REMOTE_USAGE_MARK = "__QA_USAGE__"
+
+# Shell used by Fabric 'run' (fabric.api.env.shell) when Fabric is not available
+DEFAULT_REMOTE_SHELL = "/bin/bash -l -c"
+
+# GNU time format: wall time, user time, sys time, max RSS (KB), file system inputs and outputs (blocks)
+_REMOTE_TIME_FORMAT = "%e %U %S %M %I %O"
+
+_enabled = os.environ.get(RESOURCE_USAGE_ENV_VAR, "").lower() in ("1", "true", "yes")
+
+# Shared recorder (see get_resource_usage_recorder)
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def enable_resource_usage(enabled=True):
+    """
+    Enable (or disable) the resource usage accounting of commandline_utils and FabricUtils commands
+    :param enabled (bool): True to enable it
+    :return: None
+    """
+
+    global _enabled
+    _enabled = enabled
+
+
+def is_resource_usage_enabled():
+    """
+    :return (bool): True if the resource usage accounting is enabled
+    """
+    return _enabled
+
+
+def get_command_name(command):
+    """
+    Name used to aggregate the usage of a command: the program name (without path) of the first word
+    :param command (string): Shell command
+    :return (string): Command name
+    """
+
+    words = command.split()
+    return os.path.basename(words[0]) if words else ""
+
+
+def _build_usage(wall_time, user_time, sys_time, max_rss_kb, read_bytes, write_bytes):
+    """
+    :return (dict): Resource usage of a command
+    """
+
+    return {'wall_time': wall_time, 'user_time': user_time, 'sys_time': sys_time, 'max_rss_kb': max_rss_kb,
+            'read_bytes': read_bytes, 'write_bytes': write_bytes}
+
+
+def get_local_usage(rusage, wall_time):
+    """
+    Resource usage of a finished local process
+    :param rusage: resource.struct_rusage returned by os.wait4
+    :param wall_time (float): Execution time (seconds)
+    :return (dict): wall_time, user_time, sys_time (seconds), max_rss_kb, read_bytes, write_bytes
+    """
+
+    return _build_usage(wall_time, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss,
+                        rusage.ru_inblock * IO_BLOCK_SIZE, rusage.ru_oublock * IO_BLOCK_SIZE)
+
+
+def _get_remote_shell():
+    """
+    :return (string): Shell used by Fabric to run the remote commands (env.shell)
+    """
+
+    try:
+        from fabric.api import env
+        return env.shell
+    except ImportError:
+        return DEFAULT_REMOTE_SHELL
+
+
+def wrap_remote_command(command, shell=None):
+    """
+    Wrap the remote command with '/usr/bin/time' (GNU time). The usage is printed in the last output line (see
+    parse_remote_usage) and the exit code of the command is kept. If '/usr/bin/time' is not available in the
+    remote host, the command is executed without measuring it.
+    :param command (string): Shell command
+    :param shell (string): Shell that runs the command, as Fabric does. By default, Fabric's env.shell
+    ('/bin/bash -l -c'), so the measured command gets the same environment (login profile, bash syntax) as
+    the not measured one.
+    :return (string): Wrapped command
+    """
+
+    quoted_command = pipes.quote(command)
+    return ('QA_USAGE_FILE=$(mktemp 2>/dev/null || echo /tmp/qa_usage.$$); '
+            'if [ -x /usr/bin/time ]; then /usr/bin/time -f {time_format} -o "$QA_USAGE_FILE" {shell} {command}; '
+            'else {shell} {command}; fi; QA_EXIT_CODE=$?; '
+            'echo "{mark} $(tail -n 1 "$QA_USAGE_FILE" 2>/dev/null)"; rm -f "$QA_USAGE_FILE"; '
+            'exit $QA_EXIT_CODE').format(time_format=pipes.quote(_REMOTE_TIME_FORMAT), command=quoted_command,
+                                         shell=shell or _get_remote_shell(), mark=_REMOTE_USAGE_MARK)
+
+
+def parse_remote_usage(output, wall_time):
+    """
+    Split the output of a wrapped remote command into the command output and its resource usage
+    :param output (string): Output of the wrapped command
+    :param wall_time (float): Execution time measured locally (seconds), used when the remote time is not available
+    :return (tuple): (command output, usage dict as in get_local_usage)
+    """
+
+    position = output.rfind(_REMOTE_USAGE_MARK)
+    if position == -1:
+        return output, _build_usage(wall_time, None, None, None, None, None)
+
+    command_output = output[:position].rstrip("\r\n")
+    fields = output[position + len(_REMOTE_USAGE_MARK):].split()
+    try:
+        remote_wall_time, user_time, sys_time = [float(field) for field in fields[:3]]
+        max_rss_kb, inputs, outputs = [int(field) for field in fields[3:6]]
+    except ValueError:
+        return command_output, _build_usage(wall_time, None, None, None, None, None)
+    return command_output, _build_usage(remote_wall_time, user_time, sys_time, max_rss_kb,
+                                        inputs * IO_BLOCK_SIZE, outputs * IO_BLOCK_SIZE)
+
+
+class ResourceUsageRecorder(object):
+
+    def __init__(self):
+        """
+        Init the ResourceUsageRecorder
+        :return: None
+        """
+
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def record(self, command, usage, exit_code=0):
+        """
+        Add the usage of an executed command to the stats of its command name
+        :param command (string): Executed command
+        :param usage (dict): Usage (see get_local_usage). Unknown values are None.
+        :param exit_code (int): Exit code of the command (None if it could not be executed)
+        :return: None
+        """
+
+        name = get_command_name(command)
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {'count': 0, 'failures': 0, 'wall_time_total': 0.0, 'wall_time_max': 0.0,
+                                             'user_time_total': 0.0, 'sys_time_total': 0.0, 'max_rss_kb': 0,
+                                             'read_bytes_total': 0, 'write_bytes_total': 0}
+            stats['count'] += 1
+            if exit_code != 0:
+                stats['failures'] += 1
+            stats['wall_time_total'] += usage['wall_time']
+            stats['wall_time_max'] = max(stats['wall_time_max'], usage['wall_time'])
+            if usage['user_time'] is not None:
+                stats['user_time_total'] += usage['user_time']
+                stats['sys_time_total'] += usage['sys_time']
+                stats['max_rss_kb'] = max(stats['max_rss_kb'], usage['max_rss_kb'])
+                stats['read_bytes_total'] += usage['read_bytes']
+                stats['write_bytes_total'] += usage['write_bytes']
+        __logger__.debug("Resource usage of '%s': %s", name, usage)
+
+    def get_stats(self):
+        """
+        Get the aggregated usage
+        :return (dict): command name -> dict with count, failures, wall_time_total, wall_time_max, wall_time_mean,
+        user_time_total, sys_time_total (seconds), max_rss_kb, read_bytes_total and write_bytes_total
+        """
+
+        with self._lock:
+            stats = dict((name, dict(values)) for name, values in self._stats.iteritems())
+        for values in stats.itervalues():
+            values['wall_time_mean'] = values['wall_time_total'] / values['count']
+        return stats
+
+    def reset(self):
+        """
+        Remove all the recorded usage
+        :return: None
+        """
+
+        with self._lock:
+            self._stats.clear()
+
+    def export_json(self, file_path):
+        """
+        Save the aggregated usage in a JSON file
+        :param file_path (string): File path
+        :return: None
+        """
+
+        with open(file_path, 'w') as file_object:
+            json.dump(self.get_stats(), file_object, indent=2, sort_keys=True)
+
+
+def get_resource_usage_recorder():
+    """
+    Get the shared ResourceUsageRecorder, where commandline_utils and FabricUtils record the usage of their commands
+    :return: ResourceUsageRecorder
+    """
+
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = ResourceUsageRecorder()
+
+            from qautils.metrics.metrics_utils import get_metrics_registry
+            get_metrics_registry().register_collector("resource_usage", _recorder.get_stats)
+    return _recorder
@@ -23,6 +23,12 @@ PROPERTIES_CONFIG_ENV_NAME = "name"
 PROPERTIES_CONFIG_REMOTE_LOGS = "remote_logs"
 PROPERTIES_CONFIG_REMOTE_LOGS_CAPTURE_LOCAL_PATH = "capture_local_path"
 
+# Profiling properties (see qautils.metrics.profiling_utils)
+PROPERTIES_CONFIG_PROFILING = "profiling"
+PROPERTIES_CONFIG_PROFILING_ENABLED = "enabled"
+PROPERTIES_CONFIG_PROFILING_FORMAT = "format"
+PROPERTIES_CONFIG_PROFILING_OUTPUT = "output"
+
 # Generic API service properties
 PROPERTIES_CONFIG_SERVICE_PROTOCOL = "protocol"
 PROPERTIES_CONFIG_SERVICE_HOST = "host"
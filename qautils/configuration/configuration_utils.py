@@ -4,6 +4,17 @@
 configuration_utils module has some functions to manage project configuration
     - set_up: Loads properties from properties.json file and configures the project.
               By default, properties file should be located at ./settings/settings.json
+    - Configuration: Cached project configuration with layered overrides (file < environment variables < CLI) that
+      is reloaded when the properties file changes. Subscribers are notified when the configuration changes.
+      It has typed accessors for the properties defined in configuration_properties. E.g.:
+          get_configuration().get_service_port("example_http_service_1")  # -> 5678 (int)
+    - get_configuration: Returns the project Configuration (created on first call).
+
+Environment variable overrides: ENV_OVERRIDE_PREFIX + property path, with '__' as path separator. Values are parsed
+as JSON when possible (otherwise, they are used as strings). E.g.:
+    QAUTILS_CONF__example_http_service_1__port=8080
+CLI overrides: list of 'path=value' strings, with '.' as path separator. E.g.:
+    ["example_http_service_1.port=8080", "environment.name=soak"]
 """
 
 __author__ = "@jframos"
@@ -16,10 +27,15 @@ __version__ = "1.2.1"
 import os
 import sys
 import json
+import copy
+import time
+import threading
 
 from qautils.logger.logger_utils import get_logger
+from qautils.configuration import configuration_properties
 from qautils.configuration.configuration_properties import PROPERTIES_CONFIG_REMOTE_LOGS, \
-    PROPERTIES_CONFIG_REMOTE_LOGS_CAPTURE_LOCAL_PATH, PROPERTIES_FILE
+    PROPERTIES_CONFIG_REMOTE_LOGS_CAPTURE_LOCAL_PATH, PROPERTIES_FILE, PROPERTIES_CONFIG_ENV, \
+    PROPERTIES_CONFIG_PROFILING
 
 
 __logger__ = get_logger(__name__)
@@ -27,6 +43,361 @@ __logger__ = get_logger(__name__)
 # Loaded configuration. Module variable with all loaded properties from PROPERTIES_FILE
 config = None
 
+# Prefix of the environment variables that override properties
+ENV_OVERRIDE_PREFIX = "QAUTILS_CONF__"
+
+# Min time (seconds) between two checks of the properties file modification time
+DEFAULT_CHECK_INTERVAL = 1.0
+
+# Project Configuration (see get_configuration)
+_configuration = None
+_configuration_lock = threading.Lock()
+
+
+def _property_types():
+    """
+    Build the typed accessors spec from the PROPERTIES_CONFIG_* constants in configuration_properties.
+    :return (dict): Accessor name -> (property key, type converter, default section)
+    """
+
+    # Properties whose value is a section of the configuration, not a property of a section
+    sections = {"PROPERTIES_CONFIG_ENV": PROPERTIES_CONFIG_ENV,
+                "PROPERTIES_CONFIG_REMOTE_LOGS": PROPERTIES_CONFIG_REMOTE_LOGS,
+                "PROPERTIES_CONFIG_PROFILING": PROPERTIES_CONFIG_PROFILING}
+    converters = {"PROPERTIES_CONFIG_SERVICE_PORT": int,
+                  "PROPERTIES_CONFIG_SERVICE_LOG_FILES": lambda value: value if isinstance(value, list) else [value]}
+
+    accessors = dict()
+    for constant_name in dir(configuration_properties):
+        if not constant_name.startswith("PROPERTIES_CONFIG_") or constant_name in sections:
+            continue
+        default_section = None
+        for section_constant_name, section in sections.iteritems():
+            if constant_name.startswith(section_constant_name + "_"):
+                default_section = section
+        accessor_name = "get_" + constant_name[len("PROPERTIES_CONFIG_"):].lower()
+        accessors[accessor_name] = (getattr(configuration_properties, constant_name),
+                                    converters.get(constant_name), default_section)
+    return accessors
+
+
+def _parse_override_value(value):
+    """
+    Parse an override value: JSON if possible, else the string itself.
+    :param value (string): Raw value
+    :return: Parsed value
+    """
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _set_path(target, path, value):
+    """
+    Set the value in the dict, creating the intermediate dicts of the path if they don't exist.
+    :param target (dict): Dict to update
+    :param path (list): Keys
+    :param value: Value to set
+    :return: None
+    """
+
+    for key in path[:-1]:
+        if not isinstance(target.get(key), dict):
+            target[key] = dict()
+        target = target[key]
+    target[path[-1]] = value
+
+
+class Configuration(object):
+
+    def __init__(self, file_path=PROPERTIES_FILE, env_prefix=ENV_OVERRIDE_PREFIX, cli_overrides=None,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        """
+        Init the Configuration and load the properties file.
+        :param file_path (string): JSON properties file
+        :param env_prefix (string): Prefix of the environment variables that override properties. None to disable.
+        :param cli_overrides (list): 'path=value' overrides. E.g.: ["my_service.port=8080"]
+        :param check_interval (float): Min time (seconds) between two checks of the file modification time
+        :return: None
+        """
+
+        self.file_path = file_path
+        self.env_prefix = env_prefix
+        self.check_interval = check_interval
+        self.reload_count = 0
+
+        self._cli_overrides = dict()
+        for override in cli_overrides or []:
+            path, value = override.split("=", 1)
+            _set_path(self._cli_overrides, path.split("."), _parse_override_value(value))
+
+        self._lock = threading.RLock()
+        self._subscribers = list()
+        self._file_properties = dict()
+        self._file_stat = None
+        self._last_check = 0
+        self._properties = dict()
+        self._typed_cache = dict()
+        self._watcher = None
+        self._watcher_stop = threading.Event()
+
+        self.reload(force=True)
+
+    def _env_overrides(self):
+        """
+        Get the overrides defined in environment variables
+        :return (dict): Overridden properties
+        """
+
+        overrides = dict()
+        if self.env_prefix:
+            for name, value in os.environ.iteritems():
+                if name.startswith(self.env_prefix) and len(name) > len(self.env_prefix):
+                    _set_path(overrides, name[len(self.env_prefix):].split("__"), _parse_override_value(value))
+        return overrides
+
+    @staticmethod
+    def _merge(target, overrides):
+        """
+        Deep merge the overrides into the target dict
+        :param target (dict): Dict to update
+        :param overrides (dict): Values to set
+        :return: None
+        """
+
+        for key, value in overrides.iteritems():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                Configuration._merge(target[key], value)
+            else:
+                target[key] = copy.deepcopy(value)
+
+    def reload(self, force=False):
+        """
+        Reload the properties file if its modification time (or size) has changed, and notify the subscribers if
+        the resulting configuration has changed. If the file cannot be parsed or read, or it has been removed, the
+        previous configuration is kept (on first load, ValueError or IOError is raised and a missing file is an empty
+        configuration).
+        :param force (bool): Reload it even if the file has not changed
+        :return (bool): True if the configuration has changed
+        """
+
+        with self._lock:
+            self._last_check = time.time()
+            try:
+                stat = os.stat(self.file_path)
+                file_stat = (stat.st_mtime, stat.st_size)
+            except OSError:
+                file_stat = None
+
+            if not force and file_stat == self._file_stat:
+                return False
+
+            if file_stat is None and self.reload_count == 0:
+                __logger__.warning("%s properties file does not exist", self.file_path)
+                file_properties = dict()
+            elif file_stat is None:
+                # Removed (or being replaced) after the first load: like a parse error, keep the last good properties
+                __logger__.error("%s properties file does not exist. Previous configuration is kept", self.file_path)
+                file_properties = self._file_properties
+            else:
+                __logger__.info("Loading project properties from %s", self.file_path)
+                try:
+                    with open(self.file_path) as config_file:
+                        file_properties = json.load(config_file)
+                except (ValueError, IOError), e:
+                    __logger__.error('Error loading config file: %s' % e)
+                    if self.reload_count == 0:
+                        raise e
+                    file_properties = self._file_properties
+            self._file_stat = file_stat
+            self._file_properties = file_properties
+
+            properties = copy.deepcopy(file_properties)
+            self._merge(properties, self._env_overrides())
+            self._merge(properties, self._cli_overrides)
+
+            previous_properties = self._properties
+            changed = properties != previous_properties
+            self._properties = properties
+            self._typed_cache = dict()
+            self.reload_count += 1
+            subscribers = list(self._subscribers)
+
+        __logger__.debug("Properties loaded: %s", properties)
+        if changed and self.reload_count > 1:
+            for callback in subscribers:
+                try:
+                    callback(properties, previous_properties)
+                except Exception, e:
+                    __logger__.error("Configuration subscriber failed: %s", e)
+        return changed
+
+    def _check_reload(self):
+        """
+        Reload the configuration if the check interval has expired since last check
+        :return: None
+        """
+
+        if time.time() - self._last_check >= self.check_interval:
+            self.reload()
+
+    def set_override(self, path, value):
+        """
+        Override a property at runtime, as a CLI override.
+        :param path (string): Property path, with '.' as separator
+        :param value: New value
+        :return: None
+        """
+
+        with self._lock:
+            _set_path(self._cli_overrides, path.split("."), value)
+        self.reload(force=True)
+
+    def subscribe(self, callback):
+        """
+        Subscribe to configuration changes.
+        :param callback: Function (new_properties, old_properties) called after each change
+        :return: None
+        """
+
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Unsubscribe from configuration changes.
+        :param callback: Subscribed function
+        :return: None
+        """
+
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def start_watching(self, interval=DEFAULT_CHECK_INTERVAL):
+        """
+        Start a daemon thread that checks the properties file every 'interval' seconds, so subscribers are notified
+        even if the configuration is not being read.
+        :param interval (float): Seconds between checks
+        :return: None
+        """
+
+        if self._watcher is not None:
+            return
+
+        def _watch():
+            while not self._watcher_stop.wait(interval):
+                self.reload()
+
+        self._watcher_stop.clear()
+        self._watcher = threading.Thread(target=_watch, name="qautils-config-watcher")
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop_watching(self):
+        """
+        Stop the thread started by start_watching
+        :return: None
+        """
+
+        if self._watcher is not None:
+            self._watcher_stop.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def as_dict(self):
+        """
+        Get all the properties (with overrides). The returned dict should not be modified.
+        :return (dict): Properties
+        """
+
+        self._check_reload()
+        return self._properties
+
+    def get(self, path, default=None):
+        """
+        Get a property value
+        :param path: Property path. String with '.' as separator, or list/tuple of keys.
+        :param default: Value returned if the property does not exist
+        :return: Property value
+        """
+
+        self._check_reload()
+        value = self._properties
+        for key in path.split(".") if isinstance(path, basestring) else path:
+            if not isinstance(value, dict) or key not in value:
+                return default
+            value = value[key]
+        return value
+
+    def _get_typed(self, accessor_name, section):
+        """
+        Get the value of a typed property, converted to its type. Converted values are cached until next reload.
+        :param accessor_name (string): Accessor name (see _property_types)
+        :param section (string): Section where the property is defined
+        :return: Property value (None if it does not exist)
+        """
+
+        self._check_reload()
+        cache_key = (accessor_name, section)
+        typed_cache = self._typed_cache
+        if cache_key not in typed_cache:
+            key, converter, default_section = _PROPERTY_TYPES[accessor_name]
+            value = self.get((section or default_section, key))
+            typed_cache[cache_key] = converter(value) if converter is not None and value is not None else value
+        return typed_cache[cache_key]
+
+
+# Typed accessors for the PROPERTIES_CONFIG_* properties. E.g.: get_service_host(section), get_env_name()
+_PROPERTY_TYPES = _property_types()
+
+
+def _add_typed_accessor(accessor_name):
+    """
+    Add the typed accessor method to the Configuration class
+    :param accessor_name (string): Accessor name (see _property_types)
+    :return: None
+    """
+
+    key, _, default_section = _PROPERTY_TYPES[accessor_name]
+
+    def _accessor(self, section=default_section):
+        return self._get_typed(accessor_name, section)
+
+    _accessor.__name__ = accessor_name
+    _accessor.__doc__ = "Get the '{}' property of the given section{}".format(
+        key, " (by default, '{}')".format(default_section) if default_section else "")
+    setattr(Configuration, accessor_name, _accessor)
+
+
+for _accessor_name in _PROPERTY_TYPES:
+    _add_typed_accessor(_accessor_name)
+
+
+def get_configuration(**kwargs):
+    """
+    Get the project Configuration. It is created (and the properties file loaded) on the first call.
+    :param kwargs: Configuration arguments, used only on the first call
+    :return: Configuration
+    """
+
+    global _configuration
+    with _configuration_lock:
+        if _configuration is None:
+            _configuration = Configuration(**kwargs)
+    return _configuration
+
+
+def _update_config(properties, previous_properties):
+    """
+    Configuration subscriber: Keep the 'config' module variable updated
+    """
+
+    global config
+    config = properties
+
 
 def _load_project_properties():
     """
@@ -34,19 +405,20 @@ def _load_project_properties():
     store the resulting dictionary in the config global variable.
     """
 
-    __logger__.info("Loading project properties from %s", PROPERTIES_FILE)
+    if not os.path.exists(PROPERTIES_FILE):
+        __logger__.error('%s properties file CANNOT be opened', PROPERTIES_FILE)
+        return
+
     try:
-        with open(PROPERTIES_FILE) as config_file:
-            try:
-                global config
-                config = json.load(config_file)
-            except Exception, e:
-                __logger__.error('Error parsing config file: %s' % e)
-                sys.exit(1)
-    except IOError, e:
-        __logger__.error('%s properties file CANNOT be opened: %s', PROPERTIES_FILE, e)
+        configuration = get_configuration()
+    except Exception, e:
+        __logger__.error('Error parsing config file: %s' % e)
+        sys.exit(1)
 
-    __logger__.debug("Properties loaded: %s", config)
+    global config
+    config = configuration.as_dict()
+    configuration.unsubscribe(_update_config)
+    configuration.subscribe(_update_config)
 
 
 def set_up_project():
@@ -69,4 +441,11 @@ def set_up_project():
         if not os.path.exists(log_path):
             os.makedirs(log_path)
 
+    """
+    Enable the profiling hooks if the configuration asks for it.
+    """
+    if PROPERTIES_CONFIG_PROFILING in config:
+        from qautils.metrics.profiling_utils import configure_profiling
+        configure_profiling(config[PROPERTIES_CONFIG_PROFILING])
+
     # Overrides if you need more project configurations
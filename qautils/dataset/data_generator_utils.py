@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+"""
+data_generator_utils module contains a seeded bulk test-data generator:
+    - DataGenerator: Generates records from a schema (Python dict/list with tagged values), in batches.
+        * generate: Generator of records for the given shard.
+        * generate_batches: Generator of batches (lists of records) for the given shard.
+        * write_jsonl: Writes the generated records to a JSON-lines file.
+        * write_csv: Writes the generated records to a CSV file (nested elements are flattened).
+
+Schema values are processed as follows:
+    - dict and list values are processed recursively.
+    - Strings matching one of these tags are generated:
+        * [SEQUENCE]: Global record index (int).
+        * [UUID]: Random UUID (string).
+        * [FIRST_NAME], [LAST_NAME], [FULL_NAME]: Random names.
+        * [EMAIL]: Random e-mail address.
+        * [IPV4]: Random IPv4 address.
+        * [BOOLEAN]: Random boolean.
+        * [RANDOM_STRING_WITH_LENGTH_<length>]: Random alphanumeric string. E.g.: [RANDOM_STRING_WITH_LENGTH_15]
+        * [INTEGER_BETWEEN_<min>_AND_<max>]: Random int (both included). E.g.: [INTEGER_BETWEEN_1_AND_100]
+        * [FLOAT_BETWEEN_<min>_AND_<max>]: Random float. E.g.: [FLOAT_BETWEEN_0.5_AND_10]
+        * [ONE_OF_<value>|<value>|...]: Random choice among the given values. E.g.: [ONE_OF_ACTIVE|ERROR]
+    - Any other value is copied as it is.
+
+Records are generated in batches. Each batch uses its own RNG, seeded with (seed, batch number), so the generated
+data depends on the seed, the batch size and the record index: N workers can generate disjoint shards of the same
+dataset in parallel without any coordination (shard 'k' of 'N' generates the batches 'b' where b % N == k), as long
+as all of them use the same seed and the same batch size. A different batch size generates a different dataset.
+If NumPy is installed, a vectorized RNG is used (the values are deterministic too, but not the same ones that are
+generated with the pure Python RNG).
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import csv
+import json
+import random
+import hashlib
+
+from qautils.logger.logger_utils import get_logger
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+__logger__ = get_logger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Data used to generate names and e-mails
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+               "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Lucia",
+               "Javier", "Carmen", "Pablo", "Laura", "Daniel", "Marta", "Alejandro", "Elena", "Manuel", "Sofia"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+              "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson"]
+EMAIL_DOMAIN = "example.com"
+RANDOM_STRING_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+class _PythonRandomBackend(object):
+    """
+    RNG backend based on the standard 'random' module
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def integers(self, low, high, size):
+        """
+        :return (list): 'size' random ints in [low, high]
+        """
+        randint = self.rng.randint
+        return [randint(low, high) for _ in xrange(size)]
+
+    def floats(self, low, high, size):
+        """
+        :return (list): 'size' random floats in [low, high)
+        """
+        uniform = self.rng.uniform
+        return [uniform(low, high) for _ in xrange(size)]
+
+    def strings(self, alphabet, length, size):
+        """
+        :return (list): 'size' random strings of the given length
+        """
+        choice = self.rng.choice
+        return ["".join(choice(alphabet) for _ in xrange(length)) for _ in xrange(size)]
+
+
+class _NumpyRandomBackend(object):
+    """
+    Vectorized RNG backend based on 'numpy.random.RandomState'
+    """
+
+    def __init__(self, seed):
+        self.rng = numpy.random.RandomState(seed)
+
+    def integers(self, low, high, size):
+        """
+        :return (list): 'size' random ints in [low, high]
+        """
+        return self.rng.randint(low, high + 1, size=size).tolist()
+
+    def floats(self, low, high, size):
+        """
+        :return (list): 'size' random floats in [low, high)
+        """
+        return self.rng.uniform(low, high, size=size).tolist()
+
+    def strings(self, alphabet, length, size):
+        """
+        :return (list): 'size' random strings of the given length
+        """
+        if length == 0:
+            return [""] * size
+        chars = numpy.array(list(alphabet), dtype="S1")
+        generated = chars[self.rng.randint(0, len(alphabet), size=(size, length))]
+        return generated.view("S{}".format(length)).ravel().tolist()
+
+
+def _batch_seed(seed, batch_number):
+    """
+    Derive the RNG seed for the given batch. This value only depends on the global seed and the batch number.
+    :param seed: Global seed of the generator
+    :param batch_number (int): Batch number
+    :return (int): 32-bits seed
+    """
+
+    digest = hashlib.md5("{}:{}".format(seed, batch_number)).hexdigest()
+    return int(digest[:8], 16)
+
+
+def _compile_tag(value):
+    """
+    Compile a schema leaf to a column generator.
+    :param value: Schema leaf value
+    :return: Function (backend, first_index, size) -> list of values
+    """
+
+    if not isinstance(value, basestring) or not (value.startswith("[") and value.endswith("]")):
+        return lambda backend, first_index, size: [value] * size
+
+    tag = value[1:-1]
+    if tag == "SEQUENCE":
+        return lambda backend, first_index, size: range(first_index, first_index + size)
+    elif tag == "UUID":
+        import uuid
+
+        def _uuid(backend, first_index, size):
+            parts = [backend.integers(0, 0xffff, size) for _ in xrange(8)]
+            return [str(uuid.UUID(int=reduce(lambda acc, part: (acc << 16) | part, bits, 0), version=4))
+                    for bits in zip(*parts)]
+        return _uuid
+    elif tag == "FIRST_NAME":
+        return lambda backend, first_index, size: [FIRST_NAMES[i] for i in
+                                                   backend.integers(0, len(FIRST_NAMES) - 1, size)]
+    elif tag == "LAST_NAME":
+        return lambda backend, first_index, size: [LAST_NAMES[i] for i in
+                                                   backend.integers(0, len(LAST_NAMES) - 1, size)]
+    elif tag == "FULL_NAME":
+        def _full_name(backend, first_index, size):
+            return ["{} {}".format(FIRST_NAMES[first], LAST_NAMES[last]) for first, last in
+                    zip(backend.integers(0, len(FIRST_NAMES) - 1, size),
+                        backend.integers(0, len(LAST_NAMES) - 1, size))]
+        return _full_name
+    elif tag == "EMAIL":
+        def _email(backend, first_index, size):
+            return ["{}.{}{}@{}".format(FIRST_NAMES[first], LAST_NAMES[last], index, EMAIL_DOMAIN).lower()
+                    for first, last, index in zip(backend.integers(0, len(FIRST_NAMES) - 1, size),
+                                                  backend.integers(0, len(LAST_NAMES) - 1, size),
+                                                  xrange(first_index, first_index + size))]
+        return _email
+    elif tag == "IPV4":
+        def _ipv4(backend, first_index, size):
+            octets = [backend.integers(1 if i == 0 else 0, 254, size) for i in xrange(4)]
+            return ["{}.{}.{}.{}".format(*ip) for ip in zip(*octets)]
+        return _ipv4
+    elif tag == "BOOLEAN":
+        return lambda backend, first_index, size: [bool(i) for i in backend.integers(0, 1, size)]
+    elif tag.startswith("RANDOM_STRING_WITH_LENGTH_"):
+        length = int(tag[len("RANDOM_STRING_WITH_LENGTH_"):])
+        return lambda backend, first_index, size: backend.strings(RANDOM_STRING_ALPHABET, length, size)
+    elif tag.startswith("INTEGER_BETWEEN_") and "_AND_" in tag:
+        low, high = [int(limit) for limit in tag[len("INTEGER_BETWEEN_"):].split("_AND_")]
+        return lambda backend, first_index, size: backend.integers(low, high, size)
+    elif tag.startswith("FLOAT_BETWEEN_") and "_AND_" in tag:
+        low, high = [float(limit) for limit in tag[len("FLOAT_BETWEEN_"):].split("_AND_")]
+        return lambda backend, first_index, size: backend.floats(low, high, size)
+    elif tag.startswith("ONE_OF_"):
+        options = tag[len("ONE_OF_"):].split("|")
+        return lambda backend, first_index, size: [options[i] for i in backend.integers(0, len(options) - 1, size)]
+
+    # Not a generator tag. Copy it as it is.
+    return lambda backend, first_index, size: [value] * size
+
+
+def _compile_schema(schema, path=()):
+    """
+    Compile the schema to a list of column generators.
+    :param schema: Schema (dict, list or leaf value)
+    :param path (tuple): Path of the schema element in the root schema
+    :return (list): List of tuples (path, column generator)
+    """
+
+    columns = list()
+    if isinstance(schema, dict):
+        for key in sorted(schema.keys()):
+            columns.extend(_compile_schema(schema[key], path + (key,)))
+    elif isinstance(schema, list):
+        for index, element in enumerate(schema):
+            columns.extend(_compile_schema(element, path + (index,)))
+    else:
+        columns.append((path, _compile_tag(schema)))
+    return columns
+
+
+def _build_record(schema, values):
+    """
+    Build a record with the same structure than the schema, using the generated values.
+    :param schema: Schema (dict, list or leaf value)
+    :param values: Iterator over the values generated for this record (same order than _compile_schema)
+    :return: New record
+    """
+
+    if isinstance(schema, dict):
+        return dict((key, _build_record(schema[key], values)) for key in sorted(schema.keys()))
+    elif isinstance(schema, list):
+        return [_build_record(element, values) for element in schema]
+    else:
+        return next(values)
+
+
+class DataGenerator(object):
+
+    def __init__(self, schema, seed=0, batch_size=DEFAULT_BATCH_SIZE, use_numpy=None):
+        """
+        Init the DataGenerator.
+        :param schema: Model of the records to generate (dict, list or leaf value). See module doc for tags.
+        :param seed: Global seed. The same seed and batch size always generate the same dataset.
+        :param batch_size (int): Number of records generated in each batch. The records depend on it: all the shards
+        of a dataset must be generated with the same batch size.
+        :param use_numpy (bool): Use the vectorized NumPy RNG. By default, it is used if NumPy is installed.
+        :return: None
+        """
+
+        if use_numpy and numpy is None:
+            raise ImportError("NumPy is not installed")
+
+        self.schema = schema
+        self.seed = seed
+        self.batch_size = batch_size
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self._columns = _compile_schema(schema)
+
+        __logger__.debug("DataGenerator initialized. Seed: '%s'; Batch size: %d; NumPy RNG: %s",
+                         seed, batch_size, self.use_numpy)
+
+    def _new_backend(self, batch_number):
+        """
+        Create the RNG backend for the given batch
+        :param batch_number (int): Batch number
+        :return: RNG backend
+        """
+
+        batch_seed = _batch_seed(self.seed, batch_number)
+        return _NumpyRandomBackend(batch_seed) if self.use_numpy else _PythonRandomBackend(batch_seed)
+
+    def _generate_columns(self, batch_number, size):
+        """
+        Generate the values of all schema leaves for the given batch (column-wise)
+        :param batch_number (int): Batch number
+        :param size (int): Number of records of the batch
+        :return (list): One list of values per schema leaf
+        """
+
+        backend = self._new_backend(batch_number)
+        first_index = batch_number * self.batch_size
+        return [column(backend, first_index, size) for _, column in self._columns]
+
+    def _shard_batches(self, count, shard, num_shards):
+        """
+        Generator of the batches assigned to the given shard
+        :param count (int): Total number of records of the dataset (all shards)
+        :param shard (int): Shard to generate [0, num_shards)
+        :param num_shards (int): Number of shards the dataset is split in
+        :return: Generator of tuples (batch number, batch size)
+        """
+
+        assert 0 <= shard < num_shards, "shard should be in [0, num_shards)"
+
+        num_batches = (count + self.batch_size - 1) // self.batch_size
+        for batch_number in xrange(shard, num_batches, num_shards):
+            yield batch_number, min(self.batch_size, count - batch_number * self.batch_size)
+
+    def generate_batches(self, count, shard=0, num_shards=1):
+        """
+        Generator of batches of records for the given shard
+        :param count (int): Total number of records of the dataset (all shards)
+        :param shard (int): Shard to generate [0, num_shards)
+        :param num_shards (int): Number of shards the dataset is split in
+        :return: Generator of lists of records
+        """
+
+        for batch_number, size in self._shard_batches(count, shard, num_shards):
+            columns = self._generate_columns(batch_number, size)
+            if columns:
+                yield [_build_record(self.schema, iter(values)) for values in zip(*columns)]
+            else:
+                yield [_build_record(self.schema, iter(())) for _ in xrange(size)]
+
+    def generate(self, count, shard=0, num_shards=1):
+        """
+        Generator of records for the given shard
+        :param count (int): Total number of records of the dataset (all shards)
+        :param shard (int): Shard to generate [0, num_shards)
+        :param num_shards (int): Number of shards the dataset is split in
+        :return: Generator of records
+        """
+
+        for batch in self.generate_batches(count, shard, num_shards):
+            for record in batch:
+                yield record
+
+    def write_jsonl(self, file_path, count, shard=0, num_shards=1):
+        """
+        Write the generated records of the given shard to a JSON-lines file (one JSON document per line)
+        :param file_path (string): Target file
+        :param count (int): Total number of records of the dataset (all shards)
+        :param shard (int): Shard to generate [0, num_shards)
+        :param num_shards (int): Number of shards the dataset is split in
+        :return (int): Number of written records
+        """
+
+        __logger__.info("Writing generated data to JSON-lines file '%s' (shard %d/%d)", file_path, shard, num_shards)
+        written = 0
+        encoder = json.JSONEncoder(separators=(',', ':'))
+        with open(file_path, 'w') as target_file:
+            for batch in self.generate_batches(count, shard, num_shards):
+                target_file.write("".join(encoder.encode(record) + "\n" for record in batch))
+                written += len(batch)
+        return written
+
+    def write_csv(self, file_path, count, shard=0, num_shards=1):
+        """
+        Write the generated records of the given shard to a CSV file. Column names are the paths of the elements
+        in the schema, joined with dots. E.g.: 'server.addresses.0'
+        :param file_path (string): Target file
+        :param count (int): Total number of records of the dataset (all shards)
+        :param shard (int): Shard to generate [0, num_shards)
+        :param num_shards (int): Number of shards the dataset is split in
+        :return (int): Number of written records
+        """
+
+        __logger__.info("Writing generated data to CSV file '%s' (shard %d/%d)", file_path, shard, num_shards)
+        written = 0
+        with open(file_path, 'wb') as target_file:
+            writer = csv.writer(target_file)
+            writer.writerow([".".join(str(key) for key in path) or "value" for path, _ in self._columns])
+            for batch_number, size in self._shard_batches(count, shard, num_shards):
+                writer.writerows(zip(*self._generate_columns(batch_number, size)))
+                written += size
+        return written
@@ -20,10 +20,12 @@ __version__ = "1.2.1"
 
 
 import json
+from qautils.metrics.profiling_utils import profiled
 
 
 class DatasetUtils(object):
 
+    @profiled("dataset.prepare_data")
     def prepare_data(self, data):
         """
         Generate a fixed length data for elements tagged with the text [LENGTH]
@@ -55,6 +57,7 @@ class DatasetUtils(object):
 
         return new_param
 
+    @profiled("dataset.remove_missing_params")
     def remove_missing_params(self, data):
         """
         Removes all the data elements tagged with the text [MISSING_PARAM]
@@ -98,6 +101,7 @@ class DatasetUtils(object):
         finally:
             return param
 
+    @profiled("dataset.generate_fixed_length_params")
     def generate_fixed_length_params(self, data):
         """
         Generate a fixed length data for the elements that match the expression
@@ -111,6 +115,7 @@ class DatasetUtils(object):
         finally:
             return data
 
+    @profiled("dataset.infere_datatypes")
     def infere_datatypes(self, data):
         """
         Process the input data and replace the values in string format with the
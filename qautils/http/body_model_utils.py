@@ -15,10 +15,9 @@ __version__ = "1.2.1"
 
 
 from json import JSONEncoder
-import xmltodict
-import xmldict
 from qautils.http.headers_utils import HEADER_REPRESENTATION_JSON, HEADER_REPRESENTATION_XML
 from qautils.logger.logger_utils import get_logger
+from qautils.metrics.profiling_utils import profiled, profile_hook
 
 __logger__ = get_logger(__name__)
 
@@ -31,7 +30,9 @@ def _xml_to_dict(xml_to_convert):
     """
 
     __logger__.debug("Converting to Python dict this XML: " + str(xml_to_convert))
-    return xmltodict.parse(xml_to_convert, attr_prefix='')
+    import xmltodict
+    with profile_hook("body_model.xmltodict_parse"):
+        return xmltodict.parse(xml_to_convert, attr_prefix='')
 
 
 def _dict_to_xml(dict_to_convert):
@@ -42,9 +43,12 @@ def _dict_to_xml(dict_to_convert):
     """
 
     __logger__.debug("Converting to XML the Python dict: " + str(dict_to_convert))
-    return xmldict.dict_to_xml(dict_to_convert)
+    import xmldict
+    with profile_hook("body_model.xmldict_dump"):
+        return xmldict.dict_to_xml(dict_to_convert)
 
 
+@profiled("body_model.response_body_to_dict")
 def response_body_to_dict(http_requests_response, content_type, xml_root_element_name=None, is_list=False):
     """
     Convert a XML or JSON response in a Python dict
@@ -87,6 +91,7 @@ def response_body_to_dict(http_requests_response, content_type, xml_root_element
         return response_body
 
 
+@profiled("body_model.model_to_request_body")
 def model_to_request_body(body_model, content_type, body_model_root_element=None):
     """
     Convert a Python dict (body model) to XML or JSON
@@ -12,13 +12,24 @@ __license__ = " Apache License, Version 2.0"
 __version__ = "1.2.1"
 
 
-import requests
+import time
 from qautils.logger.logger_utils import get_logger, log_print_request, log_print_response
+from qautils.http.traffic_log_utils import get_traffic_log
+from qautils.metrics.metrics_utils import get_metrics_registry
+from qautils.metrics.profiling_utils import profiled, profile_hook
 
 
-requests.packages.urllib3.disable_warnings()
 __logger__ = get_logger(__name__)
 
+_requests_metric = get_metrics_registry().counter("http_requests_total", "HTTP requests launched by RestClient",
+                                                  ("method", "status"))
+_request_duration_metric = get_metrics_registry().histogram("http_request_duration_seconds",
+                                                            "Duration of the HTTP requests launched by RestClient",
+                                                            ("method",))
+
+# 'Requests' lib module. It is imported when the first request is launched (see _get_requests_lib)
+_requests = None
+
 
 # HTTP VERBS
 HTTP_VERB_POST = 'post'
@@ -32,6 +43,20 @@ API_ROOT_URL_ARG_NAME = 'api_root_url'
 URL_ROOT_PATTERN = "{protocol}://{host}:{port}"
 
 
+def _get_requests_lib():
+    """
+    Import 'Requests' lib (and disable its warnings) the first time it is needed
+    :return: 'requests' module
+    """
+
+    global _requests
+    if _requests is None:
+        import requests
+        requests.packages.urllib3.disable_warnings()
+        _requests = requests
+    return _requests
+
+
 class RestClient(object):
 
     api_root_url = None
@@ -61,6 +86,7 @@ class RestClient(object):
         """
         return URL_ROOT_PATTERN.format(protocol=protocol, host=host, port=port)
 
+    @profiled("rest_client._call_api")
     def _call_api(self, uri_pattern, method, body=None, headers=None, parameters=None, **kwargs):
         """
         Launch HTTP request to the API with given arguments
@@ -77,19 +103,35 @@ class RestClient(object):
         """
 
         kwargs[API_ROOT_URL_ARG_NAME] = self.api_root_url
-        url = uri_pattern.format(**kwargs)
+        with profile_hook("rest_client.format_url"):
+            url = uri_pattern.format(**kwargs)
         __logger__.info("Executing API request [%s %s]", method, url)
 
-        log_print_request(__logger__, method, url, parameters, headers, body)
+        with profile_hook("rest_client.log_request"):
+            log_print_request(__logger__, method, url, parameters, headers, body)
 
+        requests = _get_requests_lib()
+        traffic_log = get_traffic_log()
+        start_time = time.time()
         try:
-            response = requests.request(method=method, url=url, data=body, headers=headers, params=parameters,
-                                        verify=False)
+            with profile_hook("rest_client.request"):
+                response = requests.request(method=method, url=url, data=body, headers=headers, params=parameters,
+                                            verify=False)
         except Exception, e:
             __logger__.error("Request {} to {} crashed: {}".format(method, url, str(e)))
+            _requests_metric.labels(method.upper(), "error").inc()
+            if traffic_log is not None:
+                traffic_log.log_exchange(method, uri_pattern, url, body, elapsed=time.time() - start_time, error=e)
             raise e
 
-        log_print_response(__logger__, response)
+        elapsed = time.time() - start_time
+        _requests_metric.labels(method.upper(), str(response.status_code)).inc()
+        _request_duration_metric.labels(method.upper()).observe(elapsed)
+        if traffic_log is not None:
+            traffic_log.log_exchange(method, uri_pattern, url, body, response, elapsed=elapsed)
+
+        with profile_hook("rest_client.log_response"):
+            log_print_response(__logger__, response)
 
         return response
 
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""
+traffic_log_utils module contains a structured HTTP traffic log:
+    - TrafficLog: Writes one JSON document per line (JSON-lines) for each request/response exchange, with
+      method, URL pattern, status code, sizes, timings and (small) bodies. It supports sampling (1-in-N or errors only)
+      and file rotation.
+    - enable_traffic_log / disable_traffic_log / get_traffic_log: Manage the traffic log used by RestClient.
+    - summarize_traffic_log: Stream one or more traffic log files and compute per-endpoint stats.
+
+Traffic log files can be summarized from the command line:
+    python -m qautils.http.traffic_log_utils ./logs/traffic.jsonl [./logs/traffic.jsonl.1 ...]
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import sys
+import json
+import math
+import time
+import logging
+import threading
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+# Name of the logger used to write the traffic records. It does not propagate to its parents.
+TRAFFIC_LOGGER_NAME = "qautils.traffic"
+
+DEFAULT_MAX_BODY_SIZE = 1024
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# Latency histogram used by the summarizer: bucket 'i' holds latencies in [HISTOGRAM_BASE^i, HISTOGRAM_BASE^(i+1)) ms
+HISTOGRAM_BASE = 1.05
+
+# Traffic log used by RestClient (None: disabled)
+_traffic_log = None
+
+
+class TrafficLog(object):
+
+    def __init__(self, file_path, sample_rate=1, errors_only=False, max_body_size=DEFAULT_MAX_BODY_SIZE,
+                 max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        """
+        Init the TrafficLog. Records are written with the logger TRAFFIC_LOGGER_NAME, so it can be made
+        asynchronous with logger_utils.enable_async_logging(TRAFFIC_LOGGER_NAME). The file is still rotated in
+        asynchronous mode (rotating handlers are not batch-written, see async_handler_utils).
+        :param file_path (string): Target file
+        :param sample_rate (int): Only 1 of every 'sample_rate' successful exchanges is written. Errors
+        (status code >= 400 or failed requests) are always written.
+        :param errors_only (bool): Only write errors
+        :param max_body_size (int): Bodies bigger than this size (bytes) are not written. 0 to not write bodies.
+        :param max_bytes (int): Rotate the file when it reaches this size (bytes). 0 to disable rotation.
+        :param backup_count (int): Number of rotated files to keep
+        :return: None
+        """
+
+        self.file_path = file_path
+        self.sample_rate = max(1, sample_rate)
+        self.errors_only = errors_only
+        self.max_body_size = max_body_size
+
+        self.exchange_count = 0
+        self.written_count = 0
+        self._counter_lock = threading.Lock()
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+
+        from logging.handlers import RotatingFileHandler
+        self.handler = RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger = logging.getLogger(TRAFFIC_LOGGER_NAME)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def close(self):
+        """
+        Stop writing records and close the file. If the logger was made asynchronous, the AsyncHandler writing to the
+        file is flushed first (and removed if the file was its only target).
+        :return: None
+        """
+
+        from qautils.logger.async_handler_utils import AsyncHandler
+        for handler in list(self.logger.handlers):
+            if isinstance(handler, AsyncHandler) and self.handler in handler.targets:
+                handler.flush()
+                handler.setTarget([target for target in handler.targets if target is not self.handler])
+                if not handler.targets:
+                    self.logger.removeHandler(handler)
+                    handler.close()
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def _is_sampled(self, is_error):
+        """
+        Check if the exchange should be written, using the sampling config
+        :param is_error (bool): The exchange is an error
+        :return (bool): True if the exchange should be written
+        """
+
+        with self._counter_lock:
+            self.exchange_count += 1
+            exchange_number = self.exchange_count
+
+        if is_error:
+            return True
+        return not self.errors_only and exchange_number % self.sample_rate == 0
+
+    def _get_body(self, body):
+        """
+        Get the body to write in the record, if its size is under the limit
+        :param body: Raw body
+        :return (unicode): Body or None if it should not be written
+        """
+
+        if not body or len(body) > self.max_body_size:
+            return None
+        return body if isinstance(body, unicode) else body.decode('utf-8', 'replace')
+
+    def log_exchange(self, method, url_pattern, url, request_body=None, response=None, elapsed=None, error=None):
+        """
+        Write the record of a request/response exchange (if sampled)
+        :param method (string): HTTP method
+        :param url_pattern (string): URL pattern used to build the URL (RestClient uri_pattern)
+        :param url (string): Requested URL
+        :param request_body: Raw body sent
+        :param response: HTTP response ('Requests' lib) or None if the request failed
+        :param elapsed (float): Total time of the exchange (seconds)
+        :param error: Exception raised by the request, if any
+        :return: None
+        """
+
+        status_code = response.status_code if response is not None else None
+        is_error = error is not None or status_code is None or status_code >= 400
+        if not self._is_sampled(is_error):
+            return
+
+        response_content = response.content if response is not None else None
+        record = {'ts': time.time(),
+                  'method': method.upper(),
+                  'pattern': url_pattern,
+                  'url': url,
+                  'status': status_code,
+                  'req_size': len(request_body) if request_body else 0,
+                  'resp_size': len(response_content) if response_content else 0,
+                  'elapsed_ms': round(elapsed * 1000, 3) if elapsed is not None else None}
+        if response is not None and getattr(response, 'elapsed', None) is not None:
+            record['ttfb_ms'] = round(response.elapsed.total_seconds() * 1000, 3)
+        if error is not None:
+            record['error'] = repr(error)
+
+        request_body = self._get_body(request_body)
+        if request_body is not None:
+            record['req_body'] = request_body
+        response_content = self._get_body(response_content)
+        if response_content is not None:
+            record['resp_body'] = response_content
+
+        self.logger.info(self._encoder.encode(record))
+        with self._counter_lock:
+            self.written_count += 1
+
+
+def enable_traffic_log(file_path, **kwargs):
+    """
+    Enable the structured traffic log for all RestClients. Previous traffic log (if any) is closed.
+    :param file_path (string): Target file
+    :param kwargs: TrafficLog arguments (sample_rate, errors_only, max_body_size, max_bytes, backup_count)
+    :return: The TrafficLog
+    """
+
+    global _traffic_log
+    disable_traffic_log()
+    __logger__.info("Enabling HTTP traffic log: %s", file_path)
+    _traffic_log = TrafficLog(file_path, **kwargs)
+    return _traffic_log
+
+
+def disable_traffic_log():
+    """
+    Disable and close the structured traffic log
+    :return: None
+    """
+
+    global _traffic_log
+    if _traffic_log is not None:
+        _traffic_log.close()
+        _traffic_log = None
+
+
+def get_traffic_log():
+    """
+    Get the enabled traffic log
+    :return: The TrafficLog or None if it is disabled
+    """
+
+    return _traffic_log
+
+
+def _histogram_percentile(histogram, count, percentile):
+    """
+    Get an approximate percentile (upper bound of the bucket) from the latency histogram
+    :param histogram (dict): Bucket index -> count
+    :param count (int): Number of values in the histogram
+    :param percentile (float): Percentile [0, 100]
+    :return (float): Latency (ms)
+    """
+
+    if count == 0:
+        return None
+    rank = math.ceil(count * percentile / 100.0)
+    accumulated = 0
+    for bucket in sorted(histogram.keys()):
+        accumulated += histogram[bucket]
+        if accumulated >= rank:
+            return round(HISTOGRAM_BASE ** (bucket + 1), 3)
+
+
+def summarize_traffic_log(*file_paths):
+    """
+    Stream the given traffic log files and compute stats for each endpoint (method and URL pattern). Memory usage
+    does not depend on the size of the files: latency percentiles are computed from a fixed-bucket histogram
+    (approximated, ~5% error).
+    :param file_paths: Traffic log files
+    :return (dict): 'METHOD pattern' -> dict with count, errors, status (dict of status code -> count),
+    req_bytes, resp_bytes, and latency stats (ms): min, mean, max, p50, p90, p99
+    """
+
+    endpoints = dict()
+    for file_path in file_paths:
+        with open(file_path) as traffic_file:
+            for line in traffic_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    __logger__.warning("Malformed record in traffic log '%s'", file_path)
+                    continue
+
+                key = "{} {}".format(record.get('method'), record.get('pattern'))
+                stats = endpoints.get(key)
+                if stats is None:
+                    stats = endpoints[key] = {'count': 0, 'errors': 0, 'status': dict(), 'req_bytes': 0,
+                                              'resp_bytes': 0, 'latency_sum': 0.0, 'latency_count': 0,
+                                              'min': None, 'max': None, 'histogram': dict()}
+
+                status = record.get('status')
+                stats['count'] += 1
+                stats['status'][status] = stats['status'].get(status, 0) + 1
+                if status is None or status >= 400 or 'error' in record:
+                    stats['errors'] += 1
+                stats['req_bytes'] += record.get('req_size') or 0
+                stats['resp_bytes'] += record.get('resp_size') or 0
+
+                elapsed = record.get('elapsed_ms')
+                if elapsed is not None:
+                    stats['latency_sum'] += elapsed
+                    stats['latency_count'] += 1
+                    stats['min'] = elapsed if stats['min'] is None else min(stats['min'], elapsed)
+                    stats['max'] = elapsed if stats['max'] is None else max(stats['max'], elapsed)
+                    bucket = int(math.floor(math.log(max(elapsed, 0.001), HISTOGRAM_BASE)))
+                    stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+
+    for stats in endpoints.values():
+        histogram = stats.pop('histogram')
+        latency_count = stats.pop('latency_count')
+        latency_sum = stats.pop('latency_sum')
+        stats['mean'] = round(latency_sum / latency_count, 3) if latency_count else None
+        for percentile in (50, 90, 99):
+            value = _histogram_percentile(histogram, latency_count, percentile)
+            stats['p{}'.format(percentile)] = min(value, stats['max']) if value is not None else None
+
+    return endpoints
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Usage: python -m qautils.http.traffic_log_utils TRAFFIC_LOG_FILE [TRAFFIC_LOG_FILE ...]"
+        sys.exit(1)
+
+    summary = summarize_traffic_log(*sys.argv[1:])
+    row_pattern = "{:<50} {:>8} {:>7} {:>10} {:>10} {:>10} {:>10}"
+    print row_pattern.format("ENDPOINT", "COUNT", "ERRORS", "MEAN(ms)", "P50(ms)", "P99(ms)", "MAX(ms)")
+    for endpoint in sorted(summary.keys()):
+        stats = summary[endpoint]
+        print row_pattern.format(endpoint, stats['count'], stats['errors'], stats['mean'], stats['p50'],
+                                 stats['p99'], stats['max'])
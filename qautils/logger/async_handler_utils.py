@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+async_handler_utils module contains a non-blocking logging handler:
+    - AsyncHandler: Handler that enqueues the log records in a bounded queue. A background thread takes them from the
+      queue in batches and writes them to the target handlers (one write and one flush per batch for plain
+      StreamHandler/FileHandler targets; other handlers, like the rotating ones, handle each record). When the queue is
+      full, records are dropped ('drop' policy) or the caller waits ('block' policy).
+    - get_async_handlers_stats: Counters of all created AsyncHandlers.
+
+AsyncHandler extends logging.handlers.MemoryHandler, so it can be configured from the logging configuration file
+using the 'target' option. E.g.:
+
+    [handler_asyncFileHandler]
+    class=qautils.logger.async_handler_utils.AsyncHandler
+    args=(10000, 'drop', 500)
+    target=fileHandler
+
+The target handler should be declared before the AsyncHandler in the [handlers] keys list, so it is closed after
+the AsyncHandler at shutdown.
+
+This module does not use qautils loggers: log records emitted from a handler could be enqueued in the handler itself.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import logging
+import logging.handlers
+import threading
+import weakref
+import Queue
+
+
+# Queue policies when it is full
+POLICY_DROP = 'drop'
+POLICY_BLOCK = 'block'
+
+DEFAULT_CAPACITY = 10000
+DEFAULT_BATCH_SIZE = 500
+
+# Target handler classes written in batches (see AsyncHandler._write_batch). Only these exact classes: subclasses
+# (RotatingFileHandler, TimedRotatingFileHandler...) may do more things in emit, like rolling the file over.
+_BATCH_WRITE_HANDLER_CLASSES = (logging.StreamHandler, logging.FileHandler)
+
+# Queue item to stop the listener thread
+_STOP_LISTENER = object()
+
+# All created handlers, to collect stats
+_async_handlers = weakref.WeakSet()
+
+
+class AsyncHandler(logging.handlers.MemoryHandler):
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, policy=POLICY_DROP, batch_size=DEFAULT_BATCH_SIZE, target=None):
+        """
+        Init the AsyncHandler and start its listener thread
+        :param capacity (int): Max number of records waiting in the queue
+        :param policy (string): What to do when the queue is full [drop | block]
+        :param batch_size (int): Max number of records written to the targets at once
+        :param target: Target handler or list of target handlers
+        :return: None
+        """
+
+        assert policy in (POLICY_DROP, POLICY_BLOCK), "policy should be '{}' or '{}'".format(POLICY_DROP,
+                                                                                           POLICY_BLOCK)
+        logging.handlers.MemoryHandler.__init__(self, capacity)
+        self.policy = policy
+        self.batch_size = batch_size
+        self.targets = list()
+        self.setTarget(target)
+
+        self.queue = Queue.Queue(capacity)
+        self.enqueued_count = 0
+        self.dropped_count = 0
+        self.written_count = 0
+        self.batch_count = 0
+        self._counters_lock = threading.Lock()
+
+        self._listener = threading.Thread(target=self._listen, name="qautils-async-log")
+        self._listener.daemon = True
+        self._listener.start()
+        _async_handlers.add(self)
+
+        from qautils.metrics.metrics_utils import get_metrics_registry
+        get_metrics_registry().register_collector("async_logging", get_async_handlers_stats)
+
+    def setTarget(self, target):
+        """
+        Set the target handlers. Called by logging.config.fileConfig with the handler given in the 'target' option.
+        :param target: Target handler or list of target handlers
+        :return: None
+        """
+
+        if target is None:
+            self.targets = list()
+        elif isinstance(target, (list, tuple)):
+            self.targets = list(target)
+        else:
+            self.targets = [target]
+        self.target = self.targets[0] if self.targets else None
+
+    @staticmethod
+    def _prepare(record):
+        """
+        Prepare the record to be processed by other thread: merge message and args, and render the exception.
+        :param record: LogRecord
+        :return: None
+        """
+
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+    def emit(self, record):
+        """
+        Enqueue the record. It does not wait for the record to be written.
+        :param record: LogRecord
+        :return: None
+        """
+
+        try:
+            self._prepare(record)
+            if not self._listener.is_alive():
+                # Closed handler: nothing would take the record from the queue
+                for target in self.targets:
+                    self._write_batch(target, [record])
+                return
+            if self.policy == POLICY_BLOCK:
+                self.queue.put(record)
+            else:
+                self.queue.put_nowait(record)
+            with self._counters_lock:
+                self.enqueued_count += 1
+        except Queue.Full:
+            with self._counters_lock:
+                self.dropped_count += 1
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def shouldFlush(self, record):
+        """
+        Records are not buffered by MemoryHandler. See emit.
+        """
+        return False
+
+    def flush(self):
+        """
+        Wait until all enqueued records are written and flush the targets.
+        :return: None
+        """
+
+        if self._listener.is_alive():
+            self.queue.join()
+        for target in self.targets:
+            target.flush()
+
+    def close(self):
+        """
+        Stop the listener thread after writing all enqueued records.
+        :return: None
+        """
+
+        if self._listener.is_alive():
+            self.queue.put(_STOP_LISTENER)
+            self._listener.join()
+        for target in self.targets:
+            target.flush()
+        logging.Handler.close(self)
+
+    def get_stats(self):
+        """
+        Get handler counters
+        :return (dict): enqueued, dropped, written, batches and queued (current size of the queue) counters
+        """
+
+        with self._counters_lock:
+            return {'enqueued': self.enqueued_count,
+                    'dropped': self.dropped_count,
+                    'written': self.written_count,
+                    'batches': self.batch_count,
+                    'queued': self.queue.qsize()}
+
+    def _listen(self):
+        """
+        Listener thread: Take records from the queue in batches and write them to the targets.
+        :return: None
+        """
+
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            # Records enqueued after the stop request (emit called while closing) are written before stopping
+            records = [record for record in batch if record is not _STOP_LISTENER]
+            stop = len(records) < len(batch)
+            try:
+                if records:
+                    for target in self.targets:
+                        self._write_batch(target, records)
+                    with self._counters_lock:
+                        self.written_count += len(records)
+                        self.batch_count += 1
+            except:
+                # The listener must not die: 'block' callers would hang when the queue is full
+                self.handleError(records[-1])
+            finally:
+                for _ in xrange(len(batch)):
+                    self.queue.task_done()
+
+    @staticmethod
+    def _write_batch(target, records):
+        """
+        Write a batch of records to the target handler. Plain stream handlers and file handlers (without encoding)
+        are written with only one write and one flush. Other handlers, including their subclasses (e.g. rotating
+        file handlers, which roll the file over in emit), handle the records one by one.
+        :param target: Target handler
+        :param records: List of LogRecords
+        :return: None
+        """
+
+        if type(target) not in _BATCH_WRITE_HANDLER_CLASSES or getattr(target, 'encoding', None):
+            for record in records:
+                try:
+                    if record.levelno >= target.level:
+                        target.handle(record)
+                except:
+                    target.handleError(record)
+            return
+
+        lines = list()
+        for record in records:
+            try:
+                if record.levelno >= target.level and target.filter(record):
+                    line = target.format(record)
+                    lines.append(line.encode('utf-8') if isinstance(line, unicode) else line)
+            except:
+                target.handleError(record)
+
+        if not lines:
+            return
+
+        target.acquire()
+        try:
+            if target.stream is None and isinstance(target, logging.FileHandler):
+                # FileHandler with delay=True (or closed)
+                target.stream = target._open()
+            target.stream.write("\n".join(lines) + "\n")
+            target.stream.flush()
+        except:
+            target.handleError(records[-1])
+        finally:
+            target.release()
+
+
+def get_async_handlers_stats():
+    """
+    Get the counters of all created AsyncHandlers, added up
+    :return (dict): enqueued, dropped, written, batches and queued counters
+    """
+
+    stats = {'enqueued': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'queued': 0}
+    for handler in list(_async_handlers):
+        for key, value in handler.get_stats().iteritems():
+            stats[key] += value
+    return stats
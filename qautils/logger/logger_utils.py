@@ -6,6 +6,9 @@ logger_utils module contains some functions for logging management:
     - Fuctions for pretty print:
         - log_print_request
         - log_print_response
+    - Asynchronous logging (see async_handler_utils):
+        - enable_async_logging
+        - get_async_logging_stats
 
 This code is based on:
      https://pdihub.hi.inet/fiware/fiware-iotqaUtils/raw/develop/iotqautils/iotqaLogger.py
@@ -19,16 +22,30 @@ __version__ = "1.2.1"
 
 
 import logging
-import logging.config
-from xml.dom.minidom import parseString
 import json
 import os
 from qautils.configuration.configuration_properties import PROPERTIES_LOG_FILE
+from qautils.metrics.profiling_utils import profiled
 
 
-# Load logging configuration from file if it exists
-if os.path.exists(PROPERTIES_LOG_FILE):
-    logging.config.fileConfig(PROPERTIES_LOG_FILE)
+# Logging configuration is loaded from file (if it exists) when the first logger is requested
+_logging_configured = False
+
+
+def _configure_logging():
+    """
+    Load logging configuration from PROPERTIES_LOG_FILE, if it exists. Only the first call loads it.
+    :return: None
+    """
+
+    global _logging_configured
+    if _logging_configured:
+        return
+
+    _logging_configured = True
+    if os.path.exists(PROPERTIES_LOG_FILE):
+        import logging.config
+        logging.config.fileConfig(PROPERTIES_LOG_FILE)
 
 
 def get_logger(name):
@@ -38,10 +55,51 @@ def get_logger(name):
     :return: Logger
     """
 
+    _configure_logging()
     logger = logging.getLogger(name)
     return logger
 
 
+def enable_async_logging(name=None, capacity=None, policy=None, batch_size=None):
+    """
+    Replace the handlers of the given logger by an AsyncHandler writing to them. Log calls will not wait for the
+    handlers I/O anymore.
+    Async logging can also be configured in the logging configuration file (see async_handler_utils).
+    :param name: Name of the logger. Root logger by default.
+    :param capacity (int): Max number of records waiting to be written. By default, DEFAULT_CAPACITY
+    :param policy (string): What to do when there are 'capacity' records waiting [drop | block]. By default, drop.
+    :param batch_size (int): Max number of records written at once. By default, DEFAULT_BATCH_SIZE
+    :return: The AsyncHandler or None if the logger has no handlers or they are already asynchronous
+    """
+
+    from qautils.logger.async_handler_utils import AsyncHandler, DEFAULT_CAPACITY, DEFAULT_BATCH_SIZE, POLICY_DROP
+    capacity = DEFAULT_CAPACITY if capacity is None else capacity
+    policy = POLICY_DROP if policy is None else policy
+    batch_size = DEFAULT_BATCH_SIZE if batch_size is None else batch_size
+
+    logger = logging.getLogger(name)
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, AsyncHandler)]
+    if not handlers:
+        return None
+
+    async_handler = AsyncHandler(capacity, policy, batch_size, target=handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(async_handler)
+    return async_handler
+
+
+def get_async_logging_stats():
+    """
+    Get counters of the asynchronous logging: enqueued, dropped, written, batches and queued records.
+    :return (dict): Counters of all AsyncHandlers, added up
+    """
+
+    from qautils.logger.async_handler_utils import get_async_handlers_stats
+    return get_async_handlers_stats()
+
+
+@profiled("logger._get_pretty_body")
 def _get_pretty_body(headers, body):
     """
     Return a pretty printed body using the Content-Type header information
@@ -53,6 +111,7 @@ def _get_pretty_body(headers, body):
     from qautils.http.headers_utils import HEADER_CONTENT_TYPE, HEADER_REPRESENTATION_XML, HEADER_REPRESENTATION_JSON
     if HEADER_CONTENT_TYPE in headers:
         if HEADER_REPRESENTATION_XML == headers[HEADER_CONTENT_TYPE]:
+            from xml.dom.minidom import parseString
             xml_parsed = parseString(body)
             pretty_xml_as_string = xml_parsed.toprettyxml()
             return pretty_xml_as_string
@@ -78,6 +137,10 @@ def log_print_request(logger, method, url, query_params=None, headers=None, body
     :return: None
     """
 
+    # Do not pretty print the messages if they are not going to be logged
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
     log_msg = '>>>>>>>>>>>>>>>>>>>>> Request >>>>>>>>>>>>>>>>>>> \n'
     log_msg += '\t> Method: %s\n' % method
     log_msg += '\t> Url: %s\n' % url
@@ -99,6 +162,9 @@ def log_print_response(logger, response):
     :return: None
     """
 
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
     log_msg = '<<<<<<<<<<<<<<<<<<<<<< Response <<<<<<<<<<<<<<<<<<\n'
     log_msg += '\t< Response code: {}\n'.format(str(response.status_code))
     log_msg += '\t< Headers: {}\n'.format(str(dict(response.headers)))
@@ -0,0 +1,659 @@
+# -*- coding: utf-8 -*-
+
+"""
+metrics_utils module contains an in-process metrics registry shared by the qautils subsystems:
+    - Counter, Gauge, Histogram: Metrics with optional labels. Counters and histograms are updated in per-thread
+      shards (no lock in the hot path) and added up when a snapshot is taken. The shard of a thread is merged when
+      the thread ends. Histograms have fixed buckets (fixed memory).
+    - MetricsRegistry: Creates the metrics and keeps the collectors (functions returning the stats of a subsystem,
+      read on each snapshot). Snapshots are exported to JSON, to the Prometheus text format (file or local HTTP
+      endpoint).
+    - get_metrics_registry: Returns the shared MetricsRegistry, where RestClient, RemoteTail (tail engine and capture
+      writers), FabricUtils, commandline_utils, the SSH connection pool, the asynchronous logging and
+      OpenStackClients register their metrics.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import re
+import json
+import time
+import bisect
+import weakref
+import threading
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+# Prefix of all the exported metric names
+METRIC_PREFIX = "qautils_"
+
+# Default histogram buckets (upper bounds, seconds)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DEFAULT_HTTP_HOST = "127.0.0.1"
+DEFAULT_HTTP_PORT = 9464
+
+TYPE_COUNTER = 'counter'
+TYPE_GAUGE = 'gauge'
+TYPE_HISTOGRAM = 'histogram'
+
+_INVALID_NAME_CHARACTERS = re.compile(r"[^a-zA-Z0-9_]")
+
+# Shared registry (see get_metrics_registry)
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _sanitize_name(name):
+    return _INVALID_NAME_CHARACTERS.sub("_", name)
+
+
+def _escape_label_value(value):
+    return unicode(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    """
+    :return (string): Prometheus labels: {name="value",...} (empty string without labels)
+    """
+
+    pairs = zip(label_names, label_values)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(u'{}="{}"'.format(name, _escape_label_value(value)) for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardHolder(object):
+    """
+    Per-thread reference to the shard of a thread. It is released when the thread ends (see _ShardedValues).
+    """
+
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class _ShardedValues(object):
+    """
+    Values updated by many threads: each thread updates its own list (no lock), and readers add up all the lists.
+    When a thread ends, its values are added to the base values and its list is dropped, so the memory depends on
+    the live threads, not on all the threads that ever updated the values.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._base = [0] * size
+        # Weak reference to the holder of each live thread -> shard
+        self._shards = dict()
+        # Reentrant: the weak reference callback could run in a thread holding the lock
+        self._lock = threading.RLock()
+
+    def get_shard(self):
+        """
+        :return (list): Values of the current thread
+        """
+
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = self._local.holder = _ShardHolder([0] * self._size)
+            with self._lock:
+                self._shards[weakref.ref(holder, self._fold_shard)] = holder.shard
+        return holder.shard
+
+    def _fold_shard(self, holder_reference):
+        """
+        Add the values of an ended thread to the base values (weak reference callback)
+        :param holder_reference: Weak reference to the _ShardHolder of the thread
+        :return: None
+        """
+
+        with self._lock:
+            shard = self._shards.pop(holder_reference, None)
+            if shard is not None:
+                for index, value in enumerate(shard):
+                    self._base[index] += value
+
+    def get_totals(self):
+        """
+        :return (list): Sum of the values of all the threads
+        """
+
+        with self._lock:
+            totals = list(self._base)
+            shards = self._shards.values()
+        for shard in shards:
+            for index, value in enumerate(shard):
+                totals[index] += value
+        return totals
+
+    def get_shards_count(self):
+        """
+        :return (int): Number of shards (threads alive that have updated the values)
+        """
+
+        with self._lock:
+            return len(self._shards)
+
+    def reset(self):
+        """
+        Set the values of all the threads to zero. The shards of the other threads are zeroed without
+        synchronisation: an update made by a thread while the values are being reset may be lost.
+        :return: None
+        """
+
+        with self._lock:
+            self._base[:] = [0] * self._size
+            for shard in self._shards.itervalues():
+                shard[:] = [0] * self._size
+
+
+class _Metric(object):
+
+    type = None
+
+    def __init__(self, name, description="", label_names=()):
+        """
+        Init the metric
+        :param name (string): Metric name (without METRIC_PREFIX)
+        :param description (string): Help text
+        :param label_names (tuple): Label names. Values are given with 'labels'.
+        :return: None
+        """
+
+        self.name = _sanitize_name(name)
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._children = dict()
+        self._lock = threading.Lock()
+
+    def labels(self, *label_values):
+        """
+        Get the metric of the given label values (created on first use)
+        :param label_values: Values of the labels, in the order of label_names
+        :return: Metric child (same methods as the metric without labels)
+        """
+
+        child = self._children.get(label_values)
+        if child is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError("Metric '{}' expects labels {}".format(self.name, self.label_names))
+            with self._lock:
+                child = self._children.get(label_values)
+                if child is None:
+                    child = self._children[label_values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def _get_default_child(self):
+        return self.labels()
+
+    def get_children(self):
+        """
+        :return (list): (label values, child) of all the label values used
+        """
+
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class _CounterChild(object):
+
+    def __init__(self):
+        self._values = _ShardedValues(1)
+
+    def inc(self, amount=1):
+        self._values.get_shard()[0] += amount
+
+    def get(self):
+        return self._values.get_totals()[0]
+
+    def reset(self):
+        self._values.reset()
+
+
+class Counter(_Metric):
+
+    type = TYPE_COUNTER
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """
+        Increment the counter (without labels)
+        :param amount (number): Increment
+        :return: None
+        """
+
+        self._get_default_child().inc(amount)
+
+    def get(self):
+        return self._get_default_child().get()
+
+
+class _GaugeChild(object):
+
+    def __init__(self):
+        self._value = 0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """
+        Read the value from a function on each snapshot
+        :param function (function): Returns the value
+        :return: None
+        """
+
+        self._function = function
+
+    def get(self):
+        return self._function() if self._function is not None else self._value
+
+    def reset(self):
+        self._value = 0
+
+
+class Gauge(_Metric):
+
+    type = TYPE_GAUGE
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._get_default_child().set(value)
+
+    def inc(self, amount=1):
+        self._get_default_child().inc(amount)
+
+    def dec(self, amount=1):
+        self._get_default_child().dec(amount)
+
+    def set_function(self, function):
+        self._get_default_child().set_function(function)
+
+    def get(self):
+        return self._get_default_child().get()
+
+
+class _HistogramChild(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, +Inf bucket, count and sum
+        self._values = _ShardedValues(len(buckets) + 3)
+
+    def observe(self, value):
+        shard = self._values.get_shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-2] += 1
+        shard[-1] += value
+
+    def time(self):
+        """
+        :return: Context manager that observes the elapsed time (seconds) of its block
+        """
+        return _Timer(self)
+
+    def get(self):
+        """
+        :return (dict): buckets (list of (upper bound, cumulative count)), count, sum
+        """
+
+        totals = self._values.get_totals()
+        cumulative = 0
+        buckets = list()
+        for upper_bound, count in zip(self.buckets + (float('inf'),), totals[:-2]):
+            cumulative += count
+            buckets.append((upper_bound, cumulative))
+        return {'buckets': buckets, 'count': totals[-2], 'sum': totals[-1]}
+
+    def reset(self):
+        self._values.reset()
+
+
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.time() - self.start_time)
+
+
+class Histogram(_Metric):
+
+    type = TYPE_HISTOGRAM
+
+    def __init__(self, name, description="", label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Init the histogram
+        :param name (string): Metric name (without METRIC_PREFIX)
+        :param description (string): Help text
+        :param label_names (tuple): Label names
+        :param buckets (tuple): Upper bounds of the buckets, sorted
+        :return: None
+        """
+
+        super(Histogram, self).__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._get_default_child().observe(value)
+
+    def time(self):
+        return self._get_default_child().time()
+
+    def get(self):
+        return self._get_default_child().get()
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        """
+        Init the MetricsRegistry
+        :return: None
+        """
+
+        self._metrics = dict()
+        self._collectors = dict()
+        self._lock = threading.Lock()
+        self._http_server = None
+
+    def _get_or_create(self, metric_class, name, description, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, description, label_names, **kwargs)
+            elif not isinstance(metric, metric_class) or metric.label_names != tuple(label_names):
+                raise ValueError("Metric '{}' already registered with another type or labels".format(name))
+            return metric
+
+    def counter(self, name, description="", label_names=()):
+        """
+        Get the counter with this name (created on first call)
+        :param name (string): Metric name (without METRIC_PREFIX)
+        :param description (string): Help text
+        :param label_names (tuple): Label names
+        :return: Counter
+        """
+
+        return self._get_or_create(Counter, name, description, label_names)
+
+    def gauge(self, name, description="", label_names=()):
+        """
+        Get the gauge with this name (created on first call)
+        :param name (string): Metric name (without METRIC_PREFIX)
+        :param description (string): Help text
+        :param label_names (tuple): Label names
+        :return: Gauge
+        """
+
+        return self._get_or_create(Gauge, name, description, label_names)
+
+    def histogram(self, name, description="", label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Get the histogram with this name (created on first call)
+        :param name (string): Metric name (without METRIC_PREFIX)
+        :param description (string): Help text
+        :param label_names (tuple): Label names
+        :param buckets (tuple): Upper bounds of the buckets
+        :return: Histogram
+        """
+
+        return self._get_or_create(Histogram, name, description, label_names, buckets=buckets)
+
+    def register_collector(self, name, function):
+        """
+        Register a collector: a function returning the stats of a subsystem, read on each snapshot. Numeric values
+        are exported as gauges named '<name>_<key>'. Nested dicts (e.g. stats by command) are exported with the
+        outer key as the 'key' label. Registering the same name again replaces the collector.
+        :param name (string): Collector name (metric name prefix)
+        :param function (function): Returns a dict of stats
+        :return: None
+        """
+
+        with self._lock:
+            self._collectors[_sanitize_name(name)] = function
+
+    def unregister_collector(self, name):
+        with self._lock:
+            self._collectors.pop(_sanitize_name(name), None)
+
+    def _collect(self):
+        """
+        Read the collectors
+        :return (list): (name, [(labels dict, value)]) of the collector values
+        """
+
+        with self._lock:
+            collectors = sorted(self._collectors.items())
+        samples = dict()
+        for collector_name, function in collectors:
+            try:
+                stats = function() or dict()
+            except Exception, e:
+                __logger__.debug("Metrics: Error in collector '%s': %s", collector_name, str(e))
+                continue
+            for key, value in stats.iteritems():
+                if isinstance(value, dict):
+                    for stat_name, stat_value in value.iteritems():
+                        if isinstance(stat_value, (int, long, float)) and not isinstance(stat_value, bool):
+                            samples.setdefault(_sanitize_name("{}_{}".format(collector_name, stat_name)),
+                                               list()).append(({'key': key}, stat_value))
+                elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                    samples.setdefault(_sanitize_name("{}_{}".format(collector_name, key)), list()).append(
+                        (dict(), value))
+        return sorted(samples.items())
+
+    def snapshot(self):
+        """
+        Get the current value of all the metrics and collectors
+        :return (dict): metric name -> dict with type, description and values (list of dicts with labels and value;
+        histogram values are dicts with buckets, count and sum)
+        """
+
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        snapshot = dict()
+        for name, metric in metrics:
+            values = [{'labels': dict(zip(metric.label_names, label_values)), 'value': child.get()}
+                      for label_values, child in metric.get_children()]
+            snapshot[METRIC_PREFIX + name] = {'type': metric.type, 'description': metric.description,
+                                              'values': values}
+        for name, samples in self._collect():
+            snapshot[METRIC_PREFIX + name] = {'type': TYPE_GAUGE, 'description': "",
+                                              'values': [{'labels': labels, 'value': value}
+                                                         for labels, value in samples]}
+        return snapshot
+
+    def reset(self):
+        """
+        Set all the counters, gauges and histograms to zero (collectors are not affected). Updates made while
+        resetting may be lost (see _ShardedValues.reset).
+        :return: None
+        """
+
+        with self._lock:
+            metrics = self._metrics.values()
+        for metric in metrics:
+            for label_values, child in metric.get_children():
+                child.reset()
+
+    def export_json(self, file_path=None):
+        """
+        Export a snapshot to JSON
+        :param file_path (string): Target file. None to only return the JSON document.
+        :return (string): JSON document
+        """
+
+        snapshot = self.snapshot()
+        # Infinity is not valid JSON: the +Inf bucket bound is exported as a string
+        for metric in snapshot.itervalues():
+            if metric['type'] == TYPE_HISTOGRAM:
+                for sample in metric['values']:
+                    sample['value']['buckets'] = [(_format_value(upper_bound) if upper_bound == float('inf')
+                                                   else upper_bound, count)
+                                                  for upper_bound, count in sample['value']['buckets']]
+        document = json.dumps({'timestamp': time.time(), 'metrics': snapshot}, indent=2, sort_keys=True)
+        if file_path is not None:
+            _write_atomically(file_path, document)
+        return document
+
+    def to_prometheus_text(self):
+        """
+        Format a snapshot in the Prometheus text exposition format
+        :return (string): Text
+        """
+
+        lines = list()
+        for name, metric in sorted(self.snapshot().iteritems()):
+            if metric['description']:
+                lines.append("# HELP {} {}".format(name, metric['description']))
+            lines.append("# TYPE {} {}".format(name, metric['type']))
+            for sample in metric['values']:
+                label_names = sorted(sample['labels'].keys())
+                label_values = [sample['labels'][label_name] for label_name in label_names]
+                if metric['type'] == TYPE_HISTOGRAM:
+                    for upper_bound, count in sample['value']['buckets']:
+                        lines.append(u"{}_bucket{} {}".format(name, _format_labels(label_names, label_values,
+                                                                                   ('le', _format_value(upper_bound))),
+                                                             count))
+                    labels = _format_labels(label_names, label_values)
+                    lines.append(u"{}_count{} {}".format(name, labels, sample['value']['count']))
+                    lines.append(u"{}_sum{} {}".format(name, labels, _format_value(sample['value']['sum'])))
+                else:
+                    lines.append(u"{}{} {}".format(name, _format_labels(label_names, label_values),
+                                                   _format_value(sample['value'])))
+        return u"\n".join(lines).encode('utf-8') + "\n"
+
+    def write_prometheus_file(self, file_path):
+        """
+        Write a snapshot in the Prometheus text format (e.g. for the textfile collector of the node exporter).
+        The file is replaced atomically.
+        :param file_path (string): Target file (usually '*.prom')
+        :return: None
+        """
+
+        _write_atomically(file_path, self.to_prometheus_text())
+
+    def start_http_server(self, port=DEFAULT_HTTP_PORT, host=DEFAULT_HTTP_HOST):
+        """
+        Serve the metrics over HTTP in a daemon thread: '/metrics' (Prometheus text format) and '/metrics.json'
+        :param port (int): Port. 0 to choose a free one.
+        :param host (string): Listening address. By default, only local connections.
+        :return (int): Port
+        """
+
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+        registry = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/metrics":
+                    body, content_type = registry.to_prometheus_text(), "text/plain; version=0.0.4; charset=utf-8"
+                elif path == "/metrics.json":
+                    body, content_type = registry.export_json(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, message_format, *args):
+                __logger__.debug("Metrics HTTP server: " + message_format, *args)
+
+        with self._lock:
+            if self._http_server is not None:
+                return self._http_server.server_address[1]
+            self._http_server = HTTPServer((host, port), _MetricsHandler)
+            thread = threading.Thread(target=self._http_server.serve_forever, name="MetricsHTTPServer")
+            thread.daemon = True
+            thread.start()
+            port = self._http_server.server_address[1]
+        __logger__.info("Metrics available at http://%s:%d/metrics", host, port)
+        return port
+
+    def stop_http_server(self):
+        """
+        Stop the HTTP server (see start_http_server)
+        :return: None
+        """
+
+        with self._lock:
+            server, self._http_server = self._http_server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def _write_atomically(file_path, data):
+    """
+    Write the file through a temporary file and a rename, so readers never see it half written
+    :return: None
+    """
+
+    temporary_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(temporary_path, 'w') as target_file:
+        target_file.write(data)
+    os.rename(temporary_path, file_path)
+
+
+def get_metrics_registry():
+    """
+    Get the shared MetricsRegistry, where the qautils subsystems register their metrics
+    :return: MetricsRegistry
+    """
+
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+    return _registry
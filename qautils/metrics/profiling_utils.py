@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+"""
+profiling_utils module contains opt-in profiling hooks for the qautils hot paths:
+    - profiled: Decorator that profiles every call of a function as a hook.
+    - profile_hook: Context manager that profiles a block as a hook.
+    - enable_profiling / disable_profiling / is_profiling_enabled: Profiling is disabled by default (hooks only check
+      a flag). It is enabled with the environment variable QAUTILS_PROFILING (collapsed | pstats), or with the
+      'profiling' section of the properties file (see configure_profiling).
+    - get_profile_stats: Count, wall time and CPU time of each hook (also exported by the metrics registry).
+    - dump_profile: Writes the collected data as a collapsed-stack file (flamegraph.pl, speedscope...) or as a pstats
+      file. It is called at exit when profiling is enabled.
+
+Hooks in qautils: RestClient._call_api (URL formatting, request, logging), logger_utils._get_pretty_body,
+body_model_utils conversions (xmltodict parse included) and the DatasetUtils passes.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import time
+import weakref
+import functools
+import threading
+
+from qautils.configuration.configuration_properties import PROPERTIES_CONFIG_PROFILING_ENABLED, \
+    PROPERTIES_CONFIG_PROFILING_FORMAT, PROPERTIES_CONFIG_PROFILING_OUTPUT
+
+PROFILING_ENV_VAR = "QAUTILS_PROFILING"
+PROFILING_OUTPUT_ENV_VAR = "QAUTILS_PROFILING_OUTPUT"
+
+FORMAT_COLLAPSED = "collapsed"
+FORMAT_PSTATS = "pstats"
+DEFAULT_OUTPUT_FILES = {FORMAT_COLLAPSED: "./qautils_profile.folded", FORMAT_PSTATS: "./qautils_profile.pstats"}
+
+# Linux clock of the CPU time of the current thread (see _get_thread_cpu_time_function)
+_CLOCK_THREAD_CPUTIME_ID = 3
+
+_enabled = False
+_format = FORMAT_COLLAPSED
+_output_file = None
+_exit_dump_registered = False
+_collector_registered = False
+
+# Collected data of each live thread (see _get_thread_data): weak reference to the holder of the thread -> data. When a
+# thread ends, its data is added to _base_data (see _fold_thread_data), so the memory depends on the live threads,
+# not on all the threads that ever ran a hook. Both are added up by get_profile_stats and dump_profile.
+_threads_data = dict()
+_base_data = {'hooks': dict(), 'stacks': dict(), 'pstats': None}
+# Reentrant: the weak reference callback could run in a thread holding the lock
+_threads_data_lock = threading.RLock()
+_local = threading.local()
+_cpu_time = None
+
+
+def _get_thread_cpu_time_function():
+    """
+    :return (function): Returns the CPU time (seconds) of the current thread. Process CPU time if the platform does
+    not provide it.
+    """
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class _Timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+                                    use_errno=True).clock_gettime
+        timespec = _Timespec()
+        if clock_gettime(_CLOCK_THREAD_CPUTIME_ID, ctypes.byref(timespec)) != 0:
+            raise OSError()
+
+        def _thread_cpu_time():
+            value = _Timespec()
+            clock_gettime(_CLOCK_THREAD_CPUTIME_ID, ctypes.byref(value))
+            return value.tv_sec + value.tv_nsec * 1e-9
+        return _thread_cpu_time
+    except (ImportError, OSError, AttributeError):
+        return time.clock
+
+
+class _ThreadDataHolder(object):
+    """
+    Per-thread reference to the data of a thread. It is released when the thread ends (see _fold_thread_data).
+    """
+
+    __slots__ = ('data', '__weakref__')
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _get_thread_data():
+    """
+    :return (dict): Data of the current thread: 'stack' (active hooks), 'hooks' (name -> [count, wall, cpu, max
+    wall]), 'stacks' (collapsed stack -> self wall time) and 'profiler' (cProfile, pstats format only)
+    """
+
+    global _collector_registered
+    holder = getattr(_local, 'holder', None)
+    if holder is None:
+        holder = _local.holder = _ThreadDataHolder({'stack': list(), 'hooks': dict(), 'stacks': dict(),
+                                                    'profiler': None})
+        with _threads_data_lock:
+            _threads_data[weakref.ref(holder, _fold_thread_data)] = holder.data
+            register_collector = not _collector_registered
+            _collector_registered = True
+        # Registered with the first hook, not in enable_profiling: the environment variable enables the profiling
+        # while qautils.logger is being imported, and metrics_utils depends on it.
+        if register_collector:
+            from qautils.metrics.metrics_utils import get_metrics_registry
+            get_metrics_registry().register_collector("profiling", get_profile_stats)
+    return holder.data
+
+
+def _add_hooks(target, hooks):
+    """
+    Add the hooks stats to the target stats
+    :param target (dict): Hook name -> [count, wall, cpu, max wall] (updated)
+    :param hooks (dict): Hook name -> [count, wall, cpu, max wall]
+    :return: None
+    """
+
+    for name, (count, wall_time, cpu_time, wall_time_max) in hooks.items():
+        hook_stats = target.get(name)
+        if hook_stats is None:
+            hook_stats = target[name] = [0, 0.0, 0.0, 0.0]
+        hook_stats[0] += count
+        hook_stats[1] += wall_time
+        hook_stats[2] += cpu_time
+        hook_stats[3] = max(hook_stats[3], wall_time_max)
+
+
+def _add_stacks(target, stacks):
+    """
+    Add the collapsed stacks times to the target ones
+    :param target (dict): Collapsed stack -> self wall time (updated)
+    :param stacks (dict): Collapsed stack -> self wall time
+    :return: None
+    """
+
+    for stack, wall_time in stacks.items():
+        target[stack] = target.get(stack, 0.0) + wall_time
+
+
+def _fold_thread_data(holder_reference):
+    """
+    Add the data of an ended thread to the base data (weak reference callback)
+    :param holder_reference: Weak reference to the _ThreadDataHolder of the thread
+    :return: None
+    """
+
+    if _threads_data_lock is None or _threads_data is None or _base_data is None:
+        # Interpreter shutdown: module globals already torn down
+        return
+    with _threads_data_lock:
+        data = _threads_data.pop(holder_reference, None)
+        if data is None:
+            return
+        _add_hooks(_base_data['hooks'], data['hooks'])
+        _add_stacks(_base_data['stacks'], data['stacks'])
+        if data['profiler'] is not None:
+            import pstats
+
+            if _base_data['pstats'] is None:
+                _base_data['pstats'] = pstats.Stats(data['profiler'])
+            else:
+                _base_data['pstats'].add(data['profiler'])
+
+
+class _Hook(object):
+    """
+    Active hook: measures its block and adds the result to the data of the thread
+    """
+
+    __slots__ = ('name', 'data', 'entry')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        data = self.data = _get_thread_data()
+        stack = data['stack']
+        if not stack and _format == FORMAT_PSTATS:
+            if data['profiler'] is None:
+                import cProfile
+                data['profiler'] = cProfile.Profile()
+            data['profiler'].enable()
+        # Entry: [name, start wall time, start CPU time, wall time of the child hooks]
+        self.entry = [self.name, time.time(), _cpu_time(), 0.0]
+        stack.append(self.entry)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.time() - self.entry[1]
+        cpu_time = _cpu_time() - self.entry[2]
+        data = self.data
+        stack = data['stack']
+
+        hook_stats = data['hooks'].get(self.name)
+        if hook_stats is None:
+            hook_stats = data['hooks'][self.name] = [0, 0.0, 0.0, 0.0]
+        hook_stats[0] += 1
+        hook_stats[1] += wall_time
+        hook_stats[2] += cpu_time
+        hook_stats[3] = max(hook_stats[3], wall_time)
+
+        collapsed_stack = ";".join(entry[0] for entry in stack)
+        data['stacks'][collapsed_stack] = data['stacks'].get(collapsed_stack, 0.0) + wall_time - self.entry[3]
+        stack.pop()
+        if stack:
+            stack[-1][3] += wall_time
+        elif data['profiler'] is not None:
+            data['profiler'].disable()
+        return False
+
+
+class _NullHook(object):
+    """
+    Hook returned when profiling is disabled: it does nothing
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_HOOK = _NullHook()
+
+
+def profile_hook(name):
+    """
+    Profile a block of code:
+        with profile_hook("rest_client.request"):
+            ...
+    :param name (string): Hook name
+    :return: Context manager (it does nothing if profiling is disabled)
+    """
+
+    return _Hook(name) if _enabled else _NULL_HOOK
+
+
+def profiled(name=None):
+    """
+    Decorator that profiles every call of the function. When profiling is disabled, it only adds a flag check.
+    :param name (string): Hook name. By default, 'module.function'.
+    :return: Decorator
+    """
+
+    def _decorator(function):
+        hook_name = name or "{}.{}".format(function.__module__.split(".")[-1], function.__name__)
+
+        @functools.wraps(function)
+        def _wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Hook(hook_name):
+                return function(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+
+def is_profiling_enabled():
+    """
+    :return (bool): True if the hooks are collecting data
+    """
+
+    return _enabled
+
+
+def enable_profiling(output_format=FORMAT_COLLAPSED, output_file=None, dump_at_exit=True):
+    """
+    Enable the profiling hooks
+    :param output_format (string): Format of the file written by dump_profile: 'collapsed' (hooks stacks, one line
+    per stack with its self time in microseconds) or 'pstats' (cProfile data of the code run inside the hooks)
+    :param output_file (string): File written by dump_profile. By default, QAUTILS_PROFILING_OUTPUT or
+    DEFAULT_OUTPUT_FILES of the format.
+    :param dump_at_exit (bool): Call dump_profile when the interpreter exits
+    :return: None
+    """
+
+    global _enabled, _format, _output_file, _cpu_time, _exit_dump_registered
+    if output_format not in DEFAULT_OUTPUT_FILES:
+        raise ValueError("Unsupported profiling format: {}".format(output_format))
+    if _cpu_time is None:
+        _cpu_time = _get_thread_cpu_time_function()
+    _format = output_format
+    _output_file = output_file or os.environ.get(PROFILING_OUTPUT_ENV_VAR) or DEFAULT_OUTPUT_FILES[output_format]
+    if dump_at_exit and not _exit_dump_registered:
+        import atexit
+        atexit.register(_dump_at_exit)
+        _exit_dump_registered = True
+    _enabled = True
+
+
+def disable_profiling():
+    """
+    Disable the profiling hooks. The collected data is kept.
+    :return: None
+    """
+
+    global _enabled
+    _enabled = False
+
+
+def configure_profiling(properties):
+    """
+    Enable the profiling from the 'profiling' section of the properties file. E.g.:
+        "profiling": {"enabled": true, "format": "collapsed", "output": "./logs/profile.folded"}
+    :param properties (dict): Properties of the section. None to do nothing.
+    :return: None
+    """
+
+    if properties and properties.get(PROPERTIES_CONFIG_PROFILING_ENABLED):
+        enable_profiling(properties.get(PROPERTIES_CONFIG_PROFILING_FORMAT) or FORMAT_COLLAPSED,
+                         properties.get(PROPERTIES_CONFIG_PROFILING_OUTPUT))
+
+
+def reset_profile():
+    """
+    Remove the collected data (of the hooks not running)
+    :return: None
+    """
+
+    with _threads_data_lock:
+        _base_data['hooks'].clear()
+        _base_data['stacks'].clear()
+        _base_data['pstats'] = None
+        for data in _threads_data.itervalues():
+            data['hooks'].clear()
+            data['stacks'].clear()
+            data['profiler'] = None
+
+
+def get_profile_stats():
+    """
+    Get the data collected by the hooks, added up for all threads
+    :return (dict): Hook name -> dict with count, wall_time, cpu_time, wall_time_mean, wall_time_max (seconds)
+    """
+
+    with _threads_data_lock:
+        hooks = dict((name, list(hook_stats)) for name, hook_stats in _base_data['hooks'].iteritems())
+        threads_data = _threads_data.values()
+    for data in threads_data:
+        _add_hooks(hooks, data['hooks'])
+    return dict((name, {'count': count, 'wall_time': wall_time, 'cpu_time': cpu_time,
+                        'wall_time_mean': wall_time / count, 'wall_time_max': wall_time_max})
+                for name, (count, wall_time, cpu_time, wall_time_max) in hooks.iteritems() if count)
+
+
+def dump_profile(output_file=None, output_format=None):
+    """
+    Write the collected data
+    :param output_file (string): Target file. By default, the one given to enable_profiling.
+    :param output_format (string): 'collapsed' or 'pstats'. By default, the one given to enable_profiling.
+    :return (string): Path of the written file. None if there was no data.
+    """
+
+    output_format = output_format or _format
+    output_file = output_file or _output_file or DEFAULT_OUTPUT_FILES[output_format]
+    with _threads_data_lock:
+        threads_data = _threads_data.values()
+        base_pstats = _base_data['pstats']
+        stacks = dict(_base_data['stacks'])
+
+    if output_format == FORMAT_PSTATS:
+        import pstats
+
+        profilers = [data['profiler'] for data in threads_data if data['profiler'] is not None]
+        if profilers:
+            # Python 2 pstats.Stats can not be built from other Stats, but they can be added to it
+            stats = pstats.Stats(profilers[0])
+            for profile in profilers[1:] + ([base_pstats] if base_pstats is not None else []):
+                stats.add(profile)
+            stats.dump_stats(output_file)
+        elif base_pstats is not None:
+            with _threads_data_lock:
+                base_pstats.dump_stats(output_file)
+        else:
+            return None
+    else:
+        for data in threads_data:
+            _add_stacks(stacks, data['stacks'])
+        if not stacks:
+            return None
+        with open(output_file, 'w') as collapsed_file:
+            for stack in sorted(stacks):
+                collapsed_file.write("{} {}\n".format(stack, int(round(stacks[stack] * 1e6))))
+
+    from qautils.logger.logger_utils import get_logger
+    get_logger(__name__).info("Profile written to %s (%s)", output_file, output_format)
+    return output_file
+
+
+def _dump_at_exit():
+    # Also when profiling was disabled before exit: the collected data is kept (see disable_profiling)
+    try:
+        dump_profile()
+    except Exception, e:
+        from qautils.logger.logger_utils import get_logger
+        get_logger(__name__).error("Error writing the qautils profile: %s", e)
+
+
+if os.environ.get(PROFILING_ENV_VAR, "").lower() in (FORMAT_COLLAPSED, FORMAT_PSTATS, "1", "true", "yes"):
+    enable_profiling(FORMAT_PSTATS if os.environ[PROFILING_ENV_VAR].lower() == FORMAT_PSTATS else FORMAT_COLLAPSED)
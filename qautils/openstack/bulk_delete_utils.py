@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+"""
+bulk_delete_utils module contains utilities to delete many OpenStack resources at once:
+    - BulkDeleter: Sends the delete requests concurrently (up to a limit), and then waits for the resources to
+      disappear polling their status in batches (one list call per batch of pending resources, not one GET per
+      resource), with an adaptive backoff. Resources already gone (404) count as deleted. Returns a summary.
+      It is also available as OpenStackClients.bulk_delete.
+    - BULK_DELETE_TYPES: Supported resource types (delete and batch status functions).
+    - get_http_status / is_not_found: HTTP status of the errors raised by the OpenStack clients.
+    - get_next_poll_interval: Adaptive backoff of polling loops.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import time
+import random
+
+from qautils.logger.logger_utils import get_logger
+from qautils.openstack import listing_utils
+
+
+__logger__ = get_logger(__name__)
+
+DEFAULT_CONCURRENCY = 16
+
+# Delete requests retried when the API answers with these statuses (conflict, rate limit, server errors)
+RETRY_HTTP_STATUSES = (409, 429, 500, 502, 503, 504)
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+
+# Polling of the deleted resources: first interval, max interval and growth when nothing changes (seconds)
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_MAX_POLL_INTERVAL = 30.0
+POLL_BACKOFF_FACTOR = 1.5
+DEFAULT_TIMEOUT = 600
+
+# Max ids per status request (for APIs that filter by id)
+DEFAULT_BATCH_SIZE = 100
+
+# Statuses of resources that could not be deleted
+FAILED_STATUSES = ('ERROR_DELETING',)
+
+# Statuses of resources that could not be deleted only if the resource had another status after the delete request:
+# resources already in ERROR (e.g. errored servers) keep it while they are being deleted
+ERROR_STATUSES = ('ERROR',)
+
+
+def get_http_status(error):
+    """
+    Get the HTTP status of an error raised by an OpenStack client (nova, cinder, glance, neutron, keystone)
+    :param error (Exception): The error
+    :return (int): HTTP status. None if the error has no status.
+    """
+
+    for attribute in ('http_status', 'status_code', 'code'):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_not_found(error):
+    """
+    :param error (Exception): Error raised by an OpenStack client
+    :return (bool): True if the error is a 404 (the resource does not exist)
+    """
+
+    return get_http_status(error) == 404
+
+
+def get_next_poll_interval(interval, progress, initial_interval=DEFAULT_POLL_INTERVAL,
+                           max_interval=DEFAULT_MAX_POLL_INTERVAL):
+    """
+    Adaptive backoff: the interval grows while nothing changes, and shrinks when there is progress
+    :param interval (float): Current interval (seconds)
+    :param progress (bool): True if something changed in the last poll
+    :param initial_interval (float): Min interval (seconds)
+    :param max_interval (float): Max interval (seconds)
+    :return (float): Next interval (seconds)
+    """
+
+    if progress:
+        return max(initial_interval, interval / POLL_BACKOFF_FACTOR)
+    return min(max_interval, interval * POLL_BACKOFF_FACTOR)
+
+
+def _get_status(resource):
+    status = resource.get('status') if isinstance(resource, dict) else getattr(resource, 'status', None)
+    return status.upper() if status else None
+
+
+def _lister_status(list_function):
+    """
+    :return (function): Batch status function that lists all the resources of the tenant (for APIs that can not
+    filter by a list of ids)
+    """
+
+    def _status(clients, resource_ids):
+        resource_ids = set(resource_ids)
+        return dict((listing_utils.get_resource_id(resource), _get_status(resource))
+                    for resource in list_function(clients) if listing_utils.get_resource_id(resource) in resource_ids)
+    return _status
+
+
+def _neutron_status(collection):
+    """
+    :return (function): Batch status function that lists the neutron resources by id
+    """
+
+    def _status(clients, resource_ids):
+        resources = getattr(clients.get_neutronclient(), "list_" + collection)(id=list(resource_ids))[collection]
+        return dict((resource['id'], _get_status(resource)) for resource in resources)
+    return _status
+
+
+def _neutron_delete(resource_name):
+    def _delete(clients, resource_id):
+        getattr(clients.get_neutronclient(), "delete_" + resource_name)(resource_id)
+    return _delete
+
+
+def _delete_router(clients, resource_id):
+    neutron = clients.get_neutronclient()
+    neutron.remove_gateway_router(resource_id)
+    for port in neutron.list_ports(device_id=resource_id, device_owner='network:router_interface')['ports']:
+        neutron.remove_interface_router(resource_id, {'port_id': port['id']})
+    neutron.delete_router(resource_id)
+
+
+def _delete_server(clients, resource_id):
+    clients.get_novaclient().servers.delete(resource_id)
+
+
+def _delete_volume(clients, resource_id):
+    clients.get_cinderclient().volumes.delete(resource_id)
+
+
+def _delete_volume_snapshot(clients, resource_id):
+    clients.get_cinderclient().volume_snapshots.delete(resource_id)
+
+
+def _delete_image(clients, resource_id):
+    clients.get_glanceclient().images.delete(resource_id)
+
+
+# Resource types: delete function (clients, id) and batch status function (clients, ids) -> {id: status} of the
+# resources that still exist. batch_size is None when the status function lists all the resources at once.
+BULK_DELETE_TYPES = {
+    'servers': {'delete': _delete_server, 'status': _lister_status(listing_utils.list_servers),
+                'batch_size': None},
+    'volumes': {'delete': _delete_volume, 'status': _lister_status(listing_utils.list_volumes),
+                'batch_size': None},
+    'volume_snapshots': {'delete': _delete_volume_snapshot,
+                         'status': _lister_status(listing_utils.list_volume_snapshots), 'batch_size': None},
+    'images': {'delete': _delete_image, 'status': _lister_status(listing_utils.list_images), 'batch_size': None},
+    'ports': {'delete': _neutron_delete('port'), 'status': _neutron_status('ports'),
+              'batch_size': DEFAULT_BATCH_SIZE},
+    'networks': {'delete': _neutron_delete('network'), 'status': _neutron_status('networks'),
+                 'batch_size': DEFAULT_BATCH_SIZE},
+    'subnets': {'delete': _neutron_delete('subnet'), 'status': _neutron_status('subnets'),
+                'batch_size': DEFAULT_BATCH_SIZE},
+    'routers': {'delete': _delete_router, 'status': _neutron_status('routers'), 'batch_size': DEFAULT_BATCH_SIZE},
+    'floatingips': {'delete': _neutron_delete('floatingip'), 'status': _neutron_status('floatingips'),
+                    'batch_size': DEFAULT_BATCH_SIZE},
+    'security_groups': {'delete': _neutron_delete('security_group'), 'status': _neutron_status('security_groups'),
+                        'batch_size': DEFAULT_BATCH_SIZE},
+}
+
+
+class BulkDeleter(object):
+
+    def __init__(self, clients, resource_type, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY, wait=True, timeout=DEFAULT_TIMEOUT,
+                 poll_interval=DEFAULT_POLL_INTERVAL, max_poll_interval=DEFAULT_MAX_POLL_INTERVAL, batch_size=None,
+                 resource_definition=None):
+        """
+        Init the BulkDeleter
+        :param clients: OpenStackClients (tenant and region of the resources)
+        :param resource_type (string): Resource type name (see BULK_DELETE_TYPES)
+        :param concurrency (int): Max delete (and status) requests at once
+        :param retries (int): Retries of each delete request answered with a RETRY_HTTP_STATUSES status
+        :param retry_delay (float): Delay before the first retry (seconds). It is doubled on each retry.
+        :param wait (bool): Wait until the resources are gone
+        :param timeout (float): Max time waiting for the resources to be gone (seconds)
+        :param poll_interval (float): First (and min) time between status checks (seconds)
+        :param max_poll_interval (float): Max time between status checks (seconds)
+        :param batch_size (int): Max ids per status request. By default, the one of the resource type.
+        :param resource_definition (dict): 'delete', 'status' and 'batch_size' of the resource type.
+        By default, BULK_DELETE_TYPES[resource_type].
+        :return: None
+        """
+
+        self.clients = clients
+        self.resource_type = resource_type
+        self.definition = resource_definition or BULK_DELETE_TYPES[resource_type]
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.wait = wait
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.batch_size = batch_size or self.definition.get('batch_size')
+
+    def _delete(self, resource_id):
+        """
+        Send the delete request of a resource, retrying on conflicts, rate limits and server errors
+        :param resource_id (string): Resource id
+        :return (tuple): (resource id, outcome ('requested', 'not_found' or 'failed'), error message, retries)
+        """
+
+        delay = self.retry_delay
+        for attempt in xrange(self.retries + 1):
+            try:
+                self.definition['delete'](self.clients, resource_id)
+                return resource_id, 'requested', None, attempt
+            except Exception, e:
+                if is_not_found(e):
+                    return resource_id, 'not_found', None, attempt
+                if attempt == self.retries or get_http_status(e) not in RETRY_HTTP_STATUSES:
+                    return resource_id, 'failed', str(e), attempt
+                __logger__.debug("Bulk delete: Retrying %s %s in %.1f seconds: %s", self.resource_type, resource_id,
+                                 delay, str(e))
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay *= 2
+
+    def _get_statuses(self, resource_ids):
+        """
+        Get the status of a batch of resources
+        :param resource_ids (list): Resource ids
+        :return (tuple): ({id: status} of the resources that still exist, error message or None)
+        """
+
+        try:
+            return self.definition['status'](self.clients, resource_ids), None
+        except Exception, e:
+            return None, str(e)
+
+    def run(self, resource_ids):
+        """
+        Delete the resources
+        :param resource_ids (list): Resource ids
+        :return (dict): Summary:
+          *resource_type
+          *requested: number of resources
+          *deleted: ids of the resources deleted (confirmed gone, or only requested if wait is False)
+          *already_deleted: ids of the resources that did not exist (404)
+          *failed: id -> error message (delete request failed, or the resource went to an error status after the
+          delete request. Resources that were already in ERROR are polled until they are gone or time out.)
+          *timed_out: ids of the resources still there after the timeout
+          *delete_requests, delete_retries, status_requests, status_errors: number of API calls
+          *delete_time, wait_time, elapsed (seconds), deleted_per_second
+        """
+
+        from multiprocessing.pool import ThreadPool
+
+        resource_ids = list(resource_ids)
+        summary = {'resource_type': self.resource_type, 'requested': len(resource_ids), 'deleted': list(),
+                   'already_deleted': list(), 'failed': dict(), 'timed_out': list(), 'delete_requests': 0,
+                   'delete_retries': 0, 'status_requests': 0, 'status_errors': 0, 'delete_time': 0.0,
+                   'wait_time': 0.0, 'elapsed': 0.0, 'deleted_per_second': 0.0}
+        if not resource_ids:
+            return summary
+
+        start_time = time.time()
+        pool = ThreadPool(min(self.concurrency, len(resource_ids)))
+        try:
+            pending = set()
+            for resource_id, outcome, error, retries in pool.imap_unordered(self._delete, resource_ids):
+                summary['delete_requests'] += retries + 1
+                summary['delete_retries'] += retries
+                if outcome == 'requested':
+                    pending.add(resource_id)
+                elif outcome == 'not_found':
+                    summary['already_deleted'].append(resource_id)
+                else:
+                    summary['failed'][resource_id] = error
+            summary['delete_time'] = time.time() - start_time
+
+            if self.wait:
+                self._wait_deleted(pool, pending, summary)
+            else:
+                summary['deleted'].extend(pending)
+        finally:
+            pool.close()
+            pool.join()
+
+        summary['elapsed'] = time.time() - start_time
+        summary['deleted_per_second'] = len(summary['deleted']) / summary['elapsed'] if summary['elapsed'] else 0.0
+        __logger__.info("Bulk delete of %d %s: %d deleted, %d already deleted, %d failed, %d timed out in %.1f "
+                        "seconds (%.1f/s)", len(resource_ids), self.resource_type, len(summary['deleted']),
+                        len(summary['already_deleted']), len(summary['failed']), len(summary['timed_out']),
+                        summary['elapsed'], summary['deleted_per_second'])
+        return summary
+
+    def _wait_deleted(self, pool, pending, summary):
+        """
+        Poll the status of the pending resources in batches until all of them are gone, failed or timed out
+        :param pool: ThreadPool
+        :param pending (set): Ids of the resources being deleted. They are removed when gone or failed.
+        :param summary (dict): Summary, updated with the results
+        :return: None
+        """
+
+        start_time = time.time()
+        deadline = start_time + self.timeout
+        interval = self.poll_interval
+        # Resources seen with a status other than ERROR_STATUSES after the delete request
+        status_changed = set()
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+
+            ids = sorted(pending)
+            batch_size = self.batch_size or len(ids)
+            batches = [ids[index:index + batch_size] for index in xrange(0, len(ids), batch_size)]
+            progress = False
+            for batch, (statuses, error) in zip(batches, pool.map(self._get_statuses, batches)):
+                summary['status_requests'] += 1
+                if error is not None:
+                    # The batch is checked again in the next poll
+                    summary['status_errors'] += 1
+                    __logger__.debug("Bulk delete: Error getting the status of %s: %s", self.resource_type, error)
+                    continue
+                for resource_id in batch:
+                    status = statuses.get(resource_id, False)
+                    if status is False:
+                        summary['deleted'].append(resource_id)
+                    elif status in FAILED_STATUSES or (status in ERROR_STATUSES and resource_id in status_changed):
+                        summary['failed'][resource_id] = "status {}".format(status)
+                    else:
+                        if status not in ERROR_STATUSES:
+                            status_changed.add(resource_id)
+                        continue
+                    pending.discard(resource_id)
+                    progress = True
+            interval = get_next_poll_interval(interval, progress, self.poll_interval, self.max_poll_interval)
+
+        summary['timed_out'].extend(sorted(pending))
+        summary['wait_time'] = time.time() - start_time
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""
+listing_utils module contains helpers to list OpenStack resources page by page, without loading all of them in memory:
+    - ResourcePager: Iterates over the resources of a paginated listing (marker and limit). The next pages are
+      fetched by a background thread while the current one is processed, and only a few pages are kept in memory.
+    - list_servers, list_volumes, list_volume_snapshots, list_images, list_neutron_resources: Return a ResourcePager
+      of the resources of the current tenant and region of an OpenStackClients.
+    - set_page_size / get_page_size: Page size of each service.
+    - get_resource_id: Id of a listed resource (client object or dict).
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import sys
+import time
+import Queue
+import threading
+from itertools import islice
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+# Resources per page of each service. They must not be greater than the max limit of the service ('osapi_max_limit'
+# in nova and cinder, 'pagination_max_limit' in neutron): a page shorter than the limit is the last one.
+PAGE_SIZES = {'nova': 200, 'cinder': 200, 'glance': 200, 'neutron': 500}
+DEFAULT_PAGE_SIZE = 200
+
+# The first page is smaller, so the first resources arrive quickly
+DEFAULT_FIRST_PAGE_SIZE = 20
+
+# Pages fetched in advance (besides the one being processed)
+DEFAULT_PREFETCH = 1
+
+# Time between checks of the fetching thread when the consumer is not reading (seconds)
+_QUEUE_CHECK_PERIOD = 0.5
+
+# Queue entries of the fetching thread
+_PAGE = 'page'
+_END = 'end'
+_ERROR = 'error'
+
+
+def set_page_size(service, page_size):
+    """
+    Set the page size used to list the resources of a service
+    :param service (string): 'nova', 'cinder', 'glance' or 'neutron'
+    :param page_size (int): Resources per page
+    :return: None
+    """
+
+    PAGE_SIZES[service] = page_size
+
+
+def get_page_size(service):
+    """
+    :param service (string): Service name
+    :return (int): Page size used to list the resources of the service
+    """
+
+    return PAGE_SIZES.get(service, DEFAULT_PAGE_SIZE)
+
+
+def get_resource_id(resource):
+    """
+    :return (string): Id of a resource (client object or dict)
+    """
+
+    return resource['id'] if isinstance(resource, dict) else resource.id
+
+
+class ResourcePager(object):
+
+    def __init__(self, fetch_page, page_size=DEFAULT_PAGE_SIZE, first_page_size=DEFAULT_FIRST_PAGE_SIZE,
+                 prefetch=DEFAULT_PREFETCH, name=None):
+        """
+        Init the ResourcePager. No page is requested until the iteration starts.
+        :param fetch_page (function): Gets a page from (marker, limit): marker is the id of the last resource of the
+        previous page (None for the first page). Returns the list of resources.
+        :param page_size (int): Resources per page
+        :param first_page_size (int): Resources of the first page. None to use page_size.
+        :param prefetch (int): Pages fetched in advance. At most (prefetch + 2) pages are in memory.
+        :param name (string): Name used in logs
+        :return: None
+        """
+
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.first_page_size = min(first_page_size or page_size, page_size)
+        self.prefetch = max(1, prefetch)
+        self.name = name or "resources"
+
+        self.pages = 0
+        self.resources = 0
+        self.fetch_time = 0.0
+        self.wait_time = 0.0
+        self.first_resource_time = None
+
+        self._queue = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch_pages(self):
+        """
+        Fetching thread: request the pages one after another and put them in the queue
+        :return: None
+        """
+
+        marker = None
+        limit = self.first_page_size
+        try:
+            while not self._stop.is_set():
+                start_time = time.time()
+                page = list(self.fetch_page(marker, limit))
+                self.fetch_time += time.time() - start_time
+                self.pages += 1
+                if page and not self._put((_PAGE, page)):
+                    return
+                if len(page) < limit:
+                    break
+                marker = get_resource_id(page[-1])
+                limit = self.page_size
+        except Exception:
+            self._put((_ERROR, sys.exc_info()))
+            return
+        self._put((_END, None))
+
+    def _put(self, entry):
+        """
+        Put an entry in the queue, waiting while it is full
+        :return (bool): False if the pager was closed
+        """
+
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=_QUEUE_CHECK_PERIOD)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        if self._thread is not None:
+            raise RuntimeError("ResourcePager of {} already iterated".format(self.name))
+        self._queue = Queue.Queue(self.prefetch)
+        self._thread = threading.Thread(target=self._fetch_pages, name="ResourcePager")
+        self._thread.daemon = True
+        start_time = time.time()
+        self._thread.start()
+        try:
+            while True:
+                wait_start_time = time.time()
+                kind, value = self._queue.get()
+                self.wait_time += time.time() - wait_start_time
+                if kind == _END:
+                    break
+                if kind == _ERROR:
+                    raise value[0], value[1], value[2]
+                if self.first_resource_time is None:
+                    self.first_resource_time = time.time() - start_time
+                for resource in value:
+                    self.resources += 1
+                    yield resource
+        finally:
+            self.close()
+        __logger__.debug("Listed %d %s in %d pages (%.3f seconds fetching, %.3f seconds waiting)", self.resources,
+                         self.name, self.pages, self.fetch_time, self.wait_time)
+
+    def close(self):
+        """
+        Stop fetching pages (when the iteration is not completed)
+        :return: None
+        """
+
+        self._stop.set()
+
+    def get_stats(self):
+        """
+        Get listing metrics
+        :return (dict): pages, resources, fetch_time (time requesting pages), wait_time (time the consumer waited
+        for pages), first_resource_time (seconds until the first resource was available)
+        """
+
+        return {'pages': self.pages, 'resources': self.resources, 'fetch_time': self.fetch_time,
+                'wait_time': self.wait_time, 'first_resource_time': self.first_resource_time}
+
+
+def list_servers(clients, page_size=None, prefetch=DEFAULT_PREFETCH, **filters):
+    """
+    List the servers (nova)
+    :param clients: OpenStackClients
+    :param page_size (int): Resources per page. By default, get_page_size('nova').
+    :param prefetch (int): Pages fetched in advance
+    :param filters: Search options of the listing (e.g. name, status)
+    :return (ResourcePager): Server objects
+    """
+
+    servers = clients.get_novaclient().servers
+
+    def _fetch_page(marker, limit):
+        return servers.list(search_opts=filters or None, marker=marker, limit=limit)
+    return ResourcePager(_fetch_page, page_size or get_page_size('nova'), prefetch=prefetch, name="servers")
+
+
+def list_volumes(clients, page_size=None, prefetch=DEFAULT_PREFETCH, **filters):
+    """
+    List the volumes (cinder)
+    :param clients: OpenStackClients
+    :param page_size (int): Resources per page. By default, get_page_size('cinder').
+    :param prefetch (int): Pages fetched in advance
+    :param filters: Search options of the listing (e.g. status)
+    :return (ResourcePager): Volume objects
+    """
+
+    volumes = clients.get_cinderclient().volumes
+
+    def _fetch_page(marker, limit):
+        return volumes.list(search_opts=filters or None, marker=marker, limit=limit)
+    return ResourcePager(_fetch_page, page_size or get_page_size('cinder'), prefetch=prefetch, name="volumes")
+
+
+def list_volume_snapshots(clients, page_size=None, prefetch=DEFAULT_PREFETCH, **filters):
+    """
+    List the volume snapshots (cinder). The snapshots listing of python-cinderclient 1.2.1 has no marker and limit:
+    the snapshots are requested at once by the background thread and handed out in pages of page_size.
+    :param clients: OpenStackClients
+    :param page_size (int): Resources per page. By default, get_page_size('cinder').
+    :param prefetch (int): Pages fetched in advance
+    :param filters: Search options of the listing (e.g. volume_id)
+    :return (ResourcePager): Snapshot objects
+    """
+
+    snapshots_manager = clients.get_cinderclient().volume_snapshots
+    snapshots = list()
+
+    def _fetch_page(marker, limit):
+        if not snapshots:
+            snapshots.append(iter(snapshots_manager.list(search_opts=filters or None)))
+        return list(islice(snapshots[0], limit))
+    return ResourcePager(_fetch_page, page_size or get_page_size('cinder'), prefetch=prefetch,
+                         name="volume snapshots")
+
+
+def list_images(clients, page_size=None, prefetch=DEFAULT_PREFETCH, **filters):
+    """
+    List the images (glance). The glance client follows the pages by itself: this pager reads them in advance.
+    :param clients: OpenStackClients
+    :param page_size (int): Resources per page. By default, get_page_size('glance').
+    :param prefetch (int): Pages fetched in advance
+    :param filters: Filters of the listing (e.g. owner, visibility)
+    :return (ResourcePager): Image objects
+    """
+
+    page_size = page_size or get_page_size('glance')
+    images_manager = clients.get_glanceclient().images
+    images = list()
+
+    def _fetch_page(marker, limit):
+        if not images:
+            images.append(iter(images_manager.list(page_size=page_size, filters=filters)))
+        return list(islice(images[0], limit))
+    return ResourcePager(_fetch_page, page_size, prefetch=prefetch, name="images")
+
+
+def list_neutron_resources(clients, collection, page_size=None, prefetch=DEFAULT_PREFETCH, **filters):
+    """
+    List neutron resources
+    :param clients: OpenStackClients
+    :param collection (string): Collection name (e.g. 'ports', 'networks', 'floatingips', 'security_groups')
+    :param page_size (int): Resources per page. By default, get_page_size('neutron').
+    :param prefetch (int): Pages fetched in advance
+    :param filters: Filters of the listing (e.g. tenant_id, device_id)
+    :return (ResourcePager): Resource dicts
+    """
+
+    list_function = getattr(clients.get_neutronclient(), "list_" + collection)
+
+    def _fetch_page(marker, limit):
+        params = dict(filters, limit=limit)
+        if marker is not None:
+            params['marker'] = marker
+        # Without retrieve_all, the client returns a generator of pages (it does not follow the next links at once)
+        return next(list_function(retrieve_all=False, **params), {}).get(collection, [])
+    return ResourcePager(_fetch_page, page_size or get_page_size('neutron'), prefetch=prefetch, name=collection)
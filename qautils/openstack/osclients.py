@@ -27,18 +27,36 @@ __author__ = '@chemaper, Telefónica I+D'
 __project__ = 'https://github.com/chemaper/delete_os_tenant_resources/blob/develop/osclients.py'
 
 
+import time
+import threading
 from os import environ as env
 
-from keystoneclient.auth.identity import v2, v3
-from keystoneclient import session
-from keystoneclient.v2_0 import client as keystonev2
-from keystoneclient.v3 import client as keystonev3
+from qautils.logger.logger_utils import get_logger
+from qautils.metrics.metrics_utils import get_metrics_registry
 
-from neutronclient.v2_0 import client as neutronclient
-from novaclient import client as novaclient
-from cinderclient.v2 import client as cinderclient
-from glanceclient import client as glanceclient
-from swiftclient import client as swiftclient
+# The OpenStack client libraries are imported by the methods that use them, the first time they are called:
+# importing all of them takes much longer than most short scripts need.
+
+__logger__ = get_logger(__name__)
+
+_auth_events_metric = get_metrics_registry().counter(
+    "openstack_auth_events_total",
+    "Token requests (authentication, error) and tokens reused (cache_hit)",
+    ("event",))
+_auth_duration_metric = get_metrics_registry().histogram(
+    "openstack_auth_duration_seconds", "Duration of the token requests")
+_client_cache_metric = get_metrics_registry().counter(
+    "openstack_client_cache_total",
+    "OpenStack clients reused (hit) and built (miss)", ("result",))
+_catalog_index_builds_metric = get_metrics_registry().counter(
+    "openstack_catalog_index_builds_total", "Catalog index builds")
+
+# Tokens are refreshed this time (seconds) before they expire (see
+# start_token_refresher)
+DEFAULT_REFRESH_MARGIN = 300
+
+# Max time between checks of the token refresher (seconds)
+REFRESHER_CHECK_INTERVAL = 30
 
 
 class OpenStackClients(object):
@@ -83,6 +101,30 @@ class OpenStackClients(object):
         self._saved_session_v2 = None
         self._saved_session_v3 = None
 
+        # Sessions, catalog index and client cache are shared by threads
+        self._lock = threading.RLock()
+        self._refresher = None
+        self._refresher_stop = None
+        self.auth_stats = {'authentications': 0, 'proactive_refreshes': 0,
+                           'waits': 0, 'errors': 0, 'auth_time_total': 0.0,
+                           'auth_time_max': 0.0, 'cache_hits': 0}
+
+        # On-disk token cache (see enable_token_cache)
+        self._token_cache = None
+        if env.get('QAUTILS_TOKEN_CACHE_DIR'):
+            self.enable_token_cache()
+
+        # Index of the catalog of the current token (see _get_catalog_index)
+        self._catalog_index = None
+        self._catalog_index_key = None
+        # URLs set with override_endpoint: (service_type, region, interface) -> url
+        self._endpoint_overrides = dict()
+        self.catalog_stats = {'lookups': 0, 'index_builds': 0, 'invalidations': 0}
+
+        # Clients already built: (service, region, session id, token) -> client
+        self._clients = dict()
+        self.client_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
         if 'OS_USERNAME' in env:
             self.__username = env['OS_USERNAME']
         else:
@@ -143,6 +185,13 @@ class OpenStackClients(object):
         used.
         :return: Nothing.
         """
+        with self._lock:
+            self._set_credential(username, password, tenant_name, tenant_id,
+                                 trust_id)
+
+    def _set_credential(self, username, password, tenant_name, tenant_id,
+                        trust_id):
+        """See set_credential. It must be called with the lock held."""
         self.__username = username
         self.__password = password
         if trust_id:
@@ -169,6 +218,8 @@ class OpenStackClients(object):
         if self._session_v3:
             self._session_v3.invalidate()
             self._session_v3 = None
+        self._invalidate_catalog_index()
+        self.clear_client_cache()
 
     def set_region(self, region):
         """Set the region. By default this datum is filled in the constructor
@@ -178,6 +229,33 @@ class OpenStackClients(object):
         """
         self.region = region
 
+    def for_region(self, region):
+        """Get a new OpenStackClients for another region that shares the
+        credential and the sessions of this one (but not its region, client
+        cache nor catalog index). It is useful to work with several regions
+        at the same time (e.g. in several threads), because set_region
+        changes the region of all the users of the object.
+
+        Be aware that calling set_credential in any of them invalidates the
+        shared session.
+        :param region: the region name
+        :return: an OpenStackClients object
+        """
+        clients = OpenStackClients.__new__(OpenStackClients)
+        clients.__dict__.update(self.__dict__)
+        clients.region = region
+        clients._catalog_index = None
+        clients._catalog_index_key = None
+        clients._endpoint_overrides = dict(self._endpoint_overrides)
+        clients.catalog_stats = {'lookups': 0, 'index_builds': 0,
+                                 'invalidations': 0}
+        clients._clients = dict()
+        clients.client_cache_stats = {'hits': 0, 'misses': 0,
+                                      'invalidations': 0}
+        clients._refresher = None
+        clients._refresher_stop = None
+        return clients
+
     def set_keystone_version(self, use_v3=True):
         """By default, get_session and get_keystoneclient use the version v3
         of the API. Call this method to use version v2
@@ -220,9 +298,20 @@ class OpenStackClients(object):
 
         :return: a session object
         """
-        if self._session_v2:
+        session = self._session_v2
+        if session:
+            return session
+
+        # Only one thread creates the session; the others wait and share it
+        with self._lock:
+            if not self._session_v2:
+                self._session_v2 = self._new_session_v2()
             return self._session_v2
 
+    def _new_session_v2(self):
+        """Create a v2 session (see get_session_v2)
+        :return: a session object
+        """
         if self.auth_url.endswith('/v3/'):
             auth_url = self.auth_url[0:-2] + '2.0'
         elif self.auth_url.endswith('/v3'):
@@ -233,6 +322,9 @@ class OpenStackClients(object):
         if not self.__username:
             raise Exception('Username must be provided')
 
+        from keystoneclient.auth.identity import v2
+        from keystoneclient import session
+
         other_params = dict()
         if self.__trust_id:
             other_params['trust_id'] = self.__trust_id
@@ -246,9 +338,10 @@ class OpenStackClients(object):
             username=self.__username,
             password=self.__password,
             **other_params)
+        self._install_single_flight_auth(
+            auth, self._get_token_cache_key(auth_url, 'v2', other_params))
 
-        self._session_v2 = session.Session(auth=auth)
-        return self._session_v2
+        return session.Session(auth=auth)
 
     def get_session_v3(self):
         """Get a v3 session. See get_session for more details about sessions
@@ -256,9 +349,20 @@ class OpenStackClients(object):
         :return: a session object
         """
 
-        if self._session_v3:
+        session = self._session_v3
+        if session:
+            return session
+
+        # Only one thread creates the session; the others wait and share it
+        with self._lock:
+            if not self._session_v3:
+                self._session_v3 = self._new_session_v3()
             return self._session_v3
 
+    def _new_session_v3(self):
+        """Create a v3 session (see get_session_v3)
+        :return: a session object
+        """
         if self.auth_url.endswith('/v2.0/'):
             auth_url = self.auth_url[0:-4] + '3'
         elif self.auth_url.endswith('/v2.0'):
@@ -269,6 +373,9 @@ class OpenStackClients(object):
         if not self.__username:
             raise Exception('Username must be provided')
 
+        from keystoneclient.auth.identity import v3
+        from keystoneclient import session
+
         other_params = dict()
         if self.__trust_id:
             other_params['trust_id'] = self.__trust_id
@@ -283,9 +390,247 @@ class OpenStackClients(object):
             password=self.__password,
             project_domain_name='default', user_domain_name='default',
             **other_params)
+        self._install_single_flight_auth(
+            auth, self._get_token_cache_key(auth_url, 'v3', other_params))
 
-        self._session_v3 = session.Session(auth=auth)
-        return self._session_v3
+        return session.Session(auth=auth)
+
+    def _timed_authentication(self, authenticate):
+        """Call the authentication function, updating auth_stats
+        :param authenticate: function that requests a token to keystone
+        :return: the result of the function
+        """
+        start_time = time.time()
+        try:
+            result = authenticate()
+        except Exception:
+            with self._lock:
+                self.auth_stats['errors'] += 1
+            _auth_events_metric.labels("error").inc()
+            raise
+        elapsed = time.time() - start_time
+        with self._lock:
+            self.auth_stats['authentications'] += 1
+            self.auth_stats['auth_time_total'] += elapsed
+            self.auth_stats['auth_time_max'] = max(
+                self.auth_stats['auth_time_max'], elapsed)
+        _auth_events_metric.labels("authentication").inc()
+        _auth_duration_metric.observe(elapsed)
+        __logger__.debug("Keystone authentication took %.3f seconds", elapsed)
+        return result
+
+    def enable_token_cache(self, cache_dir=None, expiry_margin=None):
+        """Keep the tokens (and their catalog) in an on-disk cache shared by
+        all the processes of the user, so new OpenStackClients objects do not
+        authenticate while the cached token is valid. It is also enabled
+        defining the environment variable QAUTILS_TOKEN_CACHE_DIR.
+
+        It applies to the sessions created after calling it.
+        :param cache_dir: the cache directory (QAUTILS_TOKEN_CACHE_DIR or
+         ~/.cache/qautils/tokens if omitted)
+        :param expiry_margin: seconds; cached tokens that expire before are
+         not used (300 if omitted)
+        :return: nothing
+        """
+        from qautils.openstack.token_cache_utils import TokenCache, \
+            DEFAULT_EXPIRY_MARGIN
+
+        if expiry_margin is None:
+            expiry_margin = DEFAULT_EXPIRY_MARGIN
+        self._token_cache = TokenCache(cache_dir, expiry_margin)
+
+    def disable_token_cache(self):
+        """Stop using the on-disk token cache (see enable_token_cache)
+        :return: nothing
+        """
+        self._token_cache = None
+
+    def _get_token_cache_key(self, auth_url, version, scope):
+        """
+        :return: the fingerprint of the credential in the token cache, or
+        None if the cache is not enabled
+        """
+        if self._token_cache is None:
+            return None
+        from qautils.openstack.token_cache_utils import get_fingerprint
+
+        return get_fingerprint(auth_url, version, self.__username,
+                               self.__password, sorted(scope.items()))
+
+    def _authenticate_with_cache(self, authenticate, cache_key):
+        """Get the token from the token cache or, if there is not a valid
+        one, authenticate and save the token. Only one process
+        authenticates at the same time for the same credential.
+        :param authenticate: function that requests a token to keystone
+        :param cache_key: the fingerprint of the credential
+        :return: an AccessInfo object
+        """
+        token_cache = self._token_cache
+        access = token_cache.load(cache_key)
+        if access is None:
+            with token_cache.lock(cache_key):
+                access = token_cache.load(cache_key)
+                if access is None:
+                    access = self._timed_authentication(authenticate)
+                    token_cache.store(cache_key, access)
+                    return access
+        with self._lock:
+            self.auth_stats['cache_hits'] += 1
+        _auth_events_metric.labels("cache_hit").inc()
+        __logger__.debug("Token taken from the token cache")
+        return access
+
+    def _install_single_flight_auth(self, auth, cache_key=None):
+        """Make the token requests of the auth plugin single-flight: when
+        several threads need a new token at the same time, only one of them
+        requests it to keystone and the others wait for it. If the token
+        cache is enabled, tokens are taken from (and saved to) it.
+        :param auth: a keystoneclient identity plugin
+        :param cache_key: the fingerprint of the credential in the token
+         cache (None if it is not enabled)
+        :return: nothing
+        """
+        original_get_access = auth.get_access
+        original_invalidate = auth.invalidate
+        auth_lock = threading.Lock()
+
+        def _valid_token():
+            if auth.auth_ref is None:
+                return False
+            needs_reauthenticate = getattr(auth, '_needs_reauthenticate',
+                                           None)
+            return needs_reauthenticate is not None and \
+                not needs_reauthenticate()
+
+        def get_access(session, **kwargs):
+            if _valid_token():
+                return auth.auth_ref
+            if not auth_lock.acquire(False):
+                with self._lock:
+                    self.auth_stats['waits'] += 1
+                auth_lock.acquire()
+            try:
+                if _valid_token():
+                    return auth.auth_ref
+                if cache_key is not None and self._token_cache is not None:
+                    auth.auth_ref = self._authenticate_with_cache(
+                        lambda: auth.get_auth_ref(session, **kwargs),
+                        cache_key)
+                    return auth.auth_ref
+                return self._timed_authentication(
+                    lambda: original_get_access(session, **kwargs))
+            finally:
+                auth_lock.release()
+
+        def invalidate():
+            # A token rejected by keystone must not be taken from the cache
+            if cache_key is not None and self._token_cache is not None and \
+                    auth.auth_ref is not None:
+                self._token_cache.discard(cache_key, auth.auth_ref.auth_token)
+            return original_invalidate()
+
+        auth.get_access = get_access
+        auth.invalidate = invalidate
+        auth.qautils_auth_lock = auth_lock
+        auth.qautils_cache_key = cache_key
+
+    def refresh_token(self, session=None,
+                      refresh_margin=DEFAULT_REFRESH_MARGIN):
+        """Request a new token if the current one expires in less than
+        refresh_margin seconds. The old token is used by other threads
+        until the new one is available.
+        :param session: the session (get_session if omitted)
+        :param refresh_margin: seconds before the expiration
+        :return: True if the token was refreshed
+        """
+        if session is None:
+            session = self.get_session()
+        auth = session.auth
+        auth_lock = getattr(auth, 'qautils_auth_lock', None)
+        if auth.auth_ref is None or auth_lock is None or \
+                not auth.auth_ref.will_expire_soon(refresh_margin):
+            return False
+        with auth_lock:
+            if not auth.auth_ref.will_expire_soon(refresh_margin):
+                return False
+            auth.auth_ref = self._timed_authentication(
+                lambda: auth.get_auth_ref(session))
+            cache_key = getattr(auth, 'qautils_cache_key', None)
+            if cache_key is not None and self._token_cache is not None:
+                self._token_cache.store(cache_key, auth.auth_ref)
+        with self._lock:
+            self.auth_stats['proactive_refreshes'] += 1
+        __logger__.debug("Token refreshed before its expiration")
+        return True
+
+    def _seconds_to_refresh(self, session, refresh_margin):
+        """
+        :return: seconds until the token of the session must be refreshed
+        """
+        import calendar
+
+        auth_ref = session.auth.auth_ref
+        if auth_ref is None or auth_ref.expires is None:
+            return REFRESHER_CHECK_INTERVAL
+        expires = calendar.timegm(auth_ref.expires.utctimetuple())
+        return expires - refresh_margin - time.time()
+
+    def _run_token_refresher(self, stop_event, refresh_margin):
+        wait_time = 0
+        while not stop_event.wait(wait_time):
+            wait_time = REFRESHER_CHECK_INTERVAL
+            for session in (self._session_v2, self._session_v3):
+                if session is None:
+                    continue
+                try:
+                    self.refresh_token(session, refresh_margin)
+                    wait_time = min(wait_time, max(
+                        1, self._seconds_to_refresh(session, refresh_margin)))
+                except Exception as e:
+                    __logger__.warning("Error refreshing the token: %s", e)
+
+    def start_token_refresher(self, refresh_margin=DEFAULT_REFRESH_MARGIN):
+        """Start a background thread that refreshes the tokens of the
+        sessions refresh_margin seconds before they expire, so the threads
+        using the session never wait for a new token (nor get a 401).
+        :param refresh_margin: seconds before the expiration
+        :return: nothing
+        """
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher_stop = threading.Event()
+            self._refresher = threading.Thread(
+                target=self._run_token_refresher,
+                args=[self._refresher_stop, refresh_margin],
+                name="TokenRefresher")
+            self._refresher.daemon = True
+            self._refresher.start()
+
+    def stop_token_refresher(self):
+        """Stop the token refresher thread (see start_token_refresher)
+        :return: nothing
+        """
+        with self._lock:
+            if self._refresher_stop is not None:
+                self._refresher_stop.set()
+            self._refresher = None
+
+    def get_auth_stats(self):
+        """Get the authentication counters
+        :return: a dictionary with the following keys:
+          *authentications: number of token requests to keystone
+          *proactive_refreshes: tokens refreshed before their expiration
+          *waits: callers that waited for a token requested by another thread
+          *errors: failed token requests
+          *cache_hits: tokens taken from the on-disk token cache
+          *auth_time_total, auth_time_max, auth_time_mean: seconds
+        """
+        with self._lock:
+            stats = dict(self.auth_stats)
+        stats['auth_time_mean'] = stats['auth_time_total'] / \
+            stats['authentications'] if stats['authentications'] else 0.0
+        return stats
 
     def get_neutronclient(self):
         """Get a neutron client. A neutron client is different for each region
@@ -301,8 +646,11 @@ class OpenStackClients(object):
 
         :return: a neutron client valid for a region.
         """
-        return neutronclient.Client(
-            session=self.get_session(), region_name=self.region)
+        def _build(session):
+            from neutronclient.v2_0 import client as neutronclient
+            return neutronclient.Client(
+                session=session, region_name=self.region)
+        return self._get_cached_client('neutron', _build)
 
     def get_novaclient(self):
         """Get a nova client. A client is different for each region
@@ -318,8 +666,11 @@ class OpenStackClients(object):
 
         :return: a nova client valid for a region.
         """
-        return novaclient.Client(
-            2, region_name=self.region, session=self.get_session())
+        def _build(session):
+            from novaclient import client as novaclient
+            return novaclient.Client(
+                2, region_name=self.region, session=session)
+        return self._get_cached_client('nova', _build)
 
     def get_cinderclient(self):
         """Get a cinder client. A client is different for each region
@@ -335,8 +686,11 @@ class OpenStackClients(object):
 
         :return: a cinder client valid for a region.
         """
-        return cinderclient.Client(session=self.get_session(),
-                                   region_name=self.region)
+        def _build(session):
+            from cinderclient.v2 import client as cinderclient
+            return cinderclient.Client(session=session,
+                                       region_name=self.region)
+        return self._get_cached_client('cinder', _build)
 
     def get_glanceclient(self):
         """Get a glance client. A client is different for each region
@@ -352,19 +706,26 @@ class OpenStackClients(object):
 
         :return: a glance client valid for a region.
         """
-
-        session = self.get_session()
-        token = session.get_token()
-        endpoint = session.get_endpoint(service_type='image',
-                                        region_name=self.region)
-        return glanceclient.Client(version='1', endpoint=endpoint, token=token)
+        def _build(session, token):
+            from glanceclient import client as glanceclient
+            endpoint = session.get_endpoint(service_type='image',
+                                            region_name=self.region)
+            return glanceclient.Client(version='1', endpoint=endpoint,
+                                       token=token)
+        return self._get_cached_client('glance', _build, with_token=True)
 
     def get_swiftclient(self):
-        session = self.get_session()
-        token = session.get_token()
-        endpoint = self.get_public_endpoint('object-store', self.region)
-        token = session.get_token()
-        return swiftclient.Connection(preauthurl=endpoint, preauthtoken=token)
+        """Get a swift connection for the region. The connection uses the
+        current token: a new one is returned when the token changes.
+
+        :return: a swift connection valid for a region.
+        """
+        def _build(session, token):
+            from swiftclient import client as swiftclient
+            endpoint = self.get_public_endpoint('object-store', self.region)
+            return swiftclient.Connection(preauthurl=endpoint,
+                                          preauthtoken=token)
+        return self._get_cached_client('swift', _build, with_token=True)
 
     def get_keystoneclient(self):
         """Get a keystoneclient. A keystone server can be shared among several
@@ -391,14 +752,88 @@ class OpenStackClients(object):
     def get_keystoneclientv2(self):
         """Get a v2 keystone client. See get_keystoneclient for more details.
         :return: a keystone client"""
-        session = self.get_session_v2()
-        return keystonev2.Client(session=session)
+        def _build(session):
+            from keystoneclient.v2_0 import client as keystonev2
+            return keystonev2.Client(session=session)
+        return self._get_cached_client('keystone_v2', _build,
+                                       session=self.get_session_v2(),
+                                       regional=False)
 
     def get_keystoneclientv3(self):
         """Get a v3 keystone client. See get_keystoneclient for more details.
         :return: a keystone client"""
-        session = self.get_session_v3()
-        return keystonev3.Client(session=session)
+        def _build(session):
+            from keystoneclient.v3 import client as keystonev3
+            return keystonev3.Client(session=session)
+        return self._get_cached_client('keystone_v3', _build,
+                                       session=self.get_session_v3(),
+                                       regional=False)
+
+    def _get_cached_client(self, service, build, session=None,
+                           with_token=False, regional=True):
+        """Get the client of the service for the current region and session,
+        building it only the first time.
+
+        :param service: the service name (cache key)
+        :param build: function that builds the client. It receives the
+         session (and the token, if with_token is True)
+        :param session: the session of the client (get_session if omitted)
+        :param with_token: the client uses the token instead of the session.
+         A new client is built when the token changes.
+        :param regional: the client depends on the region
+        :return: the client
+        """
+        if session is None:
+            session = self.get_session()
+        token = session.get_token() if with_token else None
+        key = (service, self.region if regional else None, id(session), token)
+        client = self._clients.get(key)
+        if client is not None:
+            self.client_cache_stats['hits'] += 1
+            _client_cache_metric.labels("hit").inc()
+            return client
+
+        # Threads asking for the same client wait for the first one to build it
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.client_cache_stats['hits'] += 1
+                _client_cache_metric.labels("hit").inc()
+                return client
+            self.client_cache_stats['misses'] += 1
+            _client_cache_metric.labels("miss").inc()
+            if with_token:
+                # Clients of old tokens are not valid anymore
+                for old_key in [old_key for old_key in self._clients
+                                if old_key[:3] == key[:3]]:
+                    del self._clients[old_key]
+                client = build(session, token)
+            else:
+                client = build(session)
+            self._clients[key] = client
+            return client
+
+    def clear_client_cache(self):
+        """Discard the cached clients. It is called automatically when
+        the session changes (set_credential, preserve_session and
+        restore_session).
+        :return: nothing
+        """
+        if self._clients:
+            self.client_cache_stats['invalidations'] += 1
+        self._clients = dict()
+
+    def get_client_cache_stats(self):
+        """Get the counters of the client cache
+        :return: a dictionary with the following keys:
+          *hits: number of clients reused
+          *misses: number of clients built
+          *invalidations: number of times the cache was discarded
+          *clients: number of cached clients
+        """
+        stats = dict(self.client_cache_stats)
+        stats['clients'] = len(self._clients)
+        return stats
 
     def get_catalog(self):
         """Get the catalog from the credential
@@ -408,8 +843,77 @@ class OpenStackClients(object):
            * name: the name of the service (e.g. nova)
            * type: the type of the service (e.g. compute)
         """
+        return self._get_catalog_index()['catalog']
+
+    def _invalidate_catalog_index(self):
+        """Discard the catalog index. It is built again on the next lookup.
+        The endpoint overrides are kept.
+        :return: nothing
+        """
+        if self._catalog_index is not None:
+            self.catalog_stats['invalidations'] += 1
+        self._catalog_index = None
+        self._catalog_index_key = None
+
+    def _get_catalog_index(self):
+        """Get the index of the catalog of the current token. It is built
+        the first time the catalog is used after getting a new token (or
+        after changing the session or the credential).
+
+        :return: a dictionary with the following keys:
+          *catalog: the catalog (see get_catalog)
+          *services: service_type -> list of endpoints (see get_endpoints)
+          *urls: (service_type, interface, region) -> url
+          *interface_urls: (service_type, interface) -> list of urls
+        """
+        self.catalog_stats['lookups'] += 1
         session = self.get_session()
-        return session.auth.get_access(session)['catalog']
+        access = session.auth.get_access(session)
+        key = (id(session), access.auth_token)
+        index = self._catalog_index
+        if index is not None and self._catalog_index_key == key:
+            return index
+
+        with self._lock:
+            if self._catalog_index is None or self._catalog_index_key != key:
+                self._build_catalog_index(access, key)
+            return self._catalog_index
+
+    def _build_catalog_index(self, access, key):
+        """See _get_catalog_index. It must be called with the lock held."""
+        catalog = access['catalog']
+        services = dict()
+        urls = dict()
+        interface_urls = dict()
+        for service in catalog:
+            services.setdefault(service['type'], service['endpoints'])
+            for endpoint in service['endpoints']:
+                override = self._endpoint_overrides.get(
+                    (service['type'], endpoint['region'],
+                     endpoint['interface']))
+                if override:
+                    endpoint['url'] = override
+                index_key = (service['type'], endpoint['interface'])
+                urls.setdefault(index_key + (endpoint['region'],),
+                                endpoint['url'])
+                interface_urls.setdefault(index_key, list()).append(
+                    endpoint['url'])
+
+        self._catalog_index = {'catalog': catalog, 'services': services,
+                               'urls': urls, 'interface_urls': interface_urls}
+        self._catalog_index_key = key
+        self.catalog_stats['index_builds'] += 1
+        _catalog_index_builds_metric.inc()
+
+    def get_catalog_stats(self):
+        """Get the counters of the catalog index
+        :return: a dictionary with the following keys:
+          *lookups: number of catalog lookups
+          *index_builds: number of times the index was built (new tokens)
+          *invalidations: number of times the index was discarded (new
+           credential or session)
+        """
+        return dict(self.catalog_stats)
 
     def get_endpoints(self, service_type):
         """Get the endpoints for a service.
@@ -423,10 +927,10 @@ class OpenStackClients(object):
           *interface: this value usually is internal/external/admin
        interface (private, public, admin) and other fields
         """
-        for service in self.get_catalog():
-            if service['type'] == service_type:
-                return service['endpoints']
-        raise Exception('not found')
+        endpoints = self._get_catalog_index()['services'].get(service_type)
+        if endpoints is None:
+            raise Exception('not found')
+        return endpoints
 
     def get_interface_endpoint(self, service_type, interface, region=None):
         """Get the URL of the region's public/internal/admin endpoint
@@ -438,20 +942,16 @@ class OpenStackClients(object):
 
         :return: a URL as a string
         """
-        endpoints = self.get_endpoints(service_type)
-        url = None
-        for endpoint in endpoints:
-            if endpoint['interface'] != interface:
-                continue
-            if not region:
-                if url:
-                    raise Exception('A region must be specified')
-                else:
-                    url = endpoint['url']
-            else:
-                if endpoint['region'] == region:
-                    url = endpoint['url']
-                    break
+        index = self._get_catalog_index()
+        if service_type not in index['services']:
+            raise Exception('not found')
+        if region:
+            url = index['urls'].get((service_type, interface, region))
+        else:
+            urls = index['interface_urls'].get((service_type, interface), [])
+            if len(urls) > 1:
+                raise Exception('A region must be specified')
+            url = urls[0] if urls else None
         if not url:
             raise Exception('endpoint not found')
         else:
@@ -475,11 +975,15 @@ class OpenStackClients(object):
         This is a hack, but it is useful for example when the admin
         interface is an internal IP but there is also a tunnel to access
         from outside. This is equivalent to Nova's bypass-url option.
+
+        The override is kept when the token or the credential change.
         """
+        self._endpoint_overrides[(service_type, region, interface)] = url
         for endpoint in self.get_endpoints(service_type):
             if endpoint['region'] == region and\
                endpoint['interface'] == interface:
                     endpoint['url'] = url
+        self._invalidate_catalog_index()
 
     def get_regions(self, service_type):
         """Return a list of regions with endpoints in this service
@@ -487,10 +991,8 @@ class OpenStackClients(object):
         :param service_type: the service type (e.g. compute, network...)
         :return: a list of regions
         """
-        regions = set()
-        for endpoint in self.get_endpoints(service_type):
-            regions.add(endpoint['region'])
-        return regions
+        return set(endpoint['region']
+                   for endpoint in self.get_endpoints(service_type))
 
     def get_token(self):
         """Get the token, useful if you connect with a no standard service
@@ -504,6 +1006,31 @@ class OpenStackClients(object):
         """
         return self.get_session().get_project_id()
 
+    def bulk_delete(self, resource_type, resource_ids, concurrency=16,
+                    **kwargs):
+        """Delete many resources of the current tenant and region at once.
+        The delete requests are sent concurrently and then the status of the
+        pending resources is checked in batches (one list call per batch)
+        until they are gone. Resources that do not exist (404) count as
+        deleted.
+
+        :param resource_type: the resource type (servers, volumes,
+         volume_snapshots, images, ports, networks, subnets, routers,
+         floatingips or security_groups)
+        :param resource_ids: the ids of the resources
+        :param concurrency: max delete requests at once
+        :param kwargs: other parameters of
+         qautils.openstack.bulk_delete_utils.BulkDeleter (e.g. wait, timeout,
+         poll_interval, batch_size)
+        :return: a summary dictionary (see BulkDeleter.run), with the deleted,
+        already_deleted, failed and timed_out resources and the throughput
+        """
+        from qautils.openstack.bulk_delete_utils import BulkDeleter
+
+        deleter = BulkDeleter(self, resource_type, concurrency=concurrency,
+                              **kwargs)
+        return deleter.run(resource_ids)
+
     def preserve_session(self):
         """Preserve the session (or sessions, v2 and v3) cached on the object.
         This sessions can be restored with restore session.
@@ -521,25 +1048,54 @@ class OpenStackClients(object):
           clients.restore_session()
 
         """
-        self._saved_session_v2 = self._session_v2
-        self._saved_session_v3 = self._session_v3
-        self._session_v2 = None
-        self._session_v3 = None
+        with self._lock:
+            self._saved_session_v2 = self._session_v2
+            self._saved_session_v3 = self._session_v3
+            self._session_v2 = None
+            self._session_v3 = None
+            self._invalidate_catalog_index()
+            self.clear_client_cache()
 
     def restore_session(self):
         """Restore the session saved with preserve_session.
 
         See preserve_session for more details"""
 
-        if self._session_v2 and self._session_v2 != self._saved_session_v2:
-            self._session_v2.invalidate()
-        if self._session_v3 and self._session_v3 != self._saved_session_v3:
-            self._session_v3.invalidate()
-        self._session_v2 = self._saved_session_v2
-        self._session_v3 = self._saved_session_v3
+        with self._lock:
+            if self._session_v2 and \
+                    self._session_v2 != self._saved_session_v2:
+                self._session_v2.invalidate()
+            if self._session_v3 and \
+                    self._session_v3 != self._saved_session_v3:
+                self._session_v3.invalidate()
+            self._session_v2 = self._saved_session_v2
+            self._session_v3 = self._saved_session_v3
+            self._invalidate_catalog_index()
+            self.clear_client_cache()
+
+
+class _LazyOpenStackClients(object):
+    """Proxy to an OpenStackClients object that is created the first time
+    one of its attributes is used. Importing this module does not require
+    OS_AUTH_URL to be defined."""
+
+    def __init__(self):
+        self.__dict__['_clients'] = None
+
+    def _get_clients(self):
+        if self._clients is None:
+            self.__dict__['_clients'] = OpenStackClients()
+        return self._clients
+
+    def __getattr__(self, name):
+        return getattr(self._get_clients(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_clients(), name, value)
 
 
 # create an object. This allows using this methods easily with
 # from osclients import osclients
 # nova = osclients.get_novaclient()
-osclients = OpenStackClients()
+# The OpenStackClients object is created the first time it is used.
+osclients = _LazyOpenStackClients()
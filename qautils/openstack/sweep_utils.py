@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+
+"""
+sweep_utils module contains an engine to list or delete the resources of many tenants in many regions in parallel:
+    - SweepEngine: Fans out the list/delete operations over (tenant, region, resource type) with a bounded pool of
+      worker threads. Each credential has its own session (OpenStackClients), the API calls to each region are
+      rate limited and the resource types are processed in phases, following their dependencies (e.g. ports are
+      deleted before networks). Progress and throughput are reported while it runs.
+    - RESOURCE_TYPES: Supported resource types (list and delete functions, and dependencies).
+    - TokenBucket: Rate limiter (used per region).
+    - RateLimitedClients: View of an OpenStackClients whose service clients take a token of the rate limiter on each
+      API call (also on each page of the listings).
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import time
+import types
+import threading
+
+from qautils.logger.logger_utils import get_logger
+from qautils.openstack import listing_utils
+from qautils.openstack.bulk_delete_utils import is_not_found, get_next_poll_interval
+
+
+__logger__ = get_logger(__name__)
+
+ACTION_LIST = 'list'
+ACTION_DELETE = 'delete'
+
+DEFAULT_POOL_SIZE = 16
+
+# Max API calls per second (and burst) to each region
+DEFAULT_REGION_RATE = 10.0
+DEFAULT_REGION_BURST = 20
+
+# Time between progress reports (seconds)
+DEFAULT_PROGRESS_INTERVAL = 10
+
+# Max time waiting for the deleted resources of a phase to disappear, and first and max time between checks (seconds)
+DEFAULT_DELETE_TIMEOUT = 300
+DEFAULT_DELETE_POLL_INTERVAL = 5
+DEFAULT_MAX_DELETE_POLL_INTERVAL = 30
+
+# OpenStackClients methods returning service clients (rate limited by RateLimitedClients)
+_SERVICE_CLIENT_GETTERS = ('get_novaclient', 'get_cinderclient', 'get_glanceclient', 'get_neutronclient',
+                           'get_swiftclient', 'get_keystoneclient', 'get_keystoneclientv2', 'get_keystoneclientv3')
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        """
+        Init the TokenBucket
+        :param rate (float): Tokens added per second
+        :param burst (int): Max tokens
+        :return: None
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_time = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, waiting until there is one available
+        :return (float): Time waited (seconds)
+        """
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_time) * self.rate)
+                self._last_time = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
+
+
+def _iterate_pages(iterator, acquire, page_size=None):
+    """
+    Iterate a lazy listing of a client (generator), taking a token before each request. The first one was taken by
+    the call that returned the generator.
+    :param iterator: Generator returned by the client: pages (neutron, retrieve_all=False), or resources requested in
+    pages of page_size (glance)
+    :param acquire (function): Takes a token
+    :param page_size (int): Resources per request. None if each item is a request (page).
+    :return: Generator of the same items
+    """
+
+    for index, item in enumerate(iterator):
+        if index and (page_size is None or index % page_size == 0):
+            acquire()
+        yield item
+
+
+class _RateLimitedProxy(object):
+    """
+    Proxy of a service client (or of one of its managers, e.g. nova 'servers'): each method call takes a token
+    """
+
+    def __init__(self, target, acquire):
+        self._target = target
+        self._acquire = acquire
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith('_') or isinstance(value, (type, basestring, int, long, float, bool, list, tuple, dict,
+                                                      types.NoneType)):
+            return value
+        if not callable(value):
+            # Resource manager
+            return _RateLimitedProxy(value, self._acquire)
+
+        def _call(*args, **kwargs):
+            self._acquire()
+            result = value(*args, **kwargs)
+            if isinstance(result, types.GeneratorType):
+                return _iterate_pages(result, self._acquire, kwargs.get('page_size'))
+            return result
+        return _call
+
+
+class RateLimitedClients(object):
+
+    def __init__(self, clients, acquire):
+        """
+        Init the RateLimitedClients. The service clients (get_novaclient, get_neutronclient...) are returned behind a
+        proxy that calls 'acquire' before each API call. Other attributes are the ones of the OpenStackClients.
+        :param clients: OpenStackClients
+        :param acquire (function): Called before each API call (e.g. TokenBucket.acquire)
+        :return: None
+        """
+
+        self.clients = clients
+        self.acquire = acquire
+
+    def __getattr__(self, name):
+        value = getattr(self.clients, name)
+        if name in _SERVICE_CLIENT_GETTERS:
+            return lambda *args, **kwargs: _RateLimitedProxy(value(*args, **kwargs), self.acquire)
+        return value
+
+
+def _resource(resource_id, name, raw):
+    return {'id': resource_id, 'name': name, 'raw': raw}
+
+
+def _list_servers(clients):
+    return [_resource(server.id, server.name, server) for server in listing_utils.list_servers(clients)]
+
+
+def _delete_server(clients, resource):
+    clients.get_novaclient().servers.delete(resource['id'])
+
+
+def _list_volume_snapshots(clients):
+    return [_resource(snapshot.id, getattr(snapshot, 'name', None), snapshot)
+            for snapshot in listing_utils.list_volume_snapshots(clients)]
+
+
+def _delete_volume_snapshot(clients, resource):
+    clients.get_cinderclient().volume_snapshots.delete(resource['id'])
+
+
+def _list_volumes(clients):
+    return [_resource(volume.id, getattr(volume, 'name', None), volume)
+            for volume in listing_utils.list_volumes(clients)]
+
+
+def _delete_volume(clients, resource):
+    clients.get_cinderclient().volumes.delete(resource['id'])
+
+
+def _list_images(clients):
+    tenant_id = clients.get_tenant_id()
+    return [_resource(image.id, image.name, image) for image in listing_utils.list_images(clients)
+            if getattr(image, 'owner', None) == tenant_id]
+
+
+def _delete_image(clients, resource):
+    clients.get_glanceclient().images.delete(resource['id'])
+
+
+def _neutron_lister(collection, skip=None):
+    """
+    :return (function): Function that lists the neutron resources of the tenant
+    """
+
+    def _list(clients):
+        resources = listing_utils.list_neutron_resources(clients, collection, tenant_id=clients.get_tenant_id())
+        return [_resource(resource['id'], resource.get('name'), resource) for resource in resources
+                if skip is None or not skip(resource)]
+    return _list
+
+
+def _neutron_deleter(resource_name):
+    """
+    :return (function): Function that deletes a neutron resource
+    """
+
+    def _delete(clients, resource):
+        getattr(clients.get_neutronclient(), "delete_" + resource_name)(resource['id'])
+    return _delete
+
+
+def _delete_router(clients, resource):
+    neutron = clients.get_neutronclient()
+    if resource['raw'].get('external_gateway_info'):
+        neutron.remove_gateway_router(resource['id'])
+    for port in neutron.list_ports(device_id=resource['id'], device_owner='network:router_interface')['ports']:
+        neutron.remove_interface_router(resource['id'], {'port_id': port['id']})
+    neutron.delete_router(resource['id'])
+
+
+# Resource types: list and delete functions, and the resource types that must be deleted before them.
+# Ports owned by routers (interfaces) are removed with their router. In-use volumes can not be deleted, so volumes
+# go after the servers they could be attached to.
+RESOURCE_TYPES = {
+    'servers': {'list': _list_servers, 'delete': _delete_server, 'depends_on': []},
+    'volume_snapshots': {'list': _list_volume_snapshots, 'delete': _delete_volume_snapshot, 'depends_on': []},
+    'volumes': {'list': _list_volumes, 'delete': _delete_volume, 'depends_on': ['servers', 'volume_snapshots']},
+    'images': {'list': _list_images, 'delete': _delete_image, 'depends_on': ['servers']},
+    'floatingips': {'list': _neutron_lister('floatingips'), 'delete': _neutron_deleter('floatingip'),
+                    'depends_on': []},
+    'ports': {'list': _neutron_lister('ports', skip=lambda port: port['device_owner'].startswith('network:')),
+              'delete': _neutron_deleter('port'), 'depends_on': ['servers', 'floatingips']},
+    'routers': {'list': _neutron_lister('routers'), 'delete': _delete_router, 'depends_on': ['floatingips']},
+    'subnets': {'list': _neutron_lister('subnets'), 'delete': _neutron_deleter('subnet'),
+                'depends_on': ['ports', 'routers']},
+    'networks': {'list': _neutron_lister('networks'), 'delete': _neutron_deleter('network'),
+                 'depends_on': ['ports', 'routers', 'subnets']},
+    'security_groups': {'list': _neutron_lister('security_groups', skip=lambda group: group['name'] == 'default'),
+                        'delete': _neutron_deleter('security_group'), 'depends_on': ['servers', 'ports']},
+}
+
+
+def get_phases(resource_types, resource_definitions=None):
+    """
+    Group the resource types in phases: each phase only depends on the previous ones
+    :param resource_types (list): Resource type names
+    :param resource_definitions (dict): Resource type definitions. By default, RESOURCE_TYPES.
+    :return (list): List of lists of resource type names
+    """
+
+    definitions = RESOURCE_TYPES if resource_definitions is None else resource_definitions
+    pending = set(resource_types)
+    phases = list()
+    while pending:
+        phase = sorted(name for name in pending
+                       if not [dependency for dependency in definitions[name]['depends_on']
+                               if dependency in pending])
+        if not phase:
+            raise ValueError("Circular dependencies between resource types: {}".format(sorted(pending)))
+        phases.append(phase)
+        pending.difference_update(phase)
+    return phases
+
+
+class SweepEngine(object):
+
+    def __init__(self, credentials, regions=None, resource_types=None, action=ACTION_LIST, auth_url=None,
+                 pool_size=DEFAULT_POOL_SIZE, region_rate=DEFAULT_REGION_RATE, region_burst=DEFAULT_REGION_BURST,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, progress_callback=None, resource_definitions=None,
+                 clients_factory=None, delete_timeout=DEFAULT_DELETE_TIMEOUT,
+                 delete_poll_interval=DEFAULT_DELETE_POLL_INTERVAL):
+        """
+        Init the SweepEngine
+        :param credentials (list): One dict per tenant with the set_credential parameters (username, password and
+        tenant_name, tenant_id or trust_id)
+        :param regions (list): Region names. By default, the regions of the compute service of each tenant.
+        :param resource_types (list): Resource type names (see RESOURCE_TYPES). By default, all of them.
+        :param action (string): ACTION_LIST or ACTION_DELETE
+        :param auth_url (string): Keystone URL. By default, OS_AUTH_URL.
+        :param pool_size (int): Number of worker threads
+        :param region_rate (float): Max API calls per second to each region
+        :param region_burst (int): Max API calls to a region at once, after being idle
+        :param progress_interval (float): Time between progress reports (seconds)
+        :param progress_callback (function): Called with the progress dict (see get_progress) in each report.
+        By default, the progress is logged.
+        :param resource_definitions (dict): Resource type definitions. By default, RESOURCE_TYPES.
+        :param clients_factory (function): Builds the OpenStackClients of a credential, from (auth_url).
+        By default, OpenStackClients.
+        :param delete_timeout (float): Max time waiting for the resources deleted in a phase to disappear before
+        the next phase (seconds). 0 to not wait.
+        :param delete_poll_interval (float): First (and min) time between checks of the deleted resources (seconds).
+        It grows while no resource disappears.
+        :return: None
+        """
+
+        if action not in (ACTION_LIST, ACTION_DELETE):
+            raise ValueError("Unknown action: {}".format(action))
+
+        self.credentials = credentials
+        self.regions = regions
+        self.resource_definitions = RESOURCE_TYPES if resource_definitions is None else resource_definitions
+        self.resource_types = resource_types or sorted(self.resource_definitions.keys())
+        self.action = action
+        self.auth_url = auth_url
+        self.pool_size = pool_size
+        self.region_rate = region_rate
+        self.region_burst = region_burst
+        self.progress_interval = progress_interval
+        self.progress_callback = progress_callback
+        if clients_factory is None:
+            from qautils.openstack.osclients import OpenStackClients
+            clients_factory = OpenStackClients
+        self.clients_factory = clients_factory
+        self.delete_timeout = delete_timeout
+        self.delete_poll_interval = delete_poll_interval
+
+        self._rate_limiters = dict()
+        self._lock = threading.Lock()
+        self._results = dict()
+        self._progress = {'phase': None, 'tasks_total': 0, 'tasks_done': 0, 'listed': 0, 'deleted': 0, 'errors': 0,
+                          'api_calls': 0, 'rate_limit_wait': 0.0}
+        self._start_time = None
+
+    def _get_rate_limiter(self, region):
+        with self._lock:
+            limiter = self._rate_limiters.get(region)
+            if limiter is None:
+                limiter = self._rate_limiters[region] = TokenBucket(self.region_rate, self.region_burst)
+            return limiter
+
+    def _acquire(self, region):
+        """
+        Take a token of the rate limiter of the region before an API call, and count the call
+        :param region (string): Region name
+        :return: None
+        """
+
+        waited = self._get_rate_limiter(region).acquire()
+        with self._lock:
+            self._progress['api_calls'] += 1
+            self._progress['rate_limit_wait'] += waited
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, increment in increments.iteritems():
+                self._progress[name] += increment
+
+    def _get_result(self, tenant, region, resource_type):
+        """
+        :return (dict): Result of the (tenant, region, resource type): listed, deleted, errors (list of messages)
+        """
+
+        with self._lock:
+            return self._results.setdefault((tenant, region, resource_type),
+                                            {'listed': list(), 'deleted': list(), 'errors': list()})
+
+    def _list_task(self, task):
+        tenant, region, clients, resource_type = task
+        result = self._get_result(tenant, region, resource_type)
+        try:
+            resources = self.resource_definitions[resource_type]['list'](clients)
+        except Exception, e:
+            __logger__.error("Sweep: Error listing %s of '%s' in %s: %s", resource_type, tenant, region, str(e))
+            result['errors'].append("list: {}".format(e))
+            self._count(tasks_done=1, errors=1)
+            return []
+        result['listed'].extend((resource['id'], resource['name']) for resource in resources)
+        self._count(tasks_done=1, listed=len(resources))
+        return [(tenant, region, clients, resource_type, resource) for resource in resources]
+
+    def _delete_task(self, task):
+        tenant, region, clients, resource_type, resource = task
+        result = self._get_result(tenant, region, resource_type)
+        try:
+            self.resource_definitions[resource_type]['delete'](clients, resource)
+        except Exception, e:
+            if is_not_found(e):
+                # Already gone (e.g. deleted with its parent resource)
+                self._count(tasks_done=1)
+                return None
+            __logger__.error("Sweep: Error deleting %s %s of '%s' in %s: %s", resource_type, resource['id'], tenant,
+                             region, str(e))
+            result['errors'].append("delete {}: {}".format(resource['id'], e))
+            self._count(tasks_done=1, errors=1)
+            return None
+        result['deleted'].append(resource['id'])
+        self._count(tasks_done=1, deleted=1)
+        return task
+
+    def _wait_deleted_task(self, task):
+        """
+        Wait until the deleted resources of the (tenant, region, resource type) are not listed anymore
+        """
+
+        tenant, region, clients, resource_type, resource_ids = task
+        deadline = time.time() + self.delete_timeout
+        pending = set(resource_ids)
+        interval = self.delete_poll_interval
+        while pending and time.time() < deadline:
+            time.sleep(min(interval, max(0, deadline - time.time())))
+            try:
+                listed = self.resource_definitions[resource_type]['list'](clients)
+            except Exception, e:
+                __logger__.debug("Sweep: Error checking deleted %s of '%s' in %s: %s", resource_type, tenant,
+                                 region, str(e))
+                continue
+            pending_count = len(pending)
+            pending.intersection_update(resource['id'] for resource in listed)
+            interval = get_next_poll_interval(interval, len(pending) < pending_count, self.delete_poll_interval,
+                                              max(self.delete_poll_interval, DEFAULT_MAX_DELETE_POLL_INTERVAL))
+        if pending:
+            __logger__.warning("Sweep: %d %s of '%s' in %s are still there after %s seconds", len(pending),
+                               resource_type, tenant, region, self.delete_timeout)
+            self._get_result(tenant, region, resource_type)['errors'].append(
+                "not deleted after {} seconds: {}".format(self.delete_timeout, sorted(pending)))
+
+    def _prepare_clients(self, credential):
+        """
+        Build the OpenStackClients of the credential and authenticate it (one session per credential), and get one
+        view of it per region.
+        :param credential (dict): set_credential parameters
+        :return (list): (tenant, region, clients) tuples
+        """
+
+        tenant = credential.get('tenant_name') or credential.get('tenant_id') or credential.get('trust_id')
+        clients = self.clients_factory(self.auth_url)
+        clients.set_credential(**credential)
+        try:
+            clients.get_token()
+            regions = self.regions or sorted(clients.get_regions('compute'))
+        except Exception, e:
+            __logger__.error("Sweep: Error authenticating tenant '%s': %s", tenant, str(e))
+            self._get_result(tenant, None, None)['errors'].append("auth: {}".format(e))
+            self._count(errors=1)
+            return []
+        # Every API call of the region (each page of the listings, each call of a router deletion...) is rate limited
+        return [(tenant, region, RateLimitedClients(clients.for_region(region),
+                                                    lambda region=region: self._acquire(region)))
+                for region in regions]
+
+    def _report_progress(self, stop_event):
+        while not stop_event.wait(self.progress_interval):
+            self._emit_progress()
+
+    def _emit_progress(self):
+        progress = self.get_progress()
+        if self.progress_callback is not None:
+            self.progress_callback(progress)
+        else:
+            __logger__.info("Sweep: phase %s; tasks %d/%d; listed %d; deleted %d; errors %d; %.1f API calls/s",
+                            progress['phase'], progress['tasks_done'], progress['tasks_total'], progress['listed'],
+                            progress['deleted'], progress['errors'], progress['api_calls_per_second'])
+
+    def get_progress(self):
+        """
+        :return (dict): phase (resource types being processed), tasks_total, tasks_done, listed, deleted, errors,
+        api_calls, api_calls_per_second, deleted_per_second, rate_limit_wait (seconds) and elapsed (seconds)
+        """
+
+        with self._lock:
+            progress = dict(self._progress)
+        progress['elapsed'] = time.time() - self._start_time if self._start_time else 0.0
+        elapsed = progress['elapsed'] or 1.0
+        progress['api_calls_per_second'] = progress['api_calls'] / elapsed
+        progress['deleted_per_second'] = progress['deleted'] / elapsed
+        return progress
+
+    def run(self):
+        """
+        Run the sweep. The resource types are processed phase by phase (see get_phases); in each phase, all
+        (tenant, region, resource type) combinations are listed (and their resources deleted) in parallel.
+        :return (dict): (tenant, region, resource type) -> dict with listed (list of (id, name)), deleted (list of
+        ids) and errors (list of messages)
+        """
+
+        from multiprocessing.pool import ThreadPool
+
+        self._start_time = time.time()
+        pool = ThreadPool(self.pool_size)
+        stop_event = threading.Event()
+        reporter = threading.Thread(target=self._report_progress, args=[stop_event], name="SweepProgress")
+        reporter.daemon = True
+        reporter.start()
+        try:
+            targets = [target for targets in pool.map(self._prepare_clients, self.credentials)
+                       for target in targets]
+            for phase in get_phases(self.resource_types, self.resource_definitions):
+                with self._lock:
+                    self._progress['phase'] = phase
+                list_tasks = [(tenant, region, clients, resource_type) for tenant, region, clients in targets
+                              for resource_type in phase]
+                self._count(tasks_total=len(list_tasks))
+                delete_tasks = list()
+                for tasks in pool.imap_unordered(self._list_task, list_tasks):
+                    delete_tasks.extend(tasks)
+                if self.action == ACTION_DELETE and delete_tasks:
+                    self._count(tasks_total=len(delete_tasks))
+                    deleted_tasks = [task for task in pool.imap_unordered(self._delete_task, delete_tasks) if task]
+                    if self.delete_timeout and deleted_tasks:
+                        # Next phases depend on these resources being gone, not only on their deletion requests
+                        deleted = dict()
+                        for tenant, region, clients, resource_type, resource in deleted_tasks:
+                            deleted.setdefault((tenant, region, clients, resource_type), list()).append(
+                                resource['id'])
+                        pool.map(self._wait_deleted_task, [key + (resource_ids,)
+                                                           for key, resource_ids in deleted.iteritems()])
+        finally:
+            stop_event.set()
+            pool.close()
+            pool.join()
+        self._emit_progress()
+        return dict(self._results)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+token_cache_utils module contains an on-disk cache of Keystone tokens (with their catalog), so short-lived scripts
+do not authenticate on every run:
+    - TokenCache: Stores the tokens in files readable only by the user, keyed by the fingerprint of the Keystone URL
+      and the credential. Tokens about to expire are not returned. Processes sharing the cache authenticate only once
+      (file locking). Used by OpenStackClients.enable_token_cache.
+    - get_fingerprint: Cache key of a Keystone URL and credential.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import json
+import time
+import fcntl
+import hashlib
+import calendar
+import tempfile
+from contextlib import contextmanager
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+# Environment variable with the cache directory. When it is defined, OpenStackClients uses the cache.
+TOKEN_CACHE_DIR_ENV_VAR = "QAUTILS_TOKEN_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "qautils", "tokens")
+
+# Cached tokens expiring in less than this time (seconds) are not used
+DEFAULT_EXPIRY_MARGIN = 300
+
+# Version of the format of the cache files
+_FORMAT_VERSION = 1
+
+
+def get_fingerprint(auth_url, *credential):
+    """
+    Get the cache key of a credential. The credential values (password included) can not be obtained from it.
+    :param auth_url (string): Keystone URL
+    :param credential: Values of the credential (user, password, tenant, trust, domain...)
+    :return (string): Hexadecimal SHA-256 digest
+    """
+
+    return hashlib.sha256(json.dumps([auth_url] + list(credential))).hexdigest()
+
+
+def _get_expiration(auth_ref):
+    """
+    :param auth_ref: keystoneclient AccessInfo
+    :return (float): Expiration time of the token (epoch seconds). None if unknown.
+    """
+
+    if auth_ref.expires is None:
+        return None
+    return calendar.timegm(auth_ref.expires.utctimetuple())
+
+
+class TokenCache(object):
+
+    def __init__(self, cache_dir=None, expiry_margin=DEFAULT_EXPIRY_MARGIN):
+        """
+        Init the TokenCache. The directory is created (only accessible by the user) if it does not exist.
+        :param cache_dir (string): Cache directory. By default, QAUTILS_TOKEN_CACHE_DIR or ~/.cache/qautils/tokens
+        :param expiry_margin (float): Cached tokens expiring in less than this time (seconds) are not used
+        :return: None
+        """
+
+        self.cache_dir = os.path.expanduser(cache_dir or os.environ.get(TOKEN_CACHE_DIR_ENV_VAR) or
+                                            DEFAULT_CACHE_DIR)
+        self.expiry_margin = expiry_margin
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir, 0700)
+            except OSError:
+                # Created by another process at the same time
+                if not os.path.isdir(self.cache_dir):
+                    raise
+
+    def _get_path(self, fingerprint, extension="json"):
+        return os.path.join(self.cache_dir, "{}.{}".format(fingerprint, extension))
+
+    @contextmanager
+    def lock(self, fingerprint):
+        """
+        Exclusive lock of a cache entry, shared by all processes. While a process authenticates, the others wait for
+        the token instead of authenticating too.
+        :param fingerprint (string): Cache key (see get_fingerprint)
+        :return: Context manager
+        """
+
+        lock_fd = os.open(self._get_path(fingerprint, "lock"), os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    def load(self, fingerprint):
+        """
+        Get the cached token of a credential
+        :param fingerprint (string): Cache key (see get_fingerprint)
+        :return: keystoneclient AccessInfo (token and catalog). None if there is no valid token.
+        """
+
+        try:
+            with open(self._get_path(fingerprint)) as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+        if entry.get('format') != _FORMAT_VERSION:
+            return None
+        expires_at = entry.get('expires_at')
+        if expires_at is None or expires_at - self.expiry_margin <= time.time():
+            return None
+
+        from keystoneclient.access import AccessInfo
+
+        return AccessInfo.factory(body=entry['body'], auth_token=entry['auth_token'])
+
+    def store(self, fingerprint, auth_ref):
+        """
+        Save a token in the cache. The file is replaced atomically and only the user can read it.
+        :param fingerprint (string): Cache key (see get_fingerprint)
+        :param auth_ref: keystoneclient AccessInfo
+        :return (bool): True if saved (tokens without expiration are not saved)
+        """
+
+        expires_at = _get_expiration(auth_ref)
+        if expires_at is None:
+            return False
+        body = {'token': dict(auth_ref)} if auth_ref.version == 'v3' else {'access': dict(auth_ref)}
+        entry = {'format': _FORMAT_VERSION, 'expires_at': expires_at, 'auth_token': auth_ref.auth_token,
+                 'body': body}
+
+        # mkstemp creates the file with mode 0600
+        fd, temporary_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".{}.".format(fingerprint))
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.rename(temporary_path, self._get_path(fingerprint))
+        except Exception:
+            os.unlink(temporary_path)
+            raise
+        __logger__.debug("Token cache: Token %s... saved", fingerprint[:8])
+        return True
+
+    def discard(self, fingerprint, auth_token=None):
+        """
+        Remove a cached token (e.g. when Keystone rejects it)
+        :param fingerprint (string): Cache key (see get_fingerprint)
+        :param auth_token (string): Remove it only if it is this token. None to remove it always.
+        :return: None
+        """
+
+        path = self._get_path(fingerprint)
+        if auth_token is not None:
+            try:
+                with open(path) as cache_file:
+                    if json.load(cache_file).get('auth_token') != auth_token:
+                        return
+            except (IOError, ValueError):
+                return
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Remove all the cached tokens
+        :return: None
+        """
+
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".json"):
+                self.discard(file_name[:-len(".json")])
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+capture_index_utils module contains a sidecar index for capture files, written while the capture grows:
+    - CaptureIndexWriter: Records the offset and the timestamp of each captured line in '<capture>.idx' and,
+      optionally, a trigram filter for each block of lines in '<capture>.ngr'. Used by CaptureWriter.
+    - CaptureIndex: Reads the index with mmap and finds the lines matching a pattern between two timestamps,
+      without scanning the whole capture. It can be refreshed while the capture is still growing.
+    - parse_timestamp: Parses the timestamp of a log line.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import re
+import time
+import mmap
+import struct
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+LINE_INDEX_EXTENSION = ".idx"
+NGRAM_INDEX_EXTENSION = ".ngr"
+
+# Line record: offset of the line in the capture file, timestamp (epoch seconds, 0 if not known yet)
+LINE_RECORD = struct.Struct("<Qd")
+
+# Lines in each block of the trigram index, and size of the bitmap of each block (bytes)
+NGRAM_BLOCK_LINES = 128
+NGRAM_BITMAP_SIZE = 4096
+NGRAM_RECORD = struct.Struct("<I{}s".format(NGRAM_BITMAP_SIZE))
+_NGRAM_BITS_MASK = NGRAM_BITMAP_SIZE * 8 - 1
+
+# Default timestamp of log lines: '2015-06-01 10:11:12,123' or '2015-06-01T10:11:12.123'
+DEFAULT_TIMESTAMP_PATTERN = r"(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})(?:[.,](\d+))?"
+DEFAULT_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Parsed seconds of parse_timestamp, keyed by (timestamp pattern, timestamp format, seconds text). Many lines share
+# the same second: each one is parsed only once. Cleared when it reaches _SECONDS_CACHE_SIZE entries.
+_seconds_cache = dict()
+_SECONDS_CACHE_SIZE = 10000
+
+
+def parse_timestamp(line, timestamp_regex, timestamp_format=DEFAULT_TIMESTAMP_FORMAT):
+    """
+    Parse the timestamp of a log line. The first group of the regular expression is parsed with the format,
+    the optional second group is the fraction of second.
+    :param line (string): Log line
+    :param timestamp_regex: Compiled regular expression
+    :param timestamp_format (string): time.strptime format of the first group ('T' is replaced by a space)
+    :return (float): Epoch seconds (local time) or None if the line has no timestamp
+    """
+
+    match = timestamp_regex.search(line)
+    if match is None:
+        return None
+    seconds_text = match.group(1).replace("T", " ")
+    cache_key = (timestamp_regex.pattern, timestamp_format, seconds_text)
+    seconds = _seconds_cache.get(cache_key)
+    if seconds is None:
+        try:
+            seconds = time.mktime(time.strptime(seconds_text, timestamp_format))
+        except ValueError:
+            return None
+        if len(_seconds_cache) >= _SECONDS_CACHE_SIZE:
+            _seconds_cache.clear()
+        _seconds_cache[cache_key] = seconds
+    fraction = match.group(2) if timestamp_regex.groups > 1 else None
+    return seconds + float("0." + fraction) if fraction else seconds
+
+
+def _ngram_hashes(text):
+    """
+    :param text (string): Text
+    :return (set): Bitmap positions of the trigrams of the text
+    """
+
+    return set(((ord(a) << 16 | ord(b) << 8 | ord(c)) * 2654435761 >> 11) & _NGRAM_BITS_MASK
+               for a, b, c in set(text[i:i + 3] for i in xrange(len(text) - 2)))
+
+
+class CaptureIndexWriter(object):
+
+    def __init__(self, capture_path, timestamp_pattern=DEFAULT_TIMESTAMP_PATTERN,
+                 timestamp_format=DEFAULT_TIMESTAMP_FORMAT, ngram_index=False, mode='w'):
+        """
+        Init the CaptureIndexWriter and open the index files
+        :param capture_path (string): Capture file path. The index files are created next to it.
+        :param timestamp_pattern (string): Regular expression of the line timestamp (see parse_timestamp).
+        None to not parse timestamps. Lines without timestamp take the timestamp of the previous line.
+        :param timestamp_format (string): time.strptime format of the timestamp
+        :param ngram_index (bool): Also write the trigram index, to speed up literal searches
+        :param mode (string): 'w' (truncate) or 'a' (append)
+        :return: None
+        """
+
+        self.capture_path = capture_path
+        self.timestamp_regex = re.compile(timestamp_pattern) if timestamp_pattern else None
+        self.timestamp_format = timestamp_format
+        self.ngram_index = ngram_index
+
+        self._line_file = open(capture_path + LINE_INDEX_EXTENSION, mode + 'b')
+        self._ngram_file = open(capture_path + NGRAM_INDEX_EXTENSION, mode + 'b') if ngram_index else None
+        self._pending_records = list()
+        self._pending_blocks = list()
+        self._block_lines = list()
+        self.lines = os.fstat(self._line_file.fileno()).st_size // LINE_RECORD.size if mode == 'a' else 0
+        self._block_start = self.lines
+        self._last_timestamp = 0.0
+
+    def add_lines(self, lines, offset):
+        """
+        Index the lines. They are written to the index files with 'flush'.
+        :param lines (list): Lines (without line breaks)
+        :param offset (int): Offset of the first line in the capture file
+        :return: None
+        """
+
+        for line in lines:
+            if self.timestamp_regex is not None:
+                timestamp = parse_timestamp(line, self.timestamp_regex, self.timestamp_format)
+                if timestamp is not None:
+                    self._last_timestamp = timestamp
+            self._pending_records.append(LINE_RECORD.pack(offset, self._last_timestamp))
+            offset += len(line) + 1
+
+            if self.ngram_index:
+                self._block_lines.append(line)
+                if len(self._block_lines) == NGRAM_BLOCK_LINES:
+                    self._close_block()
+        self.lines += len(lines)
+
+    def _close_block(self):
+        """
+        Build the trigram bitmap of the current block of lines
+        :return: None
+        """
+
+        bitmap = bytearray(NGRAM_BITMAP_SIZE)
+        for position in _ngram_hashes("\n".join(self._block_lines)):
+            bitmap[position >> 3] |= 1 << (position & 7)
+        self._pending_blocks.append(NGRAM_RECORD.pack(self._block_start, str(bitmap)))
+        self._block_start += len(self._block_lines)
+        self._block_lines = list()
+
+    def flush(self):
+        """
+        Write the pending records. It must be called after writing the indexed lines to the capture file.
+        :return: None
+        """
+
+        if self._pending_records:
+            self._line_file.write("".join(self._pending_records))
+            self._line_file.flush()
+            self._pending_records = list()
+        if self._pending_blocks:
+            self._ngram_file.write("".join(self._pending_blocks))
+            self._ngram_file.flush()
+            self._pending_blocks = list()
+
+    def close(self):
+        """
+        Write the pending records and close the index files. The last incomplete block has no trigram record.
+        :return: None
+        """
+
+        self.flush()
+        self._line_file.close()
+        if self._ngram_file is not None:
+            self._ngram_file.close()
+
+
+class CaptureIndex(object):
+
+    def __init__(self, capture_path):
+        """
+        Init the CaptureIndex. The capture and its index files are mapped in memory (read only).
+        :param capture_path (string): Capture file path
+        :return: None
+        """
+
+        self.capture_path = capture_path
+        self.lines = 0
+        self._capture_map = None
+        self._line_map = None
+        self._ngram_map = None
+        self._ngram_blocks = 0
+        self.refresh()
+
+    @staticmethod
+    def _map(path):
+        """
+        :return: Read-only mmap of the file, or None if the file does not exist or is empty
+        """
+
+        try:
+            with open(path, 'rb') as file_object:
+                if os.fstat(file_object.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError):
+            return None
+
+    def refresh(self):
+        """
+        Map the files again to see the lines captured since the last refresh
+        :return (int): Number of indexed lines
+        """
+
+        self.close()
+        # The line index is mapped first: its lines are always in the capture file mapped after it
+        self._line_map = self._map(self.capture_path + LINE_INDEX_EXTENSION)
+        self._ngram_map = self._map(self.capture_path + NGRAM_INDEX_EXTENSION)
+        self._capture_map = self._map(self.capture_path)
+        self.lines = len(self._line_map) // LINE_RECORD.size if self._line_map is not None else 0
+        self._ngram_blocks = len(self._ngram_map) // NGRAM_RECORD.size if self._ngram_map is not None else 0
+        return self.lines
+
+    def close(self):
+        """
+        Unmap the files
+        :return: None
+        """
+
+        for mapped in (self._capture_map, self._line_map, self._ngram_map):
+            if mapped is not None:
+                mapped.close()
+        self._capture_map = self._line_map = self._ngram_map = None
+
+    def _record(self, line_number):
+        """
+        :return (tuple): (offset, timestamp) of the line
+        """
+        return LINE_RECORD.unpack_from(self._line_map, line_number * LINE_RECORD.size)
+
+    def get_timestamp(self, line_number):
+        """
+        :param line_number (int): Line number (starting at 0)
+        :return (float): Timestamp of the line (epoch seconds, 0 if unknown)
+        """
+        return self._record(line_number)[1]
+
+    def get_line(self, line_number):
+        """
+        :param line_number (int): Line number (starting at 0)
+        :return (string): Line (without line break)
+        """
+
+        offset = self._record(line_number)[0]
+        end = self._capture_map.find("\n", offset)
+        return self._capture_map[offset:end if end != -1 else len(self._capture_map)]
+
+    def _first_line_from(self, timestamp):
+        """
+        Binary search of the first line with a timestamp >= the given one (timestamps do not decrease)
+        :return (int): Line number
+        """
+
+        low, high = 0, self.lines
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _candidate_ranges(self, start, end, literal):
+        """
+        Ranges of lines that can contain the literal, according to the trigram index
+        :return (list): (first line, last line + 1) tuples
+        """
+
+        if self._ngram_map is None or literal is None or len(literal) < 3:
+            return [(start, end)]
+        positions = _ngram_hashes(literal)
+        ranges = list()
+        indexed_end = start
+        for block in xrange(self._ngram_blocks):
+            block_start = struct.unpack_from("<I", self._ngram_map, block * NGRAM_RECORD.size)[0]
+            block_end = block_start + NGRAM_BLOCK_LINES
+            indexed_end = max(indexed_end, block_end)
+            if block_end <= start or block_start >= end:
+                continue
+            bitmap_offset = block * NGRAM_RECORD.size + 4
+            if all(ord(self._ngram_map[bitmap_offset + (position >> 3)]) & (1 << (position & 7))
+                   for position in positions):
+                ranges.append((max(block_start, start), min(block_end, end)))
+        # Lines of the last (incomplete) block are not in the trigram index
+        if indexed_end < end:
+            ranges.append((max(indexed_end, start), end))
+        return ranges
+
+    def query(self, pattern=None, start_time=None, end_time=None, is_regex=False, refresh=True):
+        """
+        Find the lines matching the pattern between two timestamps
+        :param pattern (string): Literal text (or regular expression) to look for. None to return all lines.
+        :param start_time (float): Min timestamp (epoch seconds, included). None for no limit.
+        :param end_time (float): Max timestamp (epoch seconds, included). None for no limit.
+        :param is_regex (bool): The pattern is a regular expression
+        :param refresh (bool): Refresh the index before searching, to see the last captured lines
+        :return (list): (line number, timestamp, line) tuples
+        """
+
+        if refresh:
+            self.refresh()
+        if self.lines == 0:
+            return []
+
+        start = self._first_line_from(start_time) if start_time is not None else 0
+        end = self._first_line_from(end_time + 1e-6) if end_time is not None else self.lines
+        regex = re.compile(pattern) if pattern is not None and is_regex else None
+
+        results = list()
+        for range_start, range_end in self._candidate_ranges(start, end, None if is_regex else pattern):
+            for line_number in xrange(range_start, range_end):
+                line = self.get_line(line_number)
+                if pattern is None or (regex.search(line) if regex is not None else pattern in line):
+                    results.append((line_number, self.get_timestamp(line_number), line))
+        return results
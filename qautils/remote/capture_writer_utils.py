@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+capture_writer_utils module contains a buffered writer for captured logs:
+    - CaptureWriter: Keeps the captured lines in memory and writes them in one system call when the buffer is full
+      or when the flush interval has passed. The capture file can be compressed on the fly (gzip).
+      Lines/sec and bytes/sec are available with get_stats. An optional sidecar index (see capture_index_utils)
+      is written with the data.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import time
+import atexit
+import weakref
+import threading
+
+from qautils.logger.logger_utils import get_logger
+from qautils.metrics.metrics_utils import get_metrics_registry
+
+
+__logger__ = get_logger(__name__)
+
+_lines_metric = get_metrics_registry().counter("capture_lines_total", "Lines captured by the CaptureWriters")
+_written_bytes_metric = get_metrics_registry().counter("capture_written_bytes_total",
+                                                       "Bytes written by the CaptureWriters (before compression)")
+_flushes_metric = get_metrics_registry().counter("capture_flushes_total", "Flushes of the CaptureWriters")
+
+# Flush when the buffered data reaches this size (bytes)
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+# Flush the buffered data after this time (seconds), also when no more lines arrive
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+COMPRESSION_GZIP = 'gzip'
+
+# Writers with a flush interval, flushed by the shared flusher thread (see _start_flusher)
+_flushed_writers = weakref.WeakKeyDictionary()
+_flusher_lock = threading.Lock()
+_flusher_thread = None
+_flusher_stop = threading.Event()
+
+# Time between checks of the flusher thread (seconds)
+_FLUSHER_CHECK_PERIOD = 0.1
+
+
+def _flusher_loop():
+    """
+    Flush the writers whose flush interval has passed, until _stop_flusher is called
+    :return: None
+    """
+
+    while not _flusher_stop.wait(_FLUSHER_CHECK_PERIOD):
+        with _flusher_lock:
+            writers = _flushed_writers.keys()
+        for writer in writers:
+            try:
+                writer.flush_if_due()
+            except Exception, e:
+                __logger__.error("Capture writer: Error flushing '%s': %s", writer.file_path, str(e))
+
+
+def _start_flusher(writer):
+    """
+    Register the writer in the shared flusher thread (launched on first call)
+    :param writer: CaptureWriter
+    :return: None
+    """
+
+    global _flusher_thread
+    with _flusher_lock:
+        _flushed_writers[writer] = True
+        if _flusher_thread is None:
+            _flusher_thread = threading.Thread(target=_flusher_loop, name="CaptureFlusher")
+            _flusher_thread.daemon = True
+            _flusher_thread.start()
+
+
+@atexit.register
+def _stop_flusher():
+    """
+    Stop the flusher thread at exit, before the interpreter tears down the module globals it uses, and write the
+    data still buffered in the registered writers
+    :return: None
+    """
+
+    _flusher_stop.set()
+    if _flusher_thread is not None:
+        _flusher_thread.join()
+    with _flusher_lock:
+        writers = _flushed_writers.keys()
+    for writer in writers:
+        try:
+            writer.flush()
+        except Exception, e:
+            __logger__.error("Capture writer: Error flushing '%s' at exit: %s", writer.file_path, str(e))
+
+
+class CaptureWriter(object):
+
+    def __init__(self, file_path, buffer_size=DEFAULT_BUFFER_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 compression=None, mode='w', index=None):
+        """
+        Init the CaptureWriter and open the capture file
+        :param file_path (string): Capture file path. '.gz' is appended when compressing with gzip.
+        :param buffer_size (int): Flush when the buffered data reaches this size (bytes). 0 to flush every write.
+        :param flush_interval (float): Flush the buffered data after this time (seconds). None to flush only by size.
+        :param compression (string): None or 'gzip'
+        :param mode (string): 'w' (truncate) or 'a' (append)
+        :param index: CaptureIndexWriter of this capture file, or None. Not supported with compression.
+        :return: None
+        """
+
+        if compression not in (None, COMPRESSION_GZIP):
+            raise ValueError("Unsupported compression: {}".format(compression))
+        if compression is not None and index is not None:
+            raise ValueError("Compressed captures can not be indexed")
+
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+
+        if compression == COMPRESSION_GZIP:
+            import gzip
+            self.file_path = file_path + ".gz"
+            self._file = gzip.open(self.file_path, mode + 'b')
+            self._fd = None
+        else:
+            self.file_path = file_path
+            self._fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if mode == 'a' else os.O_TRUNC),
+                               0644)
+            self._file = None
+        self.index = index
+        self._offset = os.fstat(self._fd).st_size if self._fd is not None else 0
+
+        self._buffer = list()
+        self._buffered_bytes = 0
+        self._lock = threading.Lock()
+        self.closed = False
+
+        self.lines = 0
+        self.bytes = 0
+        self.flushes = 0
+        self.start_time = time.time()
+        self.last_flush_time = self.start_time
+
+        if flush_interval is not None:
+            _start_flusher(self)
+
+    def write_lines(self, lines):
+        """
+        Add the lines to the buffer. A line break is appended to each line.
+        :param lines (list): Lines (without line breaks)
+        :return: None
+        """
+
+        if not lines:
+            return
+        data = "\n".join(lines) + "\n"
+        with self._lock:
+            if self.index is not None:
+                self.index.add_lines(lines, self._offset)
+            self._offset += len(data)
+            self._buffer.append(data)
+            self._buffered_bytes += len(data)
+            self.lines += len(lines)
+            _lines_metric.inc(len(lines))
+            self.bytes += len(data)
+            if self._buffered_bytes >= self.buffer_size:
+                self._flush()
+
+    def write(self, data):
+        """
+        Add raw data to the buffer. Not supported for indexed captures (use write_lines).
+        :param data (string): Data
+        :return: None
+        """
+
+        if self.index is not None:
+            raise ValueError("Raw data can not be indexed. Use write_lines.")
+        with self._lock:
+            self._offset += len(data)
+            self._buffer.append(data)
+            self._buffered_bytes += len(data)
+            self.lines += data.count("\n")
+            _lines_metric.inc(data.count("\n"))
+            self.bytes += len(data)
+            if self._buffered_bytes >= self.buffer_size:
+                self._flush()
+
+    def _flush(self):
+        """
+        Write the buffered data with one system call. The lock must be held.
+        :return: None
+        """
+
+        self.last_flush_time = time.time()
+        if not self._buffer or self.closed:
+            return
+        data = "".join(self._buffer)
+        self._buffer = list()
+        self._buffered_bytes = 0
+        _written_bytes_metric.inc(len(data))
+        _flushes_metric.inc()
+        if self._fd is not None:
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+        else:
+            self._file.write(data)
+            self._file.flush()
+        # Index records are written after their lines, so readers never see a record of a missing line
+        if self.index is not None:
+            self.index.flush()
+        self.flushes += 1
+
+    def flush(self):
+        """
+        Write the buffered data
+        :return: None
+        """
+
+        with self._lock:
+            self._flush()
+
+    def flush_if_due(self):
+        """
+        Write the buffered data if the flush interval has passed
+        :return: None
+        """
+
+        if self.flush_interval is not None and time.time() - self.last_flush_time >= self.flush_interval:
+            with self._lock:
+                if self._buffer:
+                    self._flush()
+
+    def close(self):
+        """
+        Write the buffered data and close the capture file
+        :return: None
+        """
+
+        with self._lock:
+            if self.closed:
+                return
+            self._flush()
+            self.closed = True
+            if self.index is not None:
+                self.index.close()
+            if self._fd is not None:
+                os.close(self._fd)
+            else:
+                self._file.close()
+        with _flusher_lock:
+            _flushed_writers.pop(self, None)
+
+    def get_stats(self):
+        """
+        Get capture metrics
+        :return (dict): lines, bytes (uncompressed), flushes, elapsed (seconds), lines_per_second, bytes_per_second
+        """
+
+        with self._lock:
+            elapsed = time.time() - self.start_time
+            return {'lines': self.lines,
+                    'bytes': self.bytes,
+                    'flushes': self.flushes,
+                    'elapsed': elapsed,
+                    'lines_per_second': self.lines / elapsed if elapsed else 0.0,
+                    'bytes_per_second': self.bytes / elapsed if elapsed else 0.0}
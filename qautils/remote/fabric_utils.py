@@ -6,18 +6,261 @@ __copyright__ = "Copyright 2015"
 __license__ = " Apache License, Version 2.0"
 __version__ = "1.2.1"
 
-from StringIO import StringIO
+import time
+import pipes
+import warnings
 
-from fabric.api import env, hide, run, get
-from fabric.tasks import execute
-from fabric.contrib import files
 from qautils.logger.logger_utils import get_logger
+from qautils.commandline import resource_usage_utils
+from qautils.remote.ssh_pool_utils import parse_host_string
+from qautils.remote.pattern_utils import StreamPatternFinder
+from qautils.metrics.metrics_utils import get_metrics_registry
 
 
 __logger__ = get_logger(__name__)
 
+_commands_metric = get_metrics_registry().counter("remote_commands_total",
+                                                  "Remote commands executed by FabricUtils.execute_command",
+                                                  ("result",))
+_command_duration_metric = get_metrics_registry().histogram("remote_command_duration_seconds",
+                                                            "Duration of the remote commands executed by "
+                                                            "FabricUtils.execute_command")
+
 FABRIC_ASSERT_RESULT = u'<local-only>'
 
+# Max number of hosts running a command at the same time (see FabricUtils.execute_command_in_hosts)
+DEFAULT_POOL_SIZE = 10
+
+# Exit code of the remote content checks when the file cannot be read
+FILE_NOT_READABLE_EXIT_CODE = 3
+
+# awk program to look for several literal strings (environment variables P0..Pn-1) in one pass. It prints the
+# index of each string found and exits when all of them have been found.
+_AWK_FIND_CONTENTS = 'BEGIN { for (i = 0; i < n; i++) p[i] = ENVIRON["P" i] } ' \
+                     '{ for (i = 0; i < n; i++) if (!(i in f) && index($0, p[i])) { f[i] = 1; print i; c++ } ' \
+                     'if (c == n) exit }'
+
+# Batch checks (see FabricUtils.check_batch). Specs are (path, check), (path, (check, text)) or (path, check, text)
+# tuples; content checks need the text.
+CHECK_FILE_EXISTS = 'exists'
+CHECK_IS_FILE = 'is_file'
+CHECK_IS_DIR = 'is_dir'
+CHECK_CONTENT_IN_FILE = 'contains'
+CHECK_CONTENT_NOT_IN_FILE = 'not_contains'
+
+_CHECK_TESTS = {CHECK_FILE_EXISTS: "test -e {path}",
+                CHECK_IS_FILE: "test -f {path}",
+                CHECK_IS_DIR: "test -d {path}"}
+
+# Prefix of the result lines printed by the batch script
+_BATCH_RESULT_MARK = "__QA_BATCH__"
+
+
+def _run_command_task(command, timeout):
+    """
+    Fabric task: Execute a shell command on the current remote host. Errors are not raised, but returned.
+    :param command (string): Command to be executed
+    :param timeout (int): Max time (seconds) for the command. None to wait forever.
+    :return (dict): host, stdout, exit_code (None if the command could not be executed), duration (seconds)
+    and error (None if the command was executed)
+    """
+
+    from fabric.api import env, run
+
+    start_time = time.time()
+    try:
+        result = run(command, timeout=timeout)
+        return {'host': env.host_string, 'stdout': str(result), 'exit_code': result.return_code,
+                'duration': time.time() - start_time, 'error': None}
+    except (Exception, SystemExit), e:
+        # Fabric aborts (SystemExit) when it cannot connect to the host
+        return {'host': env.host_string, 'stdout': None, 'exit_code': None,
+                'duration': time.time() - start_time, 'error': str(e) or e.__class__.__name__}
+
+
+def _build_find_contents_command(path, expected_contents, start_offset=0):
+    """
+    Build the shell command that looks for the contents in the remote file, from the given byte offset. One content
+    is checked with 'grep -F -q' (exit code 0 if found, 1 if not found). Several contents are checked in one pass with
+    awk (it prints the index of each content found).
+    :param path (string): Absolute path to file
+    :param expected_contents (list): Strings to look for (without line breaks)
+    :param start_offset (int): Byte offset of the file where the search starts
+    :return (string): Command
+    """
+
+    quoted_path = pipes.quote(path)
+    command = "[ -r {} ] || exit {}; ".format(quoted_path, FILE_NOT_READABLE_EXIT_CODE)
+    if start_offset:
+        command += "tail -c +{} {} | ".format(start_offset + 1, quoted_path)
+        file_argument = ""
+    else:
+        file_argument = " " + quoted_path
+
+    if len(expected_contents) == 1:
+        return command + "grep -F -q -e {}{}".format(pipes.quote(expected_contents[0]), file_argument)
+
+    return command + _build_awk_find_contents_command(expected_contents, file_argument)
+
+
+def _build_awk_find_contents_command(expected_contents, file_argument=""):
+    """
+    Build the awk command that looks for several contents in one pass. It prints the index of each content found.
+    :param expected_contents (list): Strings to look for (without line breaks)
+    :param file_argument (string): Quoted file path (with a leading space), or empty to read stdin
+    :return (string): Command
+    """
+
+    patterns = " ".join("P{}={}".format(index, pipes.quote(content)) for index, content in enumerate(expected_contents))
+    return "{} awk -v n={} {}{}".format(patterns, len(expected_contents), pipes.quote(_AWK_FIND_CONTENTS),
+                                        file_argument)
+
+
+def _normalize_batch_specs(specs):
+    """
+    Check the shape of all the batch specs, before running any of them
+    :param specs (list): (path, check), (path, (check, text)) or (path, check, text) tuples. Content checks need
+    the text; the other checks do not have it.
+    :return (list): (path, check, text) tuples (text is None for the checks without text)
+    :raises ValueError: If a spec is not valid
+    """
+
+    normalized_specs = list()
+    for spec in specs:
+        if not isinstance(spec, (tuple, list)) or len(spec) not in (2, 3):
+            raise ValueError("Invalid batch check spec {!r}: it should be (path, check) or (path, check, text)"
+                             .format(spec))
+        if len(spec) == 3:
+            path, check, text = spec
+        elif isinstance(spec[1], (tuple, list)) and len(spec[1]) == 2:
+            path, (check, text) = spec
+        else:
+            path, check, text = spec[0], spec[1], None
+        if not isinstance(path, basestring):
+            raise ValueError("Invalid path in batch check spec {!r}".format(spec))
+        if check in (CHECK_CONTENT_IN_FILE, CHECK_CONTENT_NOT_IN_FILE):
+            if not isinstance(text, basestring):
+                raise ValueError("Check '{}' needs the text to look for: (path, check, text). Spec: {!r}"
+                                 .format(check, spec))
+        elif check in _CHECK_TESTS:
+            if text is not None:
+                raise ValueError("Check '{}' does not take a text. Spec: {!r}".format(check, spec))
+        else:
+            raise ValueError("Unknown check '{}' for path '{}'".format(check, path))
+        normalized_specs.append((path, check, text))
+    return normalized_specs
+
+
+def _build_batch_script(specs):
+    """
+    Build one shell script that runs all the checks. Each check prints a line '__QA_BATCH__ <spec index> <exit code>'.
+    All 'contains'/'not_contains' checks of the same file are done in one awk pass over the file, which prints
+    '__QA_BATCH__ F<file group> <content index>' for each content found ('-' if the file is not readable).
+    :param specs (list): (path, check, text) tuples (see _normalize_batch_specs)
+    :return (tuple): (script, content groups). Content groups is a list of lists of spec indexes, one per file.
+    """
+
+    commands = list()
+    content_groups = list()
+    content_group_by_path = dict()
+    for index, (path, check, _) in enumerate(specs):
+        if check in _CHECK_TESTS:
+            commands.append("{}; echo \"{} {} $?\"".format(_CHECK_TESTS[check].format(path=pipes.quote(path)),
+                                                          _BATCH_RESULT_MARK, index))
+        else:
+            if path not in content_group_by_path:
+                content_group_by_path[path] = len(content_groups)
+                content_groups.append(list())
+            content_groups[content_group_by_path[path]].append(index)
+
+    for path, group in sorted(content_group_by_path.iteritems(), key=lambda item: item[1]):
+        contents = [specs[index][2] for index in content_groups[group]]
+        commands.append("if [ -r {path} ]; then {awk} | sed 's/^/{mark} F{group} /'; "
+                        "else echo \"{mark} F{group} -\"; fi".format(
+                            path=pipes.quote(path), mark=_BATCH_RESULT_MARK, group=group,
+                            awk=_build_awk_find_contents_command(contents, " " + pipes.quote(path))))
+
+    return "; ".join(commands), content_groups
+
+
+def _parse_batch_output(specs, content_groups, output):
+    """
+    Parse the output of the batch script
+    :param specs (list): Checked specs (see _normalize_batch_specs)
+    :param content_groups (list): Content groups returned by _build_batch_script
+    :param output (string): Script output
+    :return (list): One result per spec: True if the check passed, False if not and None if there is no result
+    """
+
+    results = [None] * len(specs)
+    found_contents = set()
+    unreadable_groups = set()
+    for line in (output or "").splitlines():
+        fields = line.strip().split()
+        if len(fields) != 3 or fields[0] != _BATCH_RESULT_MARK:
+            continue
+        if fields[1].startswith("F"):
+            group = int(fields[1][1:])
+            if fields[2] == "-":
+                unreadable_groups.add(group)
+            else:
+                found_contents.add(content_groups[group][int(fields[2])])
+        else:
+            results[int(fields[1])] = fields[2] == "0"
+
+    # Content checks of files that are not readable fail ('not_contains' too)
+    for group, indexes in enumerate(content_groups):
+        for index in indexes:
+            check = specs[index][1]
+            results[index] = group not in unreadable_groups and \
+                (index in found_contents) == (check == CHECK_CONTENT_IN_FILE)
+    return results
+
+
+def _find_contents_in_remote_file(path, expected_contents, start_offset, run_command, open_sftp):
+    """
+    Look for the contents in the remote file. The search runs on the remote host (grep/awk), so the file is not
+    downloaded. If that is not possible (contents with line breaks, commands not available), the file is read
+    with SFTP in chunks until all contents are found.
+    :param path (string): Absolute path to file
+    :param expected_contents (list): Strings to look for
+    :param start_offset (int): Byte offset of the file where the search starts
+    :param run_command: Function (command) -> (output, exit code) that runs a command on the remote host
+    :param open_sftp: Function () -> SFTP client connected to the remote host
+    :return (dict): content -> True if the content is in the file
+    """
+
+    found = None
+    if all("\n" not in content for content in expected_contents):
+        try:
+            output, exit_code = run_command(_build_find_contents_command(path, expected_contents, start_offset))
+        except Exception, e:
+            __logger__.warning("Remote search in '%s' failed: %s", path, e)
+            output, exit_code = None, None
+
+        if exit_code == FILE_NOT_READABLE_EXIT_CODE:
+            __logger__.error("Remote file cannot be read: '%s'", path)
+            found = set()
+        elif exit_code in (0, 1) and len(expected_contents) == 1:
+            found = set(expected_contents) if exit_code == 0 else set()
+        elif exit_code == 0:
+            found = set(expected_contents[int(index)] for index in output.split() if index.isdigit())
+
+    if found is None:
+        __logger__.debug("Streaming remote file '%s' to look for the contents", path)
+        sftp = open_sftp()
+        try:
+            remote_file = sftp.open(path, 'rb')
+            try:
+                remote_file.seek(start_offset)
+                found = StreamPatternFinder(expected_contents).feed_file(remote_file)
+            finally:
+                remote_file.close()
+        finally:
+            sftp.close()
+
+    return dict((content, content in found) for content in expected_contents)
+
 
 class FabricAssertions():
 
@@ -31,61 +274,168 @@ class FabricAssertions():
         :return (bool): True if given file exists on the current remote host (dir: PROVISION_ROOT_PATH).
         """
 
+        from fabric.contrib import files
         return files.exists(path)
 
     @staticmethod
-    def assert_content_in_file(path, expected_content):
+    def assert_content_in_file(path, expected_content, start_offset=0):
 
         """
         Fabric assertion: Check if some text is in the given {dir_path}/{file}
         :param path (string): Absolute path to file
         :param expected_content (string): String to look for.
+        :param start_offset (int): Byte offset of the file where the search starts (to check only new content)
         :return (bool): True if given content is in file.
         """
 
-        fd = StringIO()
-        get(path, fd)
-        file_content = fd.getvalue()
+        return FabricAssertions.assert_contents_in_file(path, [expected_content], start_offset)[expected_content]
+
+    @staticmethod
+    def assert_contents_in_file(path, expected_contents, start_offset=0):
+
+        """
+        Fabric assertion: Check if several texts are in the given file. The search runs on the remote host.
+        :param path (string): Absolute path to file
+        :param expected_contents (list): Strings to look for.
+        :param start_offset (int): Byte offset of the file where the search starts (to check only new content)
+        :return (dict): content -> True if the content is in file.
+        """
+
+        from fabric.api import env, run
+        from fabric.state import connections
+
+        def _run_command(command):
+            result = run(command, quiet=True)
+            return result, result.return_code
 
-        return expected_content in file_content
+        return _find_contents_in_remote_file(path, expected_contents, start_offset, _run_command,
+                                             lambda: connections[env.host_string].open_sftp())
+
+
+class _InstanceOrStaticMethod(object):
+    """
+    Method that can also be called on the class, as the former FabricUtils.execute_command staticmethod
+    (deprecated). On the class, it runs with the host and credentials of the Fabric global 'env', as that
+    staticmethod did, and a DeprecationWarning is emitted.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is not None:
+            return self.function.__get__(instance, owner)
+
+        def _static_call(*args, **kwargs):
+            from fabric.api import env
+            warnings.warn("{0}.{1} called on the class is deprecated: call it on a {0} instance".format(
+                owner.__name__, self.function.__name__), DeprecationWarning, stacklevel=2)
+            return self.function(owner(env.host_string, env.user, env.password, env.key_filename), *args, **kwargs)
+        return _static_call
 
 
 class FabricUtils():
 
-    def __init__(self, host_name, host_username, host_password=None, host_ssh_key=None):
+    def __init__(self, host_name, host_username, host_password=None, host_ssh_key=None, connection_pool=None):
         """
         Init Fabric client.
         :param host_name (string): Hostname
         :param host_username (string): Username
         :param host_password (string): Password
         :param host_ssh_key (string): SSH private key file
+        :param connection_pool: SSHConnectionPool (see ssh_pool_utils). If it is given, execute_command, file_exist
+        and content_in_file use its persistent connections instead of Fabric operations.
         :return: None
         """
 
         __logger__.info("Init Fabric to execute remote commands in '%s'. Credentials: '%s/%s'; SSH Key file: '%s'",
                         host_name, host_username, host_password, host_ssh_key)
-        env.host_string = host_name
-        env.user = host_username
-        env.password = host_password
-        env.key_filename = host_ssh_key
+
+        # Connection data is not written in the Fabric global 'env': it is set only while this object runs
+        # something (see _host_settings), so several FabricUtils can be used at the same time.
+        self.host_name = host_name
+        self.host_username = host_username
+        self.host_password = host_password
+        self.host_ssh_key = host_ssh_key
+        self.connection_pool = connection_pool
 
         self.fabric_assertions = FabricAssertions()
 
-    @staticmethod
-    def execute_command(command):
+    def _host_settings(self, **extra_settings):
+        """
+        Fabric context manager with the connection data of this host
+        :param extra_settings: Other Fabric 'env' values to set
+        :return: Fabric 'settings' context manager
+        """
+
+        from fabric.api import settings
+        return settings(host_string=self.host_name, user=self.host_username, password=self.host_password,
+                        key_filename=self.host_ssh_key, **extra_settings)
+
+    def _pool_execute(self, command):
+        """
+        Execute a shell command on the remote host using the connection pool
+        :param command (string): Command to be executed
+        :return (tuple): (output, exit code)
         """
-        Execute a shell command on the current remote host
+
+        host, port, user = parse_host_string(self.host_name, self.host_username)
+        return self.connection_pool.execute(host, user, command, password=self.host_password,
+                                            key_filename=self.host_ssh_key, port=port)
+
+    def _pool_open_sftp(self):
+        """
+        Open a SFTP session on the remote host using the connection pool
+        :return: paramiko.SFTPClient
+        """
+
+        host, port, user = parse_host_string(self.host_name, self.host_username)
+        return self.connection_pool.open_sftp(host, user, password=self.host_password,
+                                              key_filename=self.host_ssh_key, port=port)
+
+    @_InstanceOrStaticMethod
+    def execute_command(self, command):
+        """
+        Execute a shell command on the current remote host.
+        If the resource usage accounting is enabled (see resource_usage_utils), the command is measured with
+        '/usr/bin/time' in the remote host.
+        Calling it on the class (FabricUtils.execute_command(command)), as the former staticmethod, is deprecated:
+        the command is executed with the host and credentials of the Fabric global 'env'.
         :param command (string): Command to be execute
         :return (string): Result of the remote execution or None if some problem happens
         """
 
+        from fabric.api import hide, run
         __logger__.debug("Executing remote command: '%s'", command)
+        measure_usage = resource_usage_utils.is_resource_usage_enabled()
+        executed_command = resource_usage_utils.wrap_remote_command(command) if measure_usage else command
+        start_time = time.time()
         try:
-            with hide('running', 'stdout'):
-                result = run(command)
+            if self.connection_pool is not None:
+                result, exit_code = self._pool_execute(executed_command)
+            else:
+                with self._host_settings(warn_only=True), hide('running', 'stdout', 'warnings'):
+                    result = run(executed_command)
+                exit_code = result.return_code
+
+            if measure_usage:
+                output, usage = resource_usage_utils.parse_remote_usage(result, time.time() - start_time)
+                resource_usage_utils.get_resource_usage_recorder().record(command, usage, exit_code)
+                if self.connection_pool is None:
+                    from fabric.operations import _AttributeString
+                    output = _AttributeString(output)
+                    output.__dict__.update(result.__dict__)
+                result = output
+
+            _command_duration_metric.observe(time.time() - start_time)
+            if exit_code != 0:
+                raise Exception("Exit code: {}".format(exit_code))
+            _commands_metric.labels("ok").inc()
             __logger__.debug("Result of execution: \n%s", result)
             return result
         except:
+            _commands_metric.labels("failed").inc()
             __logger__.error("Any problem executing command: '%s'", command)
             return None
 
@@ -99,28 +449,130 @@ class FabricUtils():
 
         path = "{}/{}".format(dir_path, file_name)
         __logger__.debug("Checking if remote file exists: '%s'", path)
+        if self.connection_pool is not None:
+            return self._pool_execute("test -e {}".format(pipes.quote(path)))[1] == 0
 
-        with hide('running', 'stdout'):
+        from fabric.api import hide
+        from fabric.tasks import execute
+
+        with self._host_settings(), hide('running', 'stdout'):
             success = execute(self.fabric_assertions.assert_file_exist, path=path)
         return success[FABRIC_ASSERT_RESULT]
 
-    def content_in_file(self, dir_path, file_name, expected_content):
+    def content_in_file(self, dir_path, file_name, expected_content, start_offset=0):
         """
         Fabric executor: Run method with assertion 'assert_content_in_file' on the remote host
         :param dir_path (string): Path of the directory where file is located.
         :param file_name (string): File name
         :param expected_content (string): String to be found in file
+        :param start_offset (int): Byte offset of the file where the search starts (to check only new content)
         :return (bool): True if file contains that content (dir: PROVISION_ROOT_PATH)
         """
 
         path = "{}/{}".format(dir_path, file_name)
         __logger__.debug("Checking if the content '%s' is in remote file: '%s'", expected_content, path)
+        return self.contents_in_file(dir_path, file_name, [expected_content], start_offset)[expected_content]
+
+    def contents_in_file(self, dir_path, file_name, expected_contents, start_offset=0):
+        """
+        Fabric executor: Run method with assertion 'assert_contents_in_file' on the remote host. All the contents
+        are checked in the same remote search.
+        :param dir_path (string): Path of the directory where file is located.
+        :param file_name (string): File name
+        :param expected_contents (list): Strings to be found in file
+        :param start_offset (int): Byte offset of the file where the search starts (to check only new content)
+        :return (dict): content -> True if file contains that content
+        """
+
+        path = "{}/{}".format(dir_path, file_name)
+        __logger__.debug("Checking if the contents %s are in remote file: '%s'", expected_contents, path)
+        from fabric.api import hide
+        from fabric.tasks import execute
         try:
-            with hide('running', 'stdout'):
-                success = execute(self.fabric_assertions.assert_content_in_file,
-                                  path=path, expected_content=expected_content)
+            if self.connection_pool is not None:
+                return _find_contents_in_remote_file(path, expected_contents, start_offset, self._pool_execute,
+                                                     self._pool_open_sftp)
+
+            with self._host_settings(), hide('running', 'stdout'):
+                success = execute(self.fabric_assertions.assert_contents_in_file,
+                                  path=path, expected_contents=expected_contents, start_offset=start_offset)
         except:
             __logger__.error("Problem when trying to access to remote file")
-            return False
+            return dict((content, False) for content in expected_contents)
 
         return success[FABRIC_ASSERT_RESULT]
+
+    def execute_command_in_hosts(self, command, hosts, pool_size=DEFAULT_POOL_SIZE, timeout=None):
+        """
+        Execute a shell command on several remote hosts in parallel. Each host runs in its own process (Fabric
+        parallel mode), with its own connection. The credentials of this object are used for all hosts, unless
+        the host string defines the user ('user@host:port').
+        :param command (string): Command to be executed
+        :param hosts (list): Host strings
+        :param pool_size (int): Max number of hosts running the command at the same time
+        :param timeout (int): Max time (seconds) for the command in each host. None to wait forever.
+        :return (dict): host -> dict with stdout, exit_code (None if the command could not be executed),
+        duration (seconds) and error (None if the command was executed)
+        """
+
+        from fabric.api import hide
+        from fabric.tasks import execute
+
+        __logger__.debug("Executing remote command in %d hosts (pool size: %d): '%s'", len(hosts), pool_size,
+                         command)
+        with self._host_settings(parallel=True, pool_size=pool_size, warn_only=True, abort_on_prompts=True,
+                                 skip_bad_hosts=True), hide('everything'):
+            results = execute(_run_command_task, command, timeout, hosts=hosts)
+
+        failed_hosts = [host for host, result in results.iteritems() if result is None or result['exit_code'] != 0]
+        if failed_hosts:
+            __logger__.warning("Remote command failed in %d of %d hosts: %s", len(failed_hosts), len(hosts),
+                               failed_hosts)
+        return results
+
+    def check_batch(self, specs):
+        """
+        Run many file checks with only one remote command (one SSH round-trip). E.g.:
+            check_batch([("/etc/hosts", CHECK_FILE_EXISTS),
+                         ("/var/log/service.log", (CHECK_CONTENT_IN_FILE, "Service started")),
+                         ("/var/log/service.log", (CHECK_CONTENT_NOT_IN_FILE, "ERROR"))])
+        :param specs (list): (path, check), (path, (check, text)) or (path, check, text) tuples. Checks:
+        CHECK_FILE_EXISTS, CHECK_IS_FILE, CHECK_IS_DIR, (CHECK_CONTENT_IN_FILE, text), (CHECK_CONTENT_NOT_IN_FILE, text)
+        :return (list): One result per spec, in the same order: True if the check passed, False if not and None if
+        the check could not be done
+        :raises ValueError: If a spec is not valid (e.g. a content check without its text). No check is run.
+        """
+
+        specs = _normalize_batch_specs(specs)
+        script, content_groups = _build_batch_script(specs)
+        __logger__.debug("Running %d remote checks in one command", len(specs))
+        try:
+            if self.connection_pool is not None:
+                output = self._pool_execute(script)[0]
+            else:
+                from fabric.api import run
+                with self._host_settings():
+                    output = run(script, quiet=True)
+        except:
+            __logger__.error("Problem when running the remote checks")
+            return [None] * len(specs)
+
+        return _parse_batch_output(specs, content_groups, output)
+
+    def check_batch_in_hosts(self, specs, hosts, pool_size=DEFAULT_POOL_SIZE, timeout=None):
+        """
+        Run many file checks in several remote hosts in parallel, with only one remote command per host.
+        See check_batch and execute_command_in_hosts.
+        :param specs (list): (path, check), (path, (check, text)) or (path, check, text) tuples
+        :param hosts (list): Host strings
+        :param pool_size (int): Max number of hosts running the checks at the same time
+        :param timeout (int): Max time (seconds) for the checks in each host. None to wait forever.
+        :return (dict): host -> list of results (one per spec, see check_batch)
+        """
+
+        specs = _normalize_batch_specs(specs)
+        script, content_groups = _build_batch_script(specs)
+        results = self.execute_command_in_hosts(script, hosts, pool_size, timeout)
+        return dict((host, _parse_batch_output(specs, content_groups, result['stdout'])
+                     if result and result['stdout'] is not None else [None] * len(specs))
+                    for host, result in results.iteritems())
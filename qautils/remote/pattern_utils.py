@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+pattern_utils module contains utilities to look for several patterns at once:
+    - MultiPatternMatcher: Compiles a list of literal strings (or regular expressions) into one regular expression
+      (several ones for long lists).
+        * search: Returns the first pattern found in the text.
+        * find_all: Returns all the patterns found in the text (also when they overlap).
+    - StreamPatternFinder: Looks for the patterns in a stream read in chunks, also when the matches cross the
+      chunk boundaries, and stops as soon as the patterns are found.
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import re
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Python 2.7 regular expressions support up to 100 groups: the patterns are compiled in several regular expressions
+# with less groups than that
+_MAX_GROUPS_PER_REGEX = 99
+
+
+class MultiPatternMatcher(object):
+
+    def __init__(self, patterns, is_regex=False):
+        """
+        Init the MultiPatternMatcher.
+        :param patterns (list): Strings to look for
+        :param is_regex (bool): Patterns are regular expressions. By default, they are literal strings.
+        :return: None
+        """
+
+        self.patterns = list(patterns)
+        self.is_regex = is_regex
+        self._regexes = self._compile(self.patterns)
+
+    def _compile(self, patterns):
+        """
+        Compile the patterns into regular expressions, with one group for each pattern. One regular expression
+        unless the groups exceed _MAX_GROUPS_PER_REGEX (the groups of regex patterns count too).
+        Literal patterns are sorted by length (longest first), so a pattern is not hidden by its prefixes.
+        :param patterns (list): Patterns
+        :return (list): Compiled regular expressions, in the order their alternatives are preferred
+        """
+
+        indexes = range(len(patterns))
+        if not self.is_regex:
+            indexes.sort(key=lambda index: -len(patterns[index]))
+
+        regexes = list()
+        alternatives = list()
+        groups = 0
+        for index in indexes:
+            pattern = patterns[index] if self.is_regex else re.escape(patterns[index])
+            pattern_groups = 1 + (re.compile(pattern).groups if self.is_regex else 0)
+            if alternatives and groups + pattern_groups > _MAX_GROUPS_PER_REGEX:
+                regexes.append(re.compile("|".join(alternatives)))
+                alternatives = list()
+                groups = 0
+            alternatives.append("(?P<p{}>{})".format(index, pattern))
+            groups += pattern_groups
+        if alternatives:
+            regexes.append(re.compile("|".join(alternatives)))
+        return regexes
+
+    @staticmethod
+    def _matched_index(match):
+        """
+        :return (int): Index of the pattern that generated the match
+        """
+        return int(match.lastgroup[1:])
+
+    def search(self, text):
+        """
+        Look for the first occurrence of any of the patterns
+        :param text (string): Text
+        :return: The pattern found first in the text, or None
+        """
+
+        first_match = None
+        for regex in self._regexes:
+            match = regex.search(text)
+            # At the same position, the alternatives of the first regular expression are preferred (as in one regex)
+            if match is not None and (first_match is None or match.start() < first_match.start()):
+                first_match = match
+        return self.patterns[self._matched_index(first_match)] if first_match else None
+
+    def find_all(self, text, patterns=None):
+        """
+        Look for all the patterns in the text
+        :param text (string): Text
+        :param patterns (list): Subset of the patterns to look for. By default, all the patterns.
+        :return (set): Patterns found in the text
+        """
+
+        pending = list(self.patterns if patterns is None else patterns)
+        regexes = self._regexes if patterns is None else self._compile(pending)
+        found = set()
+        while regexes:
+            newly_found = set(pending[self._matched_index(match)]
+                              for regex in regexes for match in regex.finditer(text))
+            if not newly_found:
+                break
+            # Matches do not overlap: look again for the pending patterns (they could be overlapped by a found one)
+            found.update(newly_found)
+            pending = [pattern for pattern in pending if pattern not in found]
+            regexes = self._compile(pending)
+        return found
+
+
+class StreamPatternFinder(object):
+
+    def __init__(self, patterns, find_all=True):
+        """
+        Init the StreamPatternFinder. Literal patterns only.
+        :param patterns (list): Strings to look for
+        :param find_all (bool): Stop when all patterns are found. If False, stop at the first match.
+        :return: None
+        """
+
+        self.matcher = MultiPatternMatcher(patterns)
+        self.find_all = find_all
+        self.found = set()
+        # Bytes of the previous chunk kept to find matches crossing the chunk boundary
+        self._overlap_size = max(len(pattern) for pattern in patterns) - 1 if patterns else 0
+        self._tail = ""
+
+    @property
+    def finished(self):
+        """
+        :return (bool): True if no more data is needed
+        """
+        return len(self.found) == len(set(self.matcher.patterns)) if self.find_all else bool(self.found)
+
+    def feed(self, chunk):
+        """
+        Look for the patterns in the next chunk of the stream
+        :param chunk (string): Data
+        :return (bool): True if no more data is needed
+        """
+
+        window = self._tail + chunk
+        if self.find_all:
+            pending = [pattern for pattern in self.matcher.patterns if pattern not in self.found]
+            self.found.update(self.matcher.find_all(window, pending))
+        else:
+            first = self.matcher.search(window)
+            if first is not None:
+                self.found.add(first)
+        self._tail = window[-self._overlap_size:] if self._overlap_size else ""
+        return self.finished
+
+    def feed_file(self, file_object, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Read the file in chunks and look for the patterns, until they are found or the end of the file is reached
+        :param file_object: File-like object (already positioned at the first byte to check)
+        :param chunk_size (int): Bytes read each time
+        :return (set): Patterns found
+        """
+
+        while not self.finished:
+            chunk = file_object.read(chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+        return self.found
@@ -2,8 +2,11 @@
 
 """
     remote_tail_utils module contains utilities for reading remote logs using 'tail'.
-        - start_tailer: Starts a new thread reading the remote file.
+        - start_tailer: Starts capturing the remote file (read by the shared TailEngine).
         - stop_tailer: Stop the capturing.
+        - mark / wait_for: Wait until a pattern appears in the captured lines.
+        - get_capture_stats: Lines/sec and bytes/sec of the local capture.
+        - get_capture_index: Index of the local capture, to search lines without scanning the whole file.
 """
 
 __author__ = "@jframos"
@@ -12,29 +15,36 @@ __copyright__ = "Copyright 2015"
 __license__ = " Apache License, Version 2.0"
 __version__ = "1.2.1"
 
+import os
 import time
 import threading
+from collections import deque
+from itertools import islice
 
-from sshtail import SSHTailer, load_dss_key
 from qautils.logger.logger_utils import get_logger
 
 
 __logger__ = get_logger(__name__)
 
-# Delay period just after starting remote tailers
+# Max time waiting for the remote tailer to be running, when starting it
 TIMER_DELAY_PERIOD = 3
 
 # Grace period when stopping thread. 3 seconds by default
 TIMER_GRACE_PERIOD = 3
 
-# Global flag
-_tail_terminate_flag = False
+# Default max time waiting for a pattern (see RemoteTail.wait_for)
+DEFAULT_WAIT_TIMEOUT = 30
+
+# Last captured lines kept in memory for wait_for
+RECENT_LINES_SIZE = 100000
 
 
 class RemoteTail:
 
     def __init__(self, remote_host_ip, remote_host_user, remote_log_path, remote_log_file_name, local_log_target,
-                 private_key):
+                 private_key, tail_engine=None, connection_pool=None, capture_buffer_size=None,
+                 capture_flush_interval=None, capture_compression=None, capture_index=False,
+                 capture_timestamp_pattern=None, capture_ngram_index=False):
         """
         Init RemoteTail class
         :param remote_host_ip: Remote Host IP
@@ -42,16 +52,41 @@ class RemoteTail:
         :param remote_log_path: Remote log path location
         :param remote_log_file_name: Remote log filename to be tailed
         :param local_log_target: Local path where remote logs will be captured
-        :param private_key: Private key to use in the SSH connection.
+        :param private_key: Private key to use in the SSH connection (DSS or RSA).
         If no path's specified for the private key file name, it automatically prepends /home/<current_user>/.ssh/
-        and for RSA keys, import load_rsa_key instead.
+        :param tail_engine: TailEngine reading the remote file. By default, the shared one.
+        :param connection_pool: SSHConnectionPool. By default, the shared one.
+        :param capture_buffer_size (int): Write the captured lines when they reach this size (bytes).
+        By default, capture_writer_utils.DEFAULT_BUFFER_SIZE.
+        :param capture_flush_interval (float): Write the captured lines after this time (seconds).
+        By default, capture_writer_utils.DEFAULT_FLUSH_INTERVAL.
+        :param capture_compression (string): None or 'gzip' ('.gz' is appended to the local file name)
+        :param capture_index (bool): Write a sidecar index of the local capture (see get_capture_index).
+        Not supported with compression.
+        :param capture_timestamp_pattern (string): Regular expression of the timestamp of the log lines.
+        By default, capture_index_utils.DEFAULT_TIMESTAMP_PATTERN.
+        :param capture_ngram_index (bool): Also index the trigrams of the lines, to speed up literal searches
         :return: None
         """
 
         self.tailer = None
         self.tail_terminate_flag = False
-        self.thread = None
         self.local_capture_file_descriptor = None
+        self.tail_engine = tail_engine
+        self.connection_pool = connection_pool
+        self.capture_buffer_size = capture_buffer_size
+        self.capture_flush_interval = capture_flush_interval
+        self.capture_compression = capture_compression
+        self.capture_index = capture_index
+        self.capture_timestamp_pattern = capture_timestamp_pattern
+        self.capture_ngram_index = capture_ngram_index
+        self.local_capture_path = None
+
+        # Last captured lines, for wait_for
+        self._recent_lines = deque(maxlen=RECENT_LINES_SIZE)
+        self._received_lines = 0
+        self._mark = 0
+        self._lines_condition = threading.Condition()
 
         self.remote_host_ip = remote_host_ip
         self.remote_host_user = remote_host_user
@@ -66,68 +101,182 @@ class RemoteTail:
         :return: None
         """
 
-        private_key_loaded = load_dss_key(self.private_key)
-        connection_host = self.remote_host_user + '@' + self.remote_host_ip
+        from qautils.remote.ssh_pool_utils import parse_host_string
+        from qautils.remote.tail_engine_utils import RemoteTailStream
+        from qautils.remote import capture_writer_utils
+
+        private_key = self.private_key
+        if private_key and not os.path.dirname(private_key):
+            private_key = os.path.join(os.path.expanduser("~"), ".ssh", private_key)
+
+        host, port, _ = parse_host_string(self.remote_host_ip)
         target_log_path = self.remote_log_path + self.remote_log_file_name
-        __logger__.info("Remote Tailer: Connecting to remote host [host: %s, path: %s", connection_host,
-                    target_log_path)
-        self.tailer = SSHTailer(connection_host, target_log_path, private_key_loaded)
+        __logger__.info("Remote Tailer: Connecting to remote host [host: %s@%s, path: %s", self.remote_host_user,
+                        self.remote_host_ip, target_log_path)
+        self.tailer = RemoteTailStream(host, self.remote_host_user, target_log_path, key_filename=private_key,
+                                       port=port, connection_pool=self.connection_pool)
 
         # Open local output file
         local_capture_path = self.local_log_target + self.remote_log_file_name
+        self.local_capture_path = local_capture_path
         __logger__.debug("Remote Tailer: Opening local file to save the captured logs")
-        self.local_capture_file_descriptor = open(local_capture_path, 'w')
+        buffer_size = self.capture_buffer_size
+        if buffer_size is None:
+            buffer_size = capture_writer_utils.DEFAULT_BUFFER_SIZE
+        flush_interval = self.capture_flush_interval
+        if flush_interval is None:
+            flush_interval = capture_writer_utils.DEFAULT_FLUSH_INTERVAL
+        index = None
+        if self.capture_index:
+            from qautils.remote import capture_index_utils
+            index = capture_index_utils.CaptureIndexWriter(
+                local_capture_path, self.capture_timestamp_pattern or capture_index_utils.DEFAULT_TIMESTAMP_PATTERN,
+                ngram_index=self.capture_ngram_index)
+        self.local_capture_file_descriptor = capture_writer_utils.CaptureWriter(local_capture_path, buffer_size,
+                                                                                flush_interval,
+                                                                                self.capture_compression,
+                                                                                index=index)
 
-    @staticmethod
-    def _read_tailer(tailer, local_capture_file_descriptor):
+    def _write_lines(self, tailer, lines):
         """
-        Execute a 'tail' on remote log file until tail_terminate_flag will be True
-        :param tailer: Created and initialized sshtail connection
-        :param local_capture_file_descriptor: Opened descriptor to local file where remote logs will be captured
+        Save the lines received from the remote 'tail' (called by the tail engine)
+        :param tailer: RemoteTailStream
+        :param lines (list): Lines
         :return: None
         """
 
-        global _tail_terminate_flag
-        _tail_terminate_flag = False
+        self.local_capture_file_descriptor.write_lines(lines)
+        with self._lines_condition:
+            self._recent_lines.extend(lines)
+            self._received_lines += len(lines)
+            self._lines_condition.notify_all()
+
+    def _close_capture(self, tailer):
+        """
+        Close the local capture file when the remote 'tail' has finished (called by the tail engine)
+        :param tailer: RemoteTailStream
+        :return: None
+        """
 
-        try:
-            while not _tail_terminate_flag:
-                for line in tailer.tail():
-                    local_capture_file_descriptor.writelines(line + "\n")
-                    local_capture_file_descriptor.flush()
+        __logger__.debug("Remote Tailer: Remote capture finished. Closing local file descriptor")
+        self.local_capture_file_descriptor.close()
+        with self._lines_condition:
+            self._lines_condition.notify_all()
 
-                # wait a bit
-                time.sleep(0.5)
+    def start_tailer(self, ready_timeout=None):
+        """
+        This method starts reading the remote log file. All RemoteTail instances share the same engine thread.
+        It returns when the remote 'tail' is running: lines written from then on are captured.
+        :param ready_timeout (float): Max time waiting for the remote 'tail' (seconds). By default, TIMER_DELAY_PERIOD.
+        :return (bool): True if the remote 'tail' is running
+        """
 
-            __logger__.debug("Remote Tailer: Remote capture finished")
-        except:
-            __logger__.error("Remote Tailer: Error when reading remote log lines")
+        if self.tail_engine is None:
+            from qautils.remote.tail_engine_utils import get_tail_engine
+            self.tail_engine = get_tail_engine()
 
-        __logger__.debug("Remote Tailer: Closing connections and file descriptors")
-        tailer.disconnect()
-        local_capture_file_descriptor.close()
+        __logger__.debug("Remote Tailer: Adding stream to the tail engine to capture logs")
+        self.tail_terminate_flag = False
+        self._mark = self._received_lines
+        self.tail_engine.add_stream(self.tailer, self._write_lines, self._close_capture)
+        ready_timeout = TIMER_DELAY_PERIOD if ready_timeout is None else ready_timeout
+        if not self.tailer.wait_ready(ready_timeout):
+            __logger__.warning("Remote Tailer: Remote tail is not running after %s seconds", ready_timeout)
+            return False
+        return True
 
-    def start_tailer(self):
+    def stop_tailer(self, grace_period=None):
         """
-        This method starts a new thread to execute a tailing on the remote log file
+        This method will stop the tailer process after a grace time period. Other tailers are not stopped.
+        :param grace_period (float): Time to keep capturing before stopping (seconds). By default, TIMER_GRACE_PERIOD.
+        It can be 0 when the expected lines have already been received (see wait_for).
         :return: None
         """
 
-        __logger__.debug("Remote Tailer: Launching thread to capture logs")
-        self.thread = threading.Thread(target=self._read_tailer,
-                                       args=[self.tailer, self.local_capture_file_descriptor])
-        self.thread.start()
-        __logger__.debug("Delay timer before starting: " + str(TIMER_DELAY_PERIOD))
-        time.sleep(TIMER_DELAY_PERIOD)
+        grace_period = TIMER_GRACE_PERIOD if grace_period is None else grace_period
+        __logger__.info("Remote Tailer: Stopping tailer")
+        __logger__.debug("Grace period after stopping: " + str(grace_period))
+        time.sleep(grace_period)
+        self.tail_terminate_flag = True
+        self.tailer.stop()
 
-    def stop_tailer(self):
+    def mark(self):
         """
-        This method will stop the tailer process after a grace time period
-        :return: None
+        Set the position from which wait_for looks for patterns to the next captured line.
+        Call it before the action that should write the expected lines.
+        :return (int): Number of lines captured so far
+        """
+
+        with self._lines_condition:
+            self._mark = self._received_lines
+            return self._mark
+
+    def wait_for(self, patterns, timeout=DEFAULT_WAIT_TIMEOUT, is_regex=False, since=None):
+        """
+        Wait until any of the patterns appears in the captured lines. Lines are checked as they arrive.
+        :param patterns: Text (or list of texts) to look for
+        :param timeout (float): Max time to wait (seconds)
+        :param is_regex (bool): The patterns are regular expressions
+        :param since (int): Check the lines captured after this number of lines. By default, the lines captured
+        after the last call to 'mark' (or since the tailer was started).
+        :return (string): First matching line, or None if no line matched before the timeout
+        """
+
+        from qautils.remote.pattern_utils import MultiPatternMatcher
+
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        matcher = MultiPatternMatcher(patterns, is_regex)
+        position = self._mark if since is None else since
+        deadline = time.time() + timeout
+
+        __logger__.debug("Remote Tailer: Waiting for %s (timeout: %s)", patterns, timeout)
+        while True:
+            with self._lines_condition:
+                first_kept = self._received_lines - len(self._recent_lines)
+                if position < first_kept:
+                    __logger__.warning("Remote Tailer: %d lines are not in memory anymore and were not checked",
+                                       first_kept - position)
+                    position = first_kept
+                new_lines = list(islice(self._recent_lines, position - first_kept, None))
+                position = self._received_lines
+                if not new_lines:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or self.tailer.closed:
+                        __logger__.debug("Remote Tailer: Pattern not found")
+                        return None
+                    self._lines_condition.wait(remaining)
+                    continue
+
+            # Literal patterns are looked for in all the new lines at once
+            if is_regex or matcher.search("\n".join(new_lines)) is not None:
+                for line in new_lines:
+                    if matcher.search(line) is not None:
+                        return line
+
+            # Non-matching lines can keep arriving: the deadline is checked after each batch too
+            if time.time() >= deadline:
+                __logger__.debug("Remote Tailer: Pattern not found")
+                return None
+
+    def get_capture_stats(self):
+        """
+        Get the metrics of the local capture (see CaptureWriter.get_stats)
+        :return (dict): lines, bytes, flushes, elapsed, lines_per_second, bytes_per_second. None if not initialized.
+        """
+
+        if self.local_capture_file_descriptor is None:
+            return None
+        return self.local_capture_file_descriptor.get_stats()
+
+    def get_capture_index(self):
+        """
+        Get the index of the local capture. It can be used while the capture is running. E.g.:
+            get_capture_index().query("ERROR", start_time, end_time)
+        :return: CaptureIndex. None if the capture is not indexed.
         """
 
-        __logger__.info("Remote Tailer: Stopping tailers")
-        __logger__.debug("Grace period after stopping: " + str(TIMER_GRACE_PERIOD))
-        time.sleep(TIMER_GRACE_PERIOD)
-        global _tail_terminate_flag
-        _tail_terminate_flag = True
+        if not self.capture_index or self.local_capture_path is None:
+            return None
+        from qautils.remote.capture_index_utils import CaptureIndex
+        return CaptureIndex(self.local_capture_path)
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+"""
+ssh_pool_utils module contains a pool of persistent SSH connections:
+    - SSHConnectionPool: Keeps authenticated SSH transports alive, keyed by (host, port, user, private key), and runs
+      commands over new channels of the same transport. Closed transports are discarded on every reuse, idle
+      connections are health-checked before being reused and evicted after a TTL (by a background thread that runs
+      while the pool has connections). If a channel can not be opened, the connection is replaced once. Host keys
+      are checked as Fabric does (see _set_host_key_policy). Hit/miss and connect time metrics are available with
+      get_stats.
+    - get_connection_pool: Returns the shared SSHConnectionPool (created on first call).
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import time
+import atexit
+import weakref
+import threading
+
+from qautils.logger.logger_utils import get_logger
+
+
+__logger__ = get_logger(__name__)
+
+DEFAULT_SSH_PORT = 22
+
+# Connections not used for this time (seconds) are closed
+DEFAULT_TTL = 300
+
+# Connections not used for this time (seconds) are checked before being reused
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+DEFAULT_CONNECT_TIMEOUT = 10
+
+READ_BUFFER_SIZE = 32768
+
+# Pools with a running evictor thread, stopped at exit (see SSHConnectionPool._start_evictor)
+_evicting_pools = weakref.WeakSet()
+
+# Shared pool (see get_connection_pool)
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def parse_host_string(host_string, default_user=None, default_port=DEFAULT_SSH_PORT):
+    """
+    Parse a Fabric-like host string: [user@]host[:port]
+    :param host_string (string): Host string
+    :param default_user (string): User if the host string does not define it
+    :param default_port (int): Port if the host string does not define it
+    :return (tuple): (host, port, user)
+    """
+
+    user = default_user
+    if "@" in host_string:
+        user, host_string = host_string.rsplit("@", 1)
+    port = default_port
+    if ":" in host_string:
+        host_string, port = host_string.rsplit(":", 1)
+        port = int(port)
+    return host_string, port, user
+
+
+def _set_host_key_policy(client):
+    """
+    Configure the host key checks of the client as Fabric does for its connections: load env.system_known_hosts,
+    load ~/.ssh/known_hosts unless env.disable_known_hosts, and accept unknown hosts unless env.reject_unknown_hosts.
+    A host whose key is in a known_hosts file with a different key is always rejected (BadHostKeyException).
+    :param client: paramiko.SSHClient
+    :return: None
+    """
+
+    import paramiko
+    try:
+        from fabric.api import env
+    except ImportError:
+        env = dict()
+
+    system_known_hosts = env.get('system_known_hosts')
+    if system_known_hosts:
+        client.load_system_host_keys(system_known_hosts)
+    if not env.get('disable_known_hosts'):
+        client.load_system_host_keys()
+    if not env.get('reject_unknown_hosts'):
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+
+@atexit.register
+def _stop_evictors():
+    """
+    Stop the evictor threads at exit, before the interpreter tears down the module globals they use
+    :return: None
+    """
+
+    for pool in list(_evicting_pools):
+        pool._stop_evictor()
+
+
+class _PooledConnection(object):
+    """
+    SSH client in the pool, with its usage timestamps
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.created = time.time()
+        self.last_used = self.created
+
+    def is_active(self):
+        """
+        Cheap check, done on every reuse: the transport has not been closed
+        :return (bool): True if the transport is active
+        """
+
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def is_alive(self):
+        """
+        Health check: the transport is active and it can send a packet
+        :return (bool): True if the connection can be used
+        """
+
+        if not self.is_active():
+            return False
+        transport = self.client.get_transport()
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+
+class SSHConnectionPool(object):
+
+    def __init__(self, ttl=DEFAULT_TTL, health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, evict_interval=None):
+        """
+        Init the SSHConnectionPool
+        :param ttl (int): Close connections not used for this time (seconds)
+        :param health_check_interval (int): Check connections not used for this time (seconds) before reusing them
+        :param connect_timeout (int): TCP connect timeout (seconds)
+        :param evict_interval (float): Time (seconds) between two runs of evict_idle in the evictor thread, which
+        runs while the pool has connections. By default, half the TTL. 0 to disable the thread: idle connections
+        are then only closed when they are requested again or when evict_idle is called.
+        :return: None
+        """
+
+        self.ttl = ttl
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self.evict_interval = max(1.0, ttl / 2.0) if evict_interval is None else evict_interval
+        self._evictor_stop = None
+
+        self._connections = dict()
+        self._connect_locks = dict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connect_errors = 0
+        self.connect_time_total = 0.0
+        self.connect_time_max = 0.0
+
+    def _connect(self, host, port, user, password, key_filename):
+        """
+        Open and authenticate a new SSH connection
+        :return: paramiko.SSHClient
+        """
+
+        import paramiko
+
+        __logger__.debug("SSH pool: Connecting to %s@%s:%s", user, host, port)
+        client = paramiko.SSHClient()
+        _set_host_key_policy(client)
+        start_time = time.time()
+        try:
+            client.connect(host, port=port, username=user, password=password, key_filename=key_filename,
+                           timeout=self.connect_timeout)
+        except Exception:
+            with self._lock:
+                self.connect_errors += 1
+            raise
+        connect_time = time.time() - start_time
+        with self._lock:
+            self.connect_time_total += connect_time
+            self.connect_time_max = max(self.connect_time_max, connect_time)
+        return client
+
+    def get_client(self, host, user, password=None, key_filename=None, port=DEFAULT_SSH_PORT):
+        """
+        Get an authenticated SSH client for the given host and credentials, reusing the pooled one if it is alive.
+        :param host (string): Hostname or IP
+        :param user (string): User name
+        :param password (string): Password
+        :param key_filename (string): SSH private key file
+        :param port (int): SSH port
+        :return: paramiko.SSHClient. It should not be closed: it is owned by the pool.
+        """
+
+        key = (host, port, user, key_filename)
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+
+        # Only one thread connects to the same host/credential at the same time. Others wait to reuse it.
+        with connect_lock:
+            with self._lock:
+                connection = self._connections.get(key)
+
+            now = time.time()
+            if connection is not None:
+                expired = now - connection.last_used > self.ttl
+                if not expired and connection.is_active() and \
+                        (now - connection.last_used < self.health_check_interval or connection.is_alive()):
+                    connection.last_used = now
+                    with self._lock:
+                        self.hits += 1
+                    return connection.client
+                __logger__.debug("SSH pool: Discarding %s connection to %s@%s:%s",
+                                 "expired" if expired else "broken", user, host, port)
+                self._discard(key, connection)
+
+            client = self._connect(host, port, user, password, key_filename)
+            with self._lock:
+                self.misses += 1
+                self._connections[key] = _PooledConnection(client)
+                if self.evict_interval and self._evictor_stop is None:
+                    self._start_evictor()
+            return client
+
+    def _start_evictor(self):
+        """
+        Start the evictor thread (called with the pool lock held). It closes the idle connections every
+        'evict_interval' seconds and finishes when the pool has no connections.
+        :return: None
+        """
+
+        stop_event = self._evictor_stop = threading.Event()
+        _evicting_pools.add(self)
+        evictor = threading.Thread(target=self._evict_loop, args=[stop_event], name="SSHPoolEvictor")
+        evictor.daemon = True
+        evictor.start()
+
+    def _evict_loop(self, stop_event):
+        """
+        Evictor thread (see _start_evictor)
+        :param stop_event: threading.Event set to stop the thread
+        :return: None
+        """
+
+        while not stop_event.wait(self.evict_interval):
+            self.evict_idle()
+            with self._lock:
+                if not self._connections and self._evictor_stop is stop_event:
+                    self._evictor_stop = None
+                    return
+
+    def _stop_evictor(self):
+        """
+        Stop the evictor thread, if it is running
+        :return: None
+        """
+
+        with self._lock:
+            stop_event, self._evictor_stop = self._evictor_stop, None
+        if stop_event is not None:
+            stop_event.set()
+
+    def discard_client(self, host, user, client, key_filename=None, port=DEFAULT_SSH_PORT):
+        """
+        Remove a client from the pool and close it (e.g. when a channel can not be opened on it). The next
+        get_client call opens a new connection.
+        :param host (string): Hostname or IP
+        :param user (string): User name
+        :param client: paramiko.SSHClient returned by get_client
+        :param key_filename (string): SSH private key file
+        :param port (int): SSH port
+        :return: None
+        """
+
+        key = (host, port, user, key_filename)
+        with self._lock:
+            connection = self._connections.get(key)
+        if connection is not None and connection.client is client:
+            self._discard(key, connection)
+        else:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _discard(self, key, connection):
+        """
+        Remove the connection from the pool and close it
+        :param key (tuple): Pool key
+        :param connection: _PooledConnection
+        :return: None
+        """
+
+        with self._lock:
+            if self._connections.get(key) is connection:
+                del self._connections[key]
+                self.evictions += 1
+        try:
+            connection.client.close()
+        except Exception:
+            pass
+
+    def open_session(self, host, user, password=None, key_filename=None, port=DEFAULT_SSH_PORT):
+        """
+        Open a new channel on the pooled connection. If it can not be opened (broken transport), the connection is
+        discarded and the channel is opened on a new one.
+        :param host (string): Hostname or IP
+        :param user (string): User name
+        :param password (string): Password
+        :param key_filename (string): SSH private key file
+        :param port (int): SSH port
+        :return: paramiko.Channel. It should be closed after using it.
+        """
+
+        client = self.get_client(host, user, password, key_filename, port)
+        try:
+            return client.get_transport().open_session()
+        except Exception, e:
+            __logger__.debug("SSH pool: Can not open a channel to %s@%s:%s (%s). Reconnecting", user, host, port,
+                             str(e))
+            self.discard_client(host, user, client, key_filename, port)
+            client = self.get_client(host, user, password, key_filename, port)
+            return client.get_transport().open_session()
+
+    def execute(self, host, user, command, password=None, key_filename=None, port=DEFAULT_SSH_PORT, timeout=None):
+        """
+        Execute a command on a new channel of the pooled connection. stderr is combined with stdout.
+        :param host (string): Hostname or IP
+        :param user (string): User name
+        :param command (string): Command to be executed
+        :param password (string): Password
+        :param key_filename (string): SSH private key file
+        :param port (int): SSH port
+        :param timeout (float): Max time (seconds) without receiving output. None to wait forever.
+        :return (tuple): (output, exit code)
+        """
+
+        channel = self.open_session(host, user, password, key_filename, port)
+        try:
+            channel.settimeout(timeout)
+            channel.set_combine_stderr(True)
+            channel.exec_command(command)
+            output = list()
+            data = channel.recv(READ_BUFFER_SIZE)
+            while data:
+                output.append(data)
+                data = channel.recv(READ_BUFFER_SIZE)
+            return "".join(output), channel.recv_exit_status()
+        finally:
+            channel.close()
+
+    def open_sftp(self, host, user, password=None, key_filename=None, port=DEFAULT_SSH_PORT):
+        """
+        Open a SFTP session on the pooled connection
+        :return: paramiko.SFTPClient. It should be closed after using it.
+        """
+
+        return self.get_client(host, user, password, key_filename, port).open_sftp()
+
+    def evict_idle(self):
+        """
+        Close the connections not used for 'ttl' seconds. Called by the evictor thread; it can also be called
+        directly (e.g. when the evictor thread is disabled).
+        :return (int): Number of closed connections
+        """
+
+        now = time.time()
+        with self._lock:
+            expired = [(key, connection) for key, connection in self._connections.iteritems()
+                       if now - connection.last_used > self.ttl]
+        for key, connection in expired:
+            self._discard(key, connection)
+        return len(expired)
+
+    def close_all(self):
+        """
+        Close all the connections of the pool
+        :return: None
+        """
+
+        with self._lock:
+            connections = self._connections.items()
+        for key, connection in connections:
+            self._discard(key, connection)
+
+    def get_stats(self):
+        """
+        Get pool metrics
+        :return (dict): hits, misses, evictions, connect_errors, connections (currently open),
+        connect_time_total, connect_time_mean and connect_time_max (seconds)
+        """
+
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'connect_errors': self.connect_errors,
+                    'connections': len(self._connections),
+                    'connect_time_total': self.connect_time_total,
+                    'connect_time_mean': self.connect_time_total / self.misses if self.misses else 0.0,
+                    'connect_time_max': self.connect_time_max}
+
+
+def get_connection_pool():
+    """
+    Get the shared SSHConnectionPool. It is created on the first call.
+    :return: SSHConnectionPool
+    """
+
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = SSHConnectionPool()
+
+            from qautils.metrics.metrics_utils import get_metrics_registry
+            get_metrics_registry().register_collector("ssh_pool", _connection_pool.get_stats)
+    return _connection_pool
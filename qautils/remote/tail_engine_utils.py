@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+
+"""
+tail_engine_utils module contains an engine to follow many log files (local or remote) with only one thread:
+    - TailEngine: Event loop (select) that reads all the registered streams and pushes their lines to callbacks as
+      soon as they arrive. Streams are added and stopped one by one.
+    - RemoteTailStream: 'tail -F' of a remote file, over a new channel of a pooled SSH connection.
+    - LocalTailStream: 'tail -F' of a local file.
+    - get_tail_engine: Returns the shared TailEngine (created and started on first call).
+"""
+
+__author__ = "@jframos"
+__project__ = "python-qautils [https://github.com/qaenablers/python-qautils]"
+__copyright__ = "Copyright 2015"
+__license__ = " Apache License, Version 2.0"
+__version__ = "1.2.1"
+
+
+import os
+import errno
+import pipes
+import select
+import threading
+
+from qautils.logger.logger_utils import get_logger
+from qautils.remote.ssh_pool_utils import DEFAULT_SSH_PORT
+
+
+__logger__ = get_logger(__name__)
+
+READ_BUFFER_SIZE = 65536
+
+# Line printed by the tail command just before starting 'tail' (see _build_tail_command)
+READY_MARKER = "__QA_TAIL_READY__"
+
+# Shared engine (see get_tail_engine)
+_tail_engine = None
+_tail_engine_lock = threading.Lock()
+
+
+def _build_tail_command(path, from_start=False):
+    """
+    Build the 'tail' command that follows the file (also when it is rotated or does not exist yet).
+    The command prints READY_MARKER and its PID ('tail' replaces the shell, so it keeps the PID) once the starting
+    position is fixed: lines written after it are always read.
+    :param path (string): File path
+    :param from_start (bool): Read the whole file. By default, only the lines written after starting are read.
+    :return (string): Command
+    """
+
+    path = pipes.quote(path)
+    if from_start:
+        return "echo {} $$; exec tail -F -c +1 {}".format(READY_MARKER, path)
+    return "SIZE=$(wc -c < {path} 2>/dev/null || echo 0); echo {marker} $$; " \
+           "exec tail -F -c +$((SIZE + 1)) {path}".format(path=path, marker=READY_MARKER)
+
+
+def _build_kill_tail_command(pid):
+    """
+    Build the command that stops the remote 'tail' (only if the PID still belongs to a 'tail' process)
+    :param pid (int): PID printed by the tail command
+    :return (string): Command
+    """
+
+    return '[ "$(ps -o comm= -p {pid} 2>/dev/null)" = tail ] && kill {pid}; true'.format(pid=int(pid))
+
+
+class _TailStream(object):
+    """
+    Base class of the streams read by the TailEngine. Subclasses implement fileno, _read and _close.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.callback = None
+        self.close_callback = None
+        self.lines = 0
+        self.bytes = 0
+        self._partial_line = ""
+        self._engine = None
+        self._stop_requested = False
+        self._closed = threading.Event()
+        self._ready = threading.Event()
+
+    def _read(self):
+        """
+        Read the available data
+        :return (string): Data. Empty string when the stream has finished. None if there is no data yet.
+        """
+        raise NotImplementedError()
+
+    def _close(self):
+        raise NotImplementedError()
+
+    def _set_ready(self, pid):
+        """
+        Called when the 'tail' is running
+        :param pid (int): PID of the 'tail' process (None if unknown)
+        :return: None
+        """
+
+        self._ready.set()
+
+    def fileno(self):
+        raise NotImplementedError()
+
+    def _split_lines(self, data):
+        """
+        Split the data into complete lines. The last incomplete line is kept for the next read.
+        :param data (string): Data read. Empty string at the end of the stream (the incomplete line is returned).
+        :return (list): Lines (without line breaks)
+        """
+
+        if not data:
+            lines = [self._partial_line] if self._partial_line else []
+            self._partial_line = ""
+            return lines
+        lines = (self._partial_line + data).split("\n")
+        self._partial_line = lines.pop()
+        return lines
+
+    @property
+    def closed(self):
+        """
+        :return (bool): True if the stream is not being read anymore
+        """
+        return self._closed.is_set()
+
+    @property
+    def ready(self):
+        """
+        :return (bool): True if the 'tail' is running: all the lines written from now on will be read
+        """
+        return self._ready.is_set() and not self.closed
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until the 'tail' is running (the stream must have been added to a TailEngine)
+        :param timeout (float): Max time to wait (seconds). None to wait forever.
+        :return (bool): True if the stream is ready
+        """
+
+        self._ready.wait(timeout)
+        return self.ready
+
+    def stop(self, wait=True, timeout=None):
+        """
+        Stop reading this stream. Other streams of the engine are not affected.
+        :param wait (bool): Wait until the stream is closed (and its last lines are delivered)
+        :param timeout (float): Max time to wait (seconds). None to wait forever.
+        :return (bool): True if the stream is closed
+        """
+
+        self._stop_requested = True
+        if self._engine is not None:
+            self._engine._wake_up()
+        else:
+            self._closed.set()
+            self._ready.set()
+        if wait:
+            self._closed.wait(timeout)
+        return self.closed
+
+
+class RemoteTailStream(_TailStream):
+
+    def __init__(self, host, user, path, password=None, key_filename=None, port=DEFAULT_SSH_PORT, from_start=False,
+                 connection_pool=None):
+        """
+        Start a 'tail -F' of the remote file. The SSH connection is taken from the connection pool.
+        :param host (string): Hostname or IP
+        :param user (string): User name
+        :param path (string): Remote file path
+        :param password (string): Password
+        :param key_filename (string): SSH private key file
+        :param port (int): SSH port
+        :param from_start (bool): Read the whole file. By default, only the lines written after starting are read.
+        :param connection_pool: SSHConnectionPool. By default, the shared one.
+        :return: None
+        """
+
+        super(RemoteTailStream, self).__init__("{}@{}:{}".format(user, host, path))
+        if connection_pool is None:
+            from qautils.remote.ssh_pool_utils import get_connection_pool
+            connection_pool = get_connection_pool()
+
+        self.connection_pool = connection_pool
+        self._connection_data = (host, user, password, key_filename, port)
+        self.remote_pid = None
+        self.channel = connection_pool.open_session(host, user, password, key_filename, port)
+        self.channel.setblocking(0)
+        self.channel.exec_command(_build_tail_command(path, from_start))
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def _read(self):
+        if self.channel.recv_stderr_ready():
+            __logger__.debug("Tail engine: %s: %s", self.name, self.channel.recv_stderr(READ_BUFFER_SIZE).strip())
+        if self.channel.recv_ready():
+            return self.channel.recv(READ_BUFFER_SIZE)
+        if self.channel.exit_status_ready() or self.channel.closed or self.channel.eof_received:
+            return ""
+        return None
+
+    def _set_ready(self, pid):
+        self.remote_pid = pid
+        super(RemoteTailStream, self)._set_ready(pid)
+
+    def _close(self):
+        """
+        Close the channel and stop the remote 'tail'. Without a PTY, closing the channel does not stop it: it would
+        keep running until the file is written again (and it gets SIGPIPE).
+        """
+
+        tail_finished = self.channel.exit_status_ready()
+        self.channel.close()
+        if self.remote_pid is not None and not tail_finished:
+            host, user, password, key_filename, port = self._connection_data
+            self.connection_pool.execute(host, user, _build_kill_tail_command(self.remote_pid), password=password,
+                                         key_filename=key_filename, port=port)
+
+
+class LocalTailStream(_TailStream):
+
+    def __init__(self, path, from_start=False):
+        """
+        Start a 'tail -F' of the local file
+        :param path (string): File path
+        :param from_start (bool): Read the whole file. By default, only the lines written after starting are read.
+        :return: None
+        """
+
+        import subprocess
+
+        super(LocalTailStream, self).__init__(path)
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen(_build_tail_command(path, from_start), shell=True,
+                                            stdout=subprocess.PIPE, stderr=devnull, close_fds=True)
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def _read(self):
+        return os.read(self.fileno(), READ_BUFFER_SIZE)
+
+    def _close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class TailEngine(object):
+
+    def __init__(self):
+        """
+        Init the TailEngine. The engine thread is launched with 'start'.
+        :return: None
+        """
+
+        self._streams = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._wake_up_read, self._wake_up_write = os.pipe()
+
+    def _wake_up(self):
+        """
+        Interrupt the current 'select' of the engine thread, to process new and stopped streams
+        :return: None
+        """
+
+        try:
+            os.write(self._wake_up_write, "x")
+        except OSError:
+            pass
+
+    def start(self):
+        """
+        Launch the engine thread
+        :return: None
+        """
+
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="TailEngine")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop all the streams and the engine thread
+        :param timeout (float): Max time to wait for the engine thread (seconds). None to wait forever.
+        :return: None
+        """
+
+        with self._lock:
+            streams = self._streams.values()
+            for stream in streams:
+                stream._stop_requested = True
+            self._running = False
+        self._wake_up()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def add_stream(self, stream, callback, close_callback=None):
+        """
+        Start reading the stream
+        :param stream: RemoteTailStream or LocalTailStream
+        :param callback (function): Called from the engine thread with (stream, lines) each time new lines arrive.
+        Lines do not include the line break.
+        :param close_callback (function): Called from the engine thread with (stream) when the stream is closed
+        :return: The stream
+        """
+
+        stream.callback = callback
+        stream.close_callback = close_callback
+        stream._engine = self
+        with self._lock:
+            self._streams[stream.fileno()] = stream
+        self._wake_up()
+        self.start()
+        return stream
+
+    def get_stats(self):
+        """
+        Get engine metrics
+        :return (dict): streams (being read), ready_streams, lines and bytes (read by the streams being read)
+        """
+
+        streams = self.get_streams()
+        return {'streams': len(streams),
+                'ready_streams': len([stream for stream in streams if stream.ready]),
+                'lines': sum(stream.lines for stream in streams),
+                'bytes': sum(stream.bytes for stream in streams)}
+
+    def get_streams(self):
+        """
+        :return (list): Streams being read
+        """
+
+        with self._lock:
+            return self._streams.values()
+
+    def _deliver(self, stream, data):
+        """
+        Push the lines of the data read to the stream callback
+        :param stream: Stream
+        :param data (string): Data read (empty string at the end of the stream)
+        :return: None
+        """
+
+        stream.bytes += len(data)
+        lines = stream._split_lines(data)
+        if lines and not stream._ready.is_set():
+            for index, line in enumerate(lines):
+                fields = line.split()
+                if fields and fields[0] == READY_MARKER:
+                    del lines[index]
+                    __logger__.debug("Tail engine: Stream %s is ready", stream.name)
+                    stream._set_ready(int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else None)
+                    break
+        if lines:
+            stream.lines += len(lines)
+            try:
+                stream.callback(stream, lines)
+            except Exception, e:
+                __logger__.error("Tail engine: Error processing lines of %s: %s", stream.name, str(e))
+
+    def _close_stream(self, stream):
+        """
+        Close the stream, deliver its last incomplete line and remove it from the engine
+        :param stream: Stream
+        :return: None
+        """
+
+        with self._lock:
+            self._streams.pop(stream.fileno(), None)
+        self._deliver(stream, "")
+        try:
+            stream._close()
+        except Exception, e:
+            __logger__.debug("Tail engine: Error closing %s: %s", stream.name, str(e))
+        __logger__.debug("Tail engine: Stream %s closed (%d lines, %d bytes)", stream.name, stream.lines,
+                         stream.bytes)
+        if stream.close_callback is not None:
+            try:
+                stream.close_callback(stream)
+            except Exception, e:
+                __logger__.error("Tail engine: Error in close callback of %s: %s", stream.name, str(e))
+        stream._closed.set()
+        stream._ready.set()
+
+    def _read_stream(self, stream):
+        """
+        Read the available data of the stream. The stream is closed if it has finished.
+        :param stream: Stream
+        :return: None
+        """
+
+        try:
+            data = stream._read()
+        except (IOError, OSError), e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            __logger__.error("Tail engine: Error reading %s: %s", stream.name, str(e))
+            data = ""
+        if data is None:
+            return
+        if data:
+            self._deliver(stream, data)
+        else:
+            self._close_stream(stream)
+
+    def _run(self):
+        """
+        Engine loop: wait for data in any stream and push it to the callbacks
+        :return: None
+        """
+
+        __logger__.debug("Tail engine: Started")
+        while True:
+            with self._lock:
+                running = self._running
+                streams = self._streams.values()
+
+            # Stopped streams: read what is already available before closing them
+            for stream in [stream for stream in streams if stream._stop_requested]:
+                if select.select([stream], [], [], 0)[0]:
+                    self._read_stream(stream)
+                if not stream.closed:
+                    self._close_stream(stream)
+            if not running:
+                break
+
+            streams = [stream for stream in streams if not stream.closed]
+            try:
+                ready = select.select([self._wake_up_read] + streams, [], [])[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for ready_object in ready:
+                if ready_object == self._wake_up_read:
+                    os.read(self._wake_up_read, READ_BUFFER_SIZE)
+                elif not ready_object.closed:
+                    self._read_stream(ready_object)
+        __logger__.debug("Tail engine: Stopped")
+
+
+def get_tail_engine():
+    """
+    Get the shared TailEngine. It is created and started on the first call.
+    :return: TailEngine
+    """
+
+    global _tail_engine
+    with _tail_engine_lock:
+        if _tail_engine is None:
+            _tail_engine = TailEngine()
+            _tail_engine.start()
+
+            from qautils.metrics.metrics_utils import get_metrics_registry
+            get_metrics_registry().register_collector("tail_engine", _tail_engine.get_stats)
+    return _tail_engine